@@ -0,0 +1,17 @@
+"""
+ASGI config for backend project.
+
+It exposes the ASGI callable as a module-level variable named
+``application``, requests are handled in a bounded thread pool, see
+pugorugh.asgi.ThreadPoolASGIHandler.
+
+    uvicorn backend.asgi:application --workers 2
+"""
+
+import os
+
+from pugorugh.asgi import get_asgi_application
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "backend.settings")
+
+application = get_asgi_application()
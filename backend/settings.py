@@ -53,12 +53,14 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
 
+    'pugorugh.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'debug_toolbar.middleware.DebugToolbarMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'pugorugh.profiling.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     ]
@@ -83,6 +85,9 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'backend.wsgi.application'
 
+# worker threads of the ASGI entry point, see backend/asgi.py
+PUGORUGH_ASGI_THREADS = int(os.environ.get('ASGI_THREADS', 8))
+
 
 # Database
 # https://docs.djangoproject.com/en/1.9/ref/settings/#databases
@@ -94,6 +99,25 @@ DATABASES = {
     }
 }
 
+# routes read only views to PUGORUGH_READ_REPLICA and UserDog rows to
+# PUGORUGH_USERDOG_SHARDS, a no-op while both are unset, see
+# pugorugh.routers and backend/settings_sharded.py
+DATABASE_ROUTERS = ['pugorugh.routers.PugorughRouter']
+PUGORUGH_READ_REPLICA = None
+PUGORUGH_USERDOG_SHARDS = []
+
+# PRAGMAs run on every new SQLite connection, see
+# backend/settings_production.py for the concurrent worker profile
+PUGORUGH_SQLITE_PRAGMAS = {}
+
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'pugorugh',
+    }
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/1.9/ref/settings/#auth-password-validators
@@ -119,12 +143,77 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.IsAuthenticated',
     ),
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
+        'pugorugh.authentication.CachedTokenAuthentication',
         # 'rest_framework.authentication.BasicAuthentication',
         # 'rest_framework.authentication.SessionAuthentication',
     )
 }
 
+# Pug or Ugh
+# when True UserDog rows are not fanned out on registration, a missing row
+# means undecided and rows are only written on like/dislike. off by default:
+# lazy mode also turns off the fan out of new dogs, and switching an
+# existing database back to eager mode needs `python manage.py fanout_dogs`
+PUGORUGH_LAZY_USERDOGS = False
+
+# cache per user queues of matching dog ids, see pugorugh.candidates. the
+# queues and the catalog version live in PUGORUGH_CANDIDATE_CACHE, which must
+# be shared by every worker process (memcached, redis), the locmem default
+# only suits a single process. `manage.py check` warns otherwise
+PUGORUGH_CANDIDATE_QUEUE = False
+PUGORUGH_CANDIDATE_CACHE = 'default'
+PUGORUGH_CANDIDATE_TIMEOUT = 300
+
+# share the matching dog ids of each preference signature between users,
+# a process local LRU bounded by sets and total ids, see
+# pugorugh.candidates.CandidateSets. needs a shared PUGORUGH_CANDIDATE_CACHE
+# with several workers, `manage.py check` warns otherwise
+PUGORUGH_CANDIDATE_SETS = False
+PUGORUGH_CANDIDATE_SETS_SIZE = 4096
+PUGORUGH_CANDIDATE_SETS_MAX_IDS = 2000000
+PUGORUGH_CANDIDATE_SETS_TTL = 300
+
+# hold the dog catalog as NumPy arrays and match preferences in process,
+# requires numpy, see pugorugh.catalog.DogCatalog. without a shared
+# PUGORUGH_CANDIDATE_CACHE other processes reload it after MAX_AGE seconds
+PUGORUGH_COLUMNAR_CATALOG = False
+PUGORUGH_COLUMNAR_CATALOG_MAX_AGE = 60
+
+# rendered dog payloads by dog id and version, a process local LRU, see
+# pugorugh.fragments.DogFragments. dogs are only served without reading
+# them when PUGORUGH_CANDIDATE_CACHE is shared between workers
+PUGORUGH_DOG_FRAGMENTS = False
+PUGORUGH_DOG_FRAGMENTS_SIZE = 10000
+
+# resolved auth tokens, see pugorugh.authentication.TokenCache. without a
+# shared cache other workers accept a revoked token for up to the TTL
+PUGORUGH_TOKEN_CACHE_SIZE = 10000
+PUGORUGH_TOKEN_CACHE_TTL = 30
+PUGORUGH_TOKEN_SHARED_CACHE = None
+
+# per view request, latency and SQL metrics served as Prometheus text at
+# /metrics/ to INTERNAL_IPS, see pugorugh.metrics. with several worker
+# processes point PUGORUGH_METRICS_DIR at a directory shared by them
+PUGORUGH_METRICS = True
+PUGORUGH_METRICS_DIR = os.environ.get('PUGORUGH_METRICS_DIR')
+PUGORUGH_METRICS_FLUSH_INTERVAL = 5
+PUGORUGH_METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+                            2.5, 5.0)
+
+# cProfile a sample of requests, or requests with an X-Profile header from
+# a staff user listed in PUGORUGH_PROFILE_USERS, see pugorugh.profiling.
+# `python manage.py profile_report` renders the call graphs
+PUGORUGH_PROFILING = False
+PUGORUGH_PROFILE_SAMPLE_RATE = 0.0
+PUGORUGH_PROFILE_HEADER = 'HTTP_X_PROFILE'
+PUGORUGH_PROFILE_USERS = []
+PUGORUGH_PROFILE_DIR = os.path.join(BASE_DIR, 'profiles')
+PUGORUGH_PROFILE_KEEP = 50
+
+# build resized image derivatives when dogs are ingested, requires Pillow,
+# `python manage.py build_dog_images` builds them for the whole catalog
+PUGORUGH_IMAGE_DERIVATIVES_ON_INGEST = False
+
 DEBUG_TOOLBAR_PANELS = [
 
     'ddt_request_history.panels.request_history.RequestHistoryPanel',
@@ -160,3 +249,12 @@ STATIC_URL = '/static/'
 STATICFILES_DIRS = (
     os.path.join(os.path.dirname(__file__), '../pugorugh/static/'),
     )
+
+# collectstatic writes content hashed, precompressed copies here
+STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
+
+STATICFILES_STORAGE = 'pugorugh.assets.CompressedManifestStaticFilesStorage'
+
+# serve STATIC_ROOT from Django with immutable caching headers, for
+# deployments without a web server in front of the app
+PUGORUGH_SERVE_STATIC = False
@@ -0,0 +1,36 @@
+"""
+Database profile for serving with several concurrent worker processes.
+
+SQLite runs in WAL mode so readers never block the writer and commits only
+append to the log, synchronous=NORMAL skips the fsync per commit (a power
+loss may drop the last commits but never corrupts the file), writers
+wait up to busy_timeout for the lock instead of failing with "database is
+locked", and the page cache and memory map are sized for the catalog.
+connections persist across requests, so the pragmas run once per worker
+connection.
+
+    gunicorn backend.wsgi --workers 4 \\
+        --env DJANGO_SETTINGS_MODULE=backend.settings_production
+
+    python pugorugh/scripts/sqlite_write_bench.py --workers 4
+"""
+from .settings import *  # noqa: F401,F403
+from .settings import DATABASES
+
+DATABASES = dict(DATABASES)
+DATABASES['default'] = dict(
+    DATABASES['default'],
+    CONN_MAX_AGE=600,
+    # seconds the sqlite3 module waits for a lock, matches busy_timeout
+    OPTIONS={'timeout': 5},
+)
+
+PUGORUGH_SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    # negative sizes are KiB: a 64 MiB page cache per connection
+    'cache_size': -65536,
+    'mmap_size': 268435456,
+    'temp_store': 'MEMORY',
+}
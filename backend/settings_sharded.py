@@ -0,0 +1,47 @@
+"""
+Settings spreading UserDog over several SQLite files.
+
+UserDog rows are sharded by user id over two databases next to the default
+one and read only views read from a replica alias. locally the replica is
+the default file, in tests it mirrors the default test database.
+
+    python manage.py migrate --settings=backend.settings_sharded
+    python manage.py migrate --database=userdogs_0 \\
+        --settings=backend.settings_sharded
+    python manage.py migrate --database=userdogs_1 \\
+        --settings=backend.settings_sharded
+
+the multi database tests run with these settings, the rest of the suite
+assumes a single database:
+
+    python manage.py test --settings=backend.settings_sharded \\
+        pugorugh.tests.TestPugorughRouter pugorugh.tests.TestShardedUserDog \\
+        pugorugh.tests.TestReplicaReads
+"""
+import os
+
+from .settings import *  # noqa: F401,F403
+from .settings import BASE_DIR, DATABASES
+
+DATABASES = dict(DATABASES)
+DATABASES.update({
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'TEST': {'MIRROR': 'default'},
+    },
+    'userdogs_0': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'db_userdogs_0.sqlite3'),
+    },
+    'userdogs_1': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'db_userdogs_1.sqlite3'),
+    },
+})
+
+PUGORUGH_READ_REPLICA = 'replica'
+PUGORUGH_USERDOG_SHARDS = ['userdogs_0', 'userdogs_1']
+
+# eager fan out joins users, dogs and UserDog in one database
+PUGORUGH_LAZY_USERDOGS = True
@@ -5,4 +5,7 @@ class PugorughConfig(AppConfig):
     name = 'pugorugh'
 
     def ready(self):
+        import pugorugh.checks
         import pugorugh.signals
+        from pugorugh.catalog import dog_catalog
+        dog_catalog.preload()
@@ -0,0 +1,60 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import django
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.db import close_old_connections
+
+
+class ThreadPoolASGIHandler(ASGIHandler):
+    """
+    ASGI handler running the synchronous view stack in a bounded thread pool
+
+    the event loop only parses requests and streams responses, each
+    request's middleware, view and ORM work runs in one of
+    settings.PUGORUGH_ASGI_THREADS worker threads, so a slow client holds
+    a coroutine instead of a worker while its request or response is in
+    flight. every worker thread keeps its own database connections, they
+    are recycled per settings.CONN_MAX_AGE around each request.
+
+    subclasses django.core.handlers.asgi.ASGIHandler
+
+    Attr:
+        executor
+            the ThreadPoolExecutor requests are handled in
+
+    method overrides:
+        get_response
+    """
+
+    def __init__(self, max_workers=None):
+        super().__init__()
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers or getattr(
+                settings, 'PUGORUGH_ASGI_THREADS', 8),
+            thread_name_prefix='pugorugh-asgi')
+
+    async def get_response(self, request):
+        """awaits the response handled in the worker pool"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor, self.handle_request, request)
+
+    def handle_request(self, request):
+        """handles request synchronously in a worker thread"""
+        close_old_connections()
+        try:
+            return super().get_response(request)
+        finally:
+            close_old_connections()
+
+
+def get_asgi_application():
+    """
+    returns the ASGI callable, the counterpart of get_wsgi_application
+
+    :rtype: ThreadPoolASGIHandler
+    """
+    django.setup(set_prefix=False)
+    return ThreadPoolASGIHandler()
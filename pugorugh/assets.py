@@ -0,0 +1,138 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+from functools import lru_cache
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import (
+    ManifestStaticFilesStorage, staticfiles_storage,
+    )
+from django.http import FileResponse, Http404
+from django.utils._os import safe_join
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:  # brotli variants are optional, gzip is always built
+    brotli = None
+
+COMPRESSIBLE = ('.css', '.js', '.json', '.svg', '.html', '.txt', '.map')
+# encoding, file suffix, in order of preference
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """
+    content hashed static files with precompressed gzip/brotli copies
+
+    subclasses django.contrib.staticfiles.storage.ManifestStaticFilesStorage
+    so collectstatic writes `name.<hash>.ext` copies and a manifest the
+    {% static %} tag and static_url() resolve through. compressible files
+    additionally get `.gz` (and with the brotli package `.br`) siblings
+    that serve() hands to clients accepting those encodings.
+
+    Attr overrides:
+        manifest_strict
+            files missing from the manifest, e.g. image derivatives built
+            after collectstatic, resolve to their unhashed name
+
+    method overrides:
+        post_process
+    """
+    manifest_strict = False
+
+    def post_process(self, *args, **kwargs):
+        yield from super().post_process(*args, **kwargs)
+        # compress the final names only, intermediate passes are discarded
+        for name, hashed_name in self.hashed_files.items():
+            for path in (name, hashed_name):
+                if path.endswith(COMPRESSIBLE) and self.exists(path):
+                    self.compress(path)
+
+    def compress(self, name):
+        """writes .gz and .br copies of name when they are smaller"""
+        path = self.path(name)
+        with open(path, 'rb') as source:
+            content = source.read()
+        variants = {'.gz': gzip.compress(content, 9, mtime=0)}
+        if brotli is not None:
+            variants['.br'] = brotli.compress(content)
+        for suffix, compressed in variants.items():
+            if len(compressed) < len(content):
+                with open(path + suffix, 'wb') as target:
+                    target.write(compressed)
+
+
+@lru_cache(maxsize=4096)
+def static_url(path):
+    """
+    returns the content hashed URL of a static file path
+
+    falls back to the plain STATIC_URL path when the file is not known to
+    the storage, e.g. before collectstatic has run
+
+    :rtype: str
+    """
+    try:
+        return staticfiles_storage.url(path)
+    except ValueError:
+        return settings.STATIC_URL + path
+
+
+@lru_cache(maxsize=1)
+def hashed_names():
+    """returns the content hashed names listed in the manifest"""
+    return frozenset(
+        getattr(staticfiles_storage, 'hashed_files', {}).values())
+
+
+@lru_cache(maxsize=1)
+def manifest_version():
+    """
+    returns a short digest of the hashed names in the manifest
+
+    it changes whenever collectstatic hashed a changed file, e.g. a dog
+    image, so it is part of ETags of payloads holding static URLs
+
+    :rtype: str
+    """
+    digest = hashlib.sha1('\n'.join(sorted(hashed_names())).encode('utf-8'))
+    return digest.hexdigest()[:8]
+
+
+def serve(request, path):
+    """
+    serves a collected static file with long lived caching headers
+
+    content hashed files are sent with an immutable one year
+    Cache-Control, other files with a short max-age. a precompressed
+    .br/.gz sibling is sent when the client accepts its encoding.
+    mounted at STATIC_URL when settings.PUGORUGH_SERVE_STATIC is on
+    """
+    try:
+        full_path = safe_join(settings.STATIC_ROOT, path)
+    except ValueError:
+        raise Http404
+    if not os.path.isfile(full_path):
+        raise Http404
+
+    accepted = request.META.get('HTTP_ACCEPT_ENCODING', '')
+    content_type, _ = mimetypes.guess_type(full_path)
+    encoding = None
+    for name, suffix in ENCODINGS:
+        if name in accepted and os.path.isfile(full_path + suffix):
+            full_path, encoding = full_path + suffix, name
+            break
+
+    response = FileResponse(open(full_path, 'rb'),
+                            content_type=content_type or
+                            'application/octet-stream')
+    if encoding:
+        response['Content-Encoding'] = encoding
+    if path.endswith(COMPRESSIBLE):
+        patch_vary_headers(response, ('Accept-Encoding',))
+    response['Cache-Control'] = (IMMUTABLE if path in hashed_names()
+                                 else 'public, max-age=60')
+    return response
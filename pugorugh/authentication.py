@@ -0,0 +1,208 @@
+import copy
+import time
+from collections import OrderedDict
+from threading import Lock
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.authentication import TokenAuthentication
+
+
+class TokenCache:
+    """
+    class encapsulates a bounded, TTL'd LRU of resolved auth tokens
+
+    maps token keys to (user, token) pairs for at most
+    settings.PUGORUGH_TOKEN_CACHE_SIZE entries, each valid for
+    settings.PUGORUGH_TOKEN_CACHE_TTL seconds. when
+    settings.PUGORUGH_TOKEN_SHARED_CACHE names a Django cache, local misses
+    are looked up there before falling back to the database, so workers
+    share resolved tokens.
+
+    entries are evicted through signals when a token is deleted or its
+    user is saved (e.g. deactivated), see pugorugh.signals, which also
+    bump a per user version in the shared cache. a local hit is only
+    answered while that version is unchanged, so other processes reject a
+    revoked token on its next use. without a shared cache other processes
+    drop their local copy only when its TTL expires, keep
+    PUGORUGH_TOKEN_CACHE_TTL short then.
+
+    attributes:
+        KEY_PREFIX
+            prefix of shared cache keys
+        USER_VERSION_PREFIX
+            prefix of the shared per user version keys
+        counters
+            hits, misses and evictions since start
+
+    methods:
+        get, set, user_version, revoke_user, evict, evict_user, clear,
+        stats
+    """
+    KEY_PREFIX = 'pugorugh:token'
+    USER_VERSION_PREFIX = 'pugorugh:token-user'
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._users = {}
+        self._lock = Lock()
+        self.counters = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    @staticmethod
+    def maxsize():
+        return getattr(settings, 'PUGORUGH_TOKEN_CACHE_SIZE', 10000)
+
+    @staticmethod
+    def ttl():
+        return getattr(settings, 'PUGORUGH_TOKEN_CACHE_TTL', 30)
+
+    @staticmethod
+    def shared():
+        alias = getattr(settings, 'PUGORUGH_TOKEN_SHARED_CACHE', None)
+        return caches[alias] if alias else None
+
+    def get(self, key):
+        """
+        returns the cached (user, token) pair of key or None
+
+        with a shared cache a local entry is checked against the version
+        of its user there, one cache read instead of a database query
+        """
+        now = time.monotonic()
+        shared = self.shared()
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None:
+            expires, pair, version = entry
+            if expires > now and (shared is None or version == self.
+                                  user_version(pair[0].pk)):
+                with self._lock:
+                    if key in self._entries:
+                        self._entries.move_to_end(key)
+                    self.counters['hits'] += 1
+                return pair
+            with self._lock:
+                if self._entries.get(key) is entry:
+                    self._remove(key)
+
+        pair = shared.get(self.KEY_PREFIX + key) if shared else None
+        if pair is not None:
+            self._store(key, pair, self.user_version(pair[0].pk))
+            with self._lock:
+                self.counters['hits'] += 1
+            return pair
+
+        with self._lock:
+            self.counters['misses'] += 1
+        return None
+
+    def set(self, key, pair):
+        """caches the (user, token) pair resolved for key"""
+        shared = self.shared()
+        self._store(key, pair,
+                    self.user_version(pair[0].pk) if shared else 0)
+        if shared:
+            shared.set(self.KEY_PREFIX + key, pair, self.ttl())
+
+    def user_version(self, user_id):
+        """returns the shared revocation version of user_id, 0 if unset"""
+        return self.shared().get(
+            '{}{}'.format(self.USER_VERSION_PREFIX, user_id), 0)
+
+    def revoke_user(self, user_id):
+        """bumps the shared version of user_id, other processes drop the
+        user's local entries on their next use"""
+        shared = self.shared()
+        if shared is None:
+            return
+        version_key = '{}{}'.format(self.USER_VERSION_PREFIX, user_id)
+        try:
+            shared.incr(version_key)
+        except ValueError:
+            shared.set(version_key, 1, None)
+
+    def _store(self, key, pair, version):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl(), pair,
+                                  version)
+            self._users.setdefault(pair[0].pk, set()).add(key)
+            while len(self._entries) > self.maxsize():
+                self._remove(next(iter(self._entries)))
+                self.counters['evictions'] += 1
+
+    def _remove(self, key):
+        _, (user, _), _ = self._entries.pop(key)
+        keys = self._users.get(user.pk)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._users[user.pk]
+
+    def evict(self, key, user_id=None):
+        """
+        drops key from the local and shared cache, revoking the local
+        copies of other processes when the user_id of key is given
+        """
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+        shared = self.shared()
+        if shared:
+            shared.delete(self.KEY_PREFIX + key)
+        if user_id is not None:
+            self.revoke_user(user_id)
+
+    def evict_user(self, user_id, keys=()):
+        """drops every cached token of user_id and the given keys"""
+        with self._lock:
+            keys = set(keys) | self._users.get(user_id, set())
+        for key in keys:
+            self.evict(key)
+        self.revoke_user(user_id)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._users.clear()
+
+    def stats(self):
+        """
+        returns hits, misses, evictions, size and hit ratio
+
+        :rtype: dict
+        """
+        with self._lock:
+            stats = dict(self.counters, size=len(self._entries))
+        total = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = stats['hits'] / total if total else 0.0
+        return stats
+
+
+token_cache = TokenCache()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Token authentication resolving keys through the process wide TokenCache.
+
+    subclasses rest_framework.authentication.TokenAuthentication, only
+    successful lookups are cached so invalid and inactive tokens keep
+    failing through the parent class
+
+    method overrides:
+        authenticate_credentials
+
+    See `DRF_TokenAuthentication <https://www.django-rest-framework.org/
+    api-guide/authentication/#tokenauthentication>`_ for info
+    """
+
+    def authenticate_credentials(self, key):
+        """returns a (user, token) pair, from the cache when possible"""
+        pair = token_cache.get(key)
+        if pair is None:
+            pair = super().authenticate_credentials(key)
+            token_cache.set(key, pair)
+        # requests get their own copy of the cached user
+        return copy.copy(pair[0]), pair[1]
@@ -0,0 +1,243 @@
+import json
+import random
+import subprocess
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+
+from .authentication import token_cache
+from .candidates import CandidateQueue, candidate_sets
+from .catalog import dog_catalog
+from .fragments import dog_fragments
+from .models import Dog
+from .signals import dogs_created
+
+ENDPOINTS = ('register', 'login', 'preferences', 'next', 'status')
+PERCENTILES = (('p50', 0.50), ('p95', 0.95), ('p99', 0.99))
+
+AGES = range(1, 180)
+GENDERS = ('m', 'f', 'u')
+SIZES = ('s', 'm', 'l', 'xl', 'u')
+AGE_GROUPS = ('b', 'y', 'a', 's')
+
+
+def percentile(values, fraction):
+    """returns the nearest rank percentile of the sorted values"""
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, int(round(fraction * (len(values) - 1))))
+    return values[index]
+
+
+def summarize(latencies, queries):
+    """
+    returns the statistics of one endpoint
+
+    :argument latencies: seconds of every request
+    :argument queries: SQL statements of every request
+    :rtype: dict of requests, rps, mean, p50, p95, p99 (milliseconds) and
+        queries per request
+    """
+    latencies = sorted(latencies)
+    total = sum(latencies)
+    stats = {
+        'requests': len(latencies),
+        'rps': len(latencies) / total if total else 0.0,
+        'mean': total / len(latencies) * 1000 if latencies else 0.0,
+        }
+    for name, fraction in PERCENTILES:
+        stats[name] = percentile(latencies, fraction) * 1000
+    stats['queries'] = sum(queries) / len(queries) if queries else 0.0
+    return stats
+
+
+def git_revision():
+    """returns the checked out commit or None outside a git work tree"""
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            check=True).stdout.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class SwipeBenchmark:
+    """
+    class encapsulates a replay of swipe sessions against the API
+
+    seeds `dogs` random dogs, then every one of `users` sessions registers
+    through the API, logs in, sets random preferences and swipes: it asks
+    for the next undecided dog and likes or dislikes it, up to `swipes`
+    times or until no dog is left. requests go through django.test.Client,
+    the full middleware and view stack without a network, in the database
+    currently configured, see the benchmark_swipes command for an
+    isolated one.
+
+    latency and SQL statements (over every database alias) are recorded
+    per endpoint, counting queries turns on the debug cursor, which adds
+    a little overhead to every request.
+
+    attributes:
+        dogs, users, swipes, like_ratio
+            size of the workload
+        seed
+            seed of the random workload, equal seeds replay equal sessions
+        latencies, queries
+            {endpoint: [seconds]} and {endpoint: [statements]} recorded
+
+    methods:
+        seed_dogs, reset_caches, request, session, run, results
+    """
+
+    def __init__(self, dogs=1000, users=20, swipes=50, like_ratio=0.3,
+                 seed=0):
+        self.dogs = dogs
+        self.users = users
+        self.swipes = swipes
+        self.like_ratio = like_ratio
+        self.seed = seed
+        self.random = random.Random(seed)
+        self.latencies = {endpoint: [] for endpoint in ENDPOINTS}
+        self.queries = {endpoint: [] for endpoint in ENDPOINTS}
+        self.elapsed = 0.0
+
+    def seed_dogs(self):
+        """bulk creates the random catalog"""
+        dogs = Dog.objects.bulk_create(
+            Dog(name='bench dog {}'.format(index),
+                image_filename='{}.jpg'.format(index),
+                breed='bench', age=self.random.choice(AGES),
+                gender=self.random.choice(GENDERS),
+                size=self.random.choice(SIZES))
+            for index in range(self.dogs))
+        dogs_created.send(sender=Dog, dog_ids=[dog.pk for dog in dogs])
+
+    @staticmethod
+    def reset_caches():
+        """empties the shared and process local caches"""
+        CandidateQueue.cache().clear()
+        token_cache.clear()
+        candidate_sets.clear()
+        dog_catalog.invalidate()
+        dog_fragments.clear()
+
+    def request(self, client, endpoint, method, path, data=None, **extra):
+        """
+        sends one request and records its latency and SQL statements
+
+        :rtype: django.http.HttpResponse
+        """
+        send = getattr(client, method)
+        with ExitStack() as stack:
+            captures = [stack.enter_context(CaptureQueriesContext(
+                connections[alias])) for alias in connections]
+            started = time.perf_counter()
+            if data is None:
+                response = send(path, **extra)
+            else:
+                response = send(path, data, content_type='application/json',
+                                **extra)
+            latency = time.perf_counter() - started
+        self.latencies[endpoint].append(latency)
+        self.queries[endpoint].append(
+            sum(len(capture) for capture in captures))
+        return response
+
+    def session(self, index):
+        """replays the session of one new user"""
+        client = Client()
+        credentials = json.dumps({'username': 'bench{}_{}'.format(
+            self.seed, index), 'password': 'bench password'})
+        self.request(client, 'register', 'post', '/api/user/', credentials)
+        response = self.request(client, 'login', 'post', '/api/user/login/',
+                                credentials)
+        auth = {'HTTP_AUTHORIZATION': 'Token {}'.format(
+            response.json()['token'])}
+
+        preference = {
+            field: ','.join(self.random.sample(
+                codes, self.random.randint(1, len(codes))))
+            for field, codes in (('age', AGE_GROUPS), ('gender', GENDERS),
+                                 ('size', SIZES))}
+        self.request(client, 'preferences', 'put', '/api/user/preferences/',
+                     json.dumps(preference), **auth)
+
+        pk = -1
+        for _ in range(self.swipes):
+            response = self.request(
+                client, 'next', 'get',
+                '/api/dog/{}/undecided/next/'.format(pk), **auth)
+            if response.status_code != 200:
+                break
+            pk = response.json()['id']
+            status = ('liked' if self.random.random() < self.like_ratio
+                      else 'disliked')
+            self.request(client, 'status', 'put',
+                         '/api/dog/{}/{}/'.format(pk, status), '{}', **auth)
+
+    def run(self, seed_dogs=True):
+        """
+        runs every session
+
+        :argument seed_dogs: False benchmarks the dogs already stored
+        :rtype: dict, see results
+        """
+        if seed_dogs:
+            self.seed_dogs()
+        self.reset_caches()
+        started = time.perf_counter()
+        for index in range(self.users):
+            self.session(index)
+        self.elapsed = time.perf_counter() - started
+        return self.results()
+
+    def results(self):
+        """
+        returns the workload, per endpoint statistics and totals
+
+        :rtype: dict, JSON serializable
+        """
+        latencies = [latency for values in self.latencies.values()
+                     for latency in values]
+        queries = [count for values in self.queries.values()
+                   for count in values]
+        total = summarize(latencies, queries)
+        total['rps'] = len(latencies) / self.elapsed if self.elapsed else 0.0
+        return {
+            'revision': git_revision(),
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'workload': {'dogs': self.dogs, 'users': self.users,
+                         'swipes': self.swipes, 'like_ratio': self.like_ratio,
+                         'seed': self.seed},
+            'endpoints': {endpoint: summarize(self.latencies[endpoint],
+                                              self.queries[endpoint])
+                          for endpoint in ENDPOINTS},
+            'total': total,
+            }
+
+
+def compare(baseline, results):
+    """
+    returns {endpoint: {stat: relative change}} of results to baseline
+
+    positive changes are regressions for latencies and queries and
+    improvements for rps
+    """
+    changes = {}
+    rows = dict(results['endpoints'], total=results['total'])
+    previous_rows = dict(baseline.get('endpoints', {}),
+                         total=baseline.get('total'))
+    for endpoint, stats in rows.items():
+        previous = previous_rows.get(endpoint)
+        if not previous:
+            continue
+        changes[endpoint] = {
+            stat: (stats[stat] - previous[stat]) / previous[stat]
+            for stat in ('rps', 'p95', 'p99', 'queries')
+            if previous.get(stat)}
+    return changes
@@ -0,0 +1,449 @@
+import time
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from collections import OrderedDict
+from threading import Lock
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .converter import StatusConverter
+from .models import Dog, UserDog
+
+STATUSES = ('liked', 'disliked', 'undecided')
+
+# cache backends holding a separate copy per process
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+    )
+
+# dog ids read per statement when matching a user's status rows against
+# candidates, well below the bound parameters SQLite allows
+STATUS_WINDOW = 500
+
+
+def first_after(ids, pk):
+    """returns the first id of the sorted ids greater than pk or None"""
+    index = bisect_right(ids, pk)
+    if index < len(ids):
+        return ids[index]
+    return None
+
+
+def contains(ids, pk):
+    """True when pk is in the sorted sequence ids"""
+    index = bisect_left(ids, pk)
+    return index < len(ids) and ids[index] == pk
+
+
+def iter_with_status(user_id, status, pk, window, matching,
+                     reverse=False):
+    """
+    yields the candidate ids following pk with the user's status in order
+
+    no statement reads more than STATUS_WINDOW ids. in UserDog.lazy_mode()
+    undecided candidates are walked window by window and the user's
+    decided rows of each window looked up, otherwise the user's rows with
+    status are walked in dog id order and the candidates among them
+    yielded. usually the first window answers
+
+    :argument pk: id to start after, None to start with the first id
+    :argument window: callable(after) returning up to STATUS_WINDOW
+        candidate ids following after (None for the first ones) in order
+    :argument matching: callable(ids) returning the set of ids that are
+        candidates
+    :argument reverse: walk ids downwards from pk
+    """
+    rows = UserDog.objects.for_user(user_id).filter(user_id=user_id)
+    if status == 'undecided' and UserDog.lazy_mode():
+        ids = window(pk)
+        while ids:
+            decided = set(rows.filter(dog_id__in=ids).exclude(
+                status=UserDog.UNDECIDED).values_list('dog_id', flat=True))
+            for dog_id in ids:
+                if dog_id not in decided:
+                    yield dog_id
+            ids = window(ids[-1])
+        return
+
+    rows = rows.filter(status=StatusConverter.STATUSES[status]).order_by(
+        '-dog_id' if reverse else 'dog_id').values_list('dog_id', flat=True)
+    while True:
+        page = rows
+        if pk is not None:
+            page = rows.filter(**{'dog_id__lt' if reverse else 'dog_id__gt':
+                                  pk})
+        ids = list(page[:STATUS_WINDOW])
+        if not ids:
+            return
+        found = matching(ids)
+        for dog_id in ids:
+            if dog_id in found:
+                yield dog_id
+        if len(ids) < STATUS_WINDOW:
+            return
+        pk = ids[-1]
+
+
+def next_with_status(user_id, status, pk, window, matching):
+    """
+    returns the first candidate id greater than pk with the user's status
+    or None, see iter_with_status
+
+    :rtype: int
+    """
+    return next(iter_with_status(user_id, status, pk, window, matching),
+                None)
+
+
+class CandidateQueue:
+    """
+    class encapsulates a per user, per status queue of candidate dog ids
+
+    the ordered ids of every dog matching a user's preferences and status
+    are cached in the Django cache named by settings.PUGORUGH_CANDIDATE_CACHE
+    so the `next` dog is a binary search instead of a filtered join.
+
+    queues are patched when a status changes (move), dropped when the
+    user's preferences change (invalidate_user) and all rebuilt when the
+    catalog changes (invalidate_catalog bumps a version in the cache key).
+    with several worker processes the cache must be shared between them
+    (e.g. memcached or redis, see shared), otherwise a worker keeps
+    serving dogs the user decided in another one until its queue expires
+
+    attributes:
+        KEY_PREFIX
+            prefix of every cache key
+        CATALOG_VERSION_KEY
+            cache key of the catalog version
+        counters
+            process local hit/miss counters, see stats()
+
+    methods:
+        enabled, shared, ids, next_after, move, invalidate_user,
+        invalidate_catalog, stats
+    """
+    KEY_PREFIX = 'pugorugh:queue'
+    CATALOG_VERSION_KEY = 'pugorugh:catalog-version'
+
+    counters = {'hits': 0, 'misses': 0}
+    _lock = Lock()
+
+    def __init__(self, user_id, status):
+        self.user_id = user_id
+        self.status = status
+        self._ids = None
+
+    @staticmethod
+    def enabled():
+        """True when settings.PUGORUGH_CANDIDATE_QUEUE is on"""
+        return getattr(settings, 'PUGORUGH_CANDIDATE_QUEUE', False)
+
+    @staticmethod
+    def cache_alias():
+        return getattr(settings, 'PUGORUGH_CANDIDATE_CACHE', 'default')
+
+    @classmethod
+    def cache(cls):
+        return caches[cls.cache_alias()]
+
+    @classmethod
+    def shared(cls):
+        """
+        True when the candidate cache, which holds the catalog version, is
+        shared between processes
+        """
+        return settings.CACHES[cls.cache_alias()]['BACKEND'] \
+            not in PROCESS_LOCAL_CACHES
+
+    @classmethod
+    def timeout(cls):
+        return getattr(settings, 'PUGORUGH_CANDIDATE_TIMEOUT', 300)
+
+    @classmethod
+    def catalog_version(cls):
+        version = cls.cache().get(cls.CATALOG_VERSION_KEY)
+        if version is None:
+            cls.cache().add(cls.CATALOG_VERSION_KEY, 1, timeout=None)
+            version = cls.cache().get(cls.CATALOG_VERSION_KEY, 1)
+        return version
+
+    @classmethod
+    def keys(cls, user_id, statuses=STATUSES):
+        """returns {status: cache key} for the current catalog version"""
+        version = cls.catalog_version()
+        return {status: '{}:{}:{}:{}'.format(
+            cls.KEY_PREFIX, version, user_id, status) for status in statuses}
+
+    @classmethod
+    def _count(cls, counter):
+        with cls._lock:
+            cls.counters[counter] += 1
+
+    def ids(self, build):
+        """
+        returns the ordered candidate dog ids, building them on a miss
+
+        :argument build: callable returning the ordered candidate ids
+        :rtype: list
+        """
+        if self._ids is not None:
+            return self._ids
+        key = self.keys(self.user_id, [self.status])[self.status]
+        ids = self.cache().get(key)
+        if ids is None:
+            self._count('misses')
+            ids = list(build())
+            self.cache().set(key, ids, self.timeout())
+        else:
+            self._count('hits')
+        self._ids = ids
+        return ids
+
+    def next_after(self, pk, build):
+        """
+        returns the first candidate id greater than pk or None
+
+        :argument pk: id of the dog currently shown, -1 to start
+        :argument build: callable returning the ordered candidate ids
+        :rtype: int
+        """
+        return first_after(self.ids(build), pk)
+
+    @classmethod
+    def move(cls, user_id, dog_id, status):
+        """
+        patches the user's cached queues after dog_id changed to status
+
+        the dog is removed from whichever cached queue holds it and added
+        to the queue of its new status. if no cached queue holds the dog
+        and some queues are not cached it is unknown whether the dog
+        matches the user's preferences, so the new status queue is dropped
+        """
+        keys = cls.keys(user_id)
+        queues = cls.cache().get_many(keys.values())
+        if not queues:
+            return
+
+        found = False
+        changed = {}
+        for name, key in keys.items():
+            ids = queues.get(key)
+            if ids is None or name == status:
+                continue
+            index = bisect_right(ids, dog_id) - 1
+            if index >= 0 and ids[index] == dog_id:
+                del ids[index]
+                changed[key] = ids
+                found = True
+
+        new_key = keys[status]
+        new_ids = queues.get(new_key)
+        if new_ids is not None and dog_id not in new_ids:
+            if found:
+                insort(new_ids, dog_id)
+                changed[new_key] = new_ids
+            elif len(queues) < len(keys):
+                cls.cache().delete(new_key)
+        if changed:
+            cls.cache().set_many(changed, cls.timeout())
+
+    @classmethod
+    def invalidate_user(cls, user_id):
+        """drops every cached queue of the user"""
+        cls.cache().delete_many(cls.keys(user_id).values())
+
+    @classmethod
+    def invalidate_catalog(cls):
+        """drops every cached queue by bumping the catalog version"""
+        cache = cls.cache()
+        cache.add(cls.CATALOG_VERSION_KEY, 1, timeout=None)
+        try:
+            cache.incr(cls.CATALOG_VERSION_KEY)
+        except ValueError:
+            cache.set(cls.CATALOG_VERSION_KEY, 2, timeout=None)
+
+    @classmethod
+    def stats(cls):
+        """
+        returns the process local hit and miss counters and hit ratio
+
+        :rtype: dict
+        """
+        with cls._lock:
+            hits, misses = cls.counters['hits'], cls.counters['misses']
+        total = hits + misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_ratio': hits / total if total else 0.0,
+            }
+
+
+class CandidateSets:
+    """
+    class encapsulates a process local LRU of dog ids per preference signature
+
+    users with the same age, gender and size masks share one sorted array
+    of the matching dog ids, so the catalog filter runs once per signature
+    and catalog version instead of once per user. a user's candidates are
+    the shared ids intersected with the user's UserDog status rows.
+
+    `next` looks the user's status up for the few ids following the
+    current dog only, see next_with_status.
+
+    sets are dropped when the catalog version of CandidateQueue changes and
+    expire after settings.PUGORUGH_CANDIDATE_SETS_TTL seconds. other
+    processes only see that version change with a shared CandidateQueue
+    cache (pugorugh.W002 warns otherwise). the least
+    recently used sets are evicted beyond
+    settings.PUGORUGH_CANDIDATE_SETS_SIZE sets or
+    settings.PUGORUGH_CANDIDATE_SETS_MAX_IDS ids held in total (8 bytes each)
+
+    attributes:
+        counters
+            hits, misses and evictions since start
+
+    methods:
+        enabled, signature, ids, candidates, next_after, clear, stats
+    """
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._version = None
+        self._held = 0
+        self._lock = Lock()
+        self.counters = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    @staticmethod
+    def enabled():
+        """True when settings.PUGORUGH_CANDIDATE_SETS is on"""
+        return getattr(settings, 'PUGORUGH_CANDIDATE_SETS', False)
+
+    @staticmethod
+    def maxsize():
+        return getattr(settings, 'PUGORUGH_CANDIDATE_SETS_SIZE', 4096)
+
+    @staticmethod
+    def max_ids():
+        return getattr(settings, 'PUGORUGH_CANDIDATE_SETS_MAX_IDS', 2000000)
+
+    @staticmethod
+    def ttl():
+        return getattr(settings, 'PUGORUGH_CANDIDATE_SETS_TTL', 300)
+
+    @staticmethod
+    def signature(preference):
+        """returns the canonical (age, gender, size) masks of preference"""
+        return (preference.age_mask, preference.gender_mask,
+                preference.size_mask)
+
+    def ids(self, preference):
+        """
+        returns the sorted ids of every dog matching preference
+
+        :argument preference: UserPref
+        :rtype: array.array
+        """
+        version = CandidateQueue.catalog_version()
+        key = self.signature(preference)
+        now = time.monotonic()
+        with self._lock:
+            if version != self._version:
+                self._clear()
+                self._version = version
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.counters['hits'] += 1
+                return entry[1]
+            if entry is not None:
+                self._remove(key)
+            self.counters['misses'] += 1
+
+        ids = array('q', Dog.objects.filter(preference.get_filter()).order_by(
+            'pk').values_list('pk', flat=True))
+        with self._lock:
+            if version == self._version and len(ids) <= self.max_ids():
+                self._store(key, (now + self.ttl(), ids))
+        return ids
+
+    def candidates(self, preference, status):
+        """
+        returns the sorted ids of the dogs matching preference with status
+
+        for the user of preference, in UserDog.lazy_mode() undecided dogs
+        are the shared ids without the user's liked/disliked rows
+
+        :argument preference: UserPref
+        :argument status: one of STATUSES
+        :rtype: list
+        """
+        ids = self.ids(preference)
+        rows = UserDog.objects.for_user(preference.user_id).filter(
+            user_id=preference.user_id)
+        if status == 'undecided' and UserDog.lazy_mode():
+            decided = set(rows.exclude(status=UserDog.UNDECIDED).values_list(
+                'dog_id', flat=True))
+            return [pk for pk in ids if pk not in decided]
+        chosen = rows.filter(
+            status=StatusConverter.STATUSES[status]).values_list(
+            'dog_id', flat=True)
+        return sorted(pk for pk in chosen if contains(ids, pk))
+
+    def next_after(self, preference, status, pk):
+        """
+        returns the first candidate id greater than pk or None
+
+        :argument pk: id of the dog currently shown, -1 to start
+        :rtype: int
+        """
+        ids = self.ids(preference)
+
+        def window(after):
+            start = bisect_right(ids, after)
+            return ids[start:start + STATUS_WINDOW].tolist()
+
+        return next_with_status(
+            preference.user_id, status, pk, window,
+            lambda dog_ids: {dog_id for dog_id in dog_ids
+                             if contains(ids, dog_id)})
+
+    def _store(self, key, entry):
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = entry
+        self._held += len(entry[1])
+        while (len(self._entries) > self.maxsize()
+               or self._held > self.max_ids()):
+            self._remove(next(iter(self._entries)))
+            self.counters['evictions'] += 1
+
+    def _remove(self, key):
+        _, ids = self._entries.pop(key)
+        self._held -= len(ids)
+
+    def _clear(self):
+        self._entries.clear()
+        self._held = 0
+
+    def clear(self):
+        with self._lock:
+            self._clear()
+
+    def stats(self):
+        """
+        returns hits, misses, evictions, sets and ids held and hit ratio
+
+        :rtype: dict
+        """
+        with self._lock:
+            stats = dict(self.counters, size=len(self._entries),
+                         ids=self._held)
+        total = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = stats['hits'] / total if total else 0.0
+        return stats
+
+
+candidate_sets = CandidateSets()
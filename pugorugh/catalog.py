@@ -0,0 +1,176 @@
+import logging
+import time
+from threading import Lock
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+
+from .candidates import CandidateQueue
+from .converter import StatusConverter
+from .models import Dog, UserDog
+
+try:
+    import numpy as np
+except ImportError:  # the columnar catalog is optional
+    np = None
+
+logger = logging.getLogger(__name__)
+
+
+class DogCatalog:
+    """
+    class encapsulates an in process, columnar copy of the Dog catalog
+
+    Dog id, age_bit, gender_bit and size_bit are held as packed NumPy
+    arrays (8 + 3 bytes per dog) ordered by id, so matching a preference
+    is one vectorized AND per attribute and the `next` dog is a
+    searchsorted over the matching ids. only the user's UserDog status
+    rows are read from the database.
+
+    the arrays are loaded at startup (PugorughConfig.ready) or on first
+    use and reloaded lazily once the catalog changed: in this process via
+    the Dog signals (invalidate) and in other processes through the
+    catalog version of CandidateQueue. that version is only seen by other
+    processes with a shared CandidateQueue cache, with a process local one
+    the arrays are reloaded once older than
+    settings.PUGORUGH_COLUMNAR_CATALOG_MAX_AGE seconds.
+
+    attributes:
+        counters
+            loads since start
+
+    methods:
+        enabled, max_age, source, preload, invalidate, columns, ids,
+        candidates, next_after, stats
+    """
+    COLUMNS = ('pk', 'age_bit', 'gender_bit', 'size_bit')
+
+    def __init__(self):
+        self._columns = None
+        self._source = None
+        self._expires = None
+        self._lock = Lock()
+        self.counters = {'loads': 0}
+
+    @staticmethod
+    def enabled():
+        """True when PUGORUGH_COLUMNAR_CATALOG is on and NumPy is installed"""
+        return (np is not None
+                and getattr(settings, 'PUGORUGH_COLUMNAR_CATALOG', False))
+
+    @staticmethod
+    def max_age():
+        return getattr(settings, 'PUGORUGH_COLUMNAR_CATALOG_MAX_AGE', 60)
+
+    @staticmethod
+    def source():
+        """returns the (database, catalog version) the arrays must match"""
+        return (connections[Dog.objects.db].settings_dict['NAME'],
+                CandidateQueue.catalog_version())
+
+    def preload(self):
+        """loads the catalog when enabled, a missing table is only logged"""
+        if not self.enabled():
+            return
+        try:
+            self.columns()
+        except DatabaseError:
+            logger.warning('dog catalog not preloaded', exc_info=True)
+
+    def invalidate(self):
+        """drops the arrays, they are reloaded on next use"""
+        with self._lock:
+            self._columns = None
+
+    def columns(self):
+        """
+        returns the (ids, age_bit, gender_bit, size_bit) arrays
+
+        :rtype: tuple of numpy.ndarray
+        """
+        source, now = self.source(), time.monotonic()
+        columns, expires = self._columns, self._expires
+        if (columns is not None and self._source == source
+                and (expires is None or now < expires)):
+            return columns
+        with self._lock:
+            if (self._columns is None or self._source != source
+                    or self._expires is not None and now >= self._expires):
+                rows = Dog.objects.order_by('pk').values_list(*self.COLUMNS)
+                table = np.array(list(rows), dtype=np.int64).reshape(
+                    -1, len(self.COLUMNS))
+                self._columns = (np.ascontiguousarray(table[:, 0]),) + tuple(
+                    table[:, index].astype(np.uint8)
+                    for index in range(1, len(self.COLUMNS)))
+                self._source = source
+                self._expires = None if CandidateQueue.shared() \
+                    else now + self.max_age()
+                self.counters['loads'] += 1
+            return self._columns
+
+    def ids(self, preference):
+        """
+        returns the sorted ids of every dog matching preference
+
+        :argument preference: UserPref
+        :rtype: numpy.ndarray
+        """
+        ids, age, gender, size = self.columns()
+        match = ((age & preference.age_mask) != 0) & (
+            (gender & preference.gender_mask) != 0) & (
+            (size & preference.size_mask) != 0)
+        return ids[match]
+
+    def candidates(self, preference, status):
+        """
+        returns the sorted ids of the dogs matching preference with status
+
+        for the user of preference, in UserDog.lazy_mode() undecided dogs
+        are the matching ids without the user's liked/disliked rows
+
+        :argument preference: UserPref
+        :argument status: one of candidates.STATUSES
+        :rtype: numpy.ndarray
+        """
+        ids = self.ids(preference)
+        rows = UserDog.objects.for_user(preference.user_id).filter(
+            user_id=preference.user_id)
+        if status == 'undecided' and UserDog.lazy_mode():
+            decided = np.fromiter(
+                rows.exclude(status=UserDog.UNDECIDED).values_list(
+                    'dog_id', flat=True), dtype=np.int64)
+            return ids[~np.isin(ids, decided)]
+        chosen = np.fromiter(
+            rows.filter(status=StatusConverter.STATUSES[status]).values_list(
+                'dog_id', flat=True), dtype=np.int64)
+        return np.intersect1d(ids, chosen, assume_unique=True)
+
+    def next_after(self, preference, status, pk):
+        """
+        returns the first candidate id greater than pk or None
+
+        :argument pk: id of the dog currently shown, -1 to start
+        :rtype: int
+        """
+        ids = self.candidates(preference, status)
+        index = int(np.searchsorted(ids, pk, side='right'))
+        if index < len(ids):
+            return int(ids[index])
+        return None
+
+    def stats(self):
+        """
+        returns loads, dogs held and bytes used by the arrays
+
+        :rtype: dict
+        """
+        columns = self._columns
+        return {
+            'loads': self.counters['loads'],
+            'size': len(columns[0]) if columns is not None else 0,
+            'bytes': sum(column.nbytes for column in columns)
+            if columns is not None else 0,
+            }
+
+
+dog_catalog = DogCatalog()
@@ -0,0 +1,41 @@
+from django.core import checks
+
+from .candidates import CandidateQueue, CandidateSets
+
+
+@checks.register(checks.Tags.caches)
+def candidate_cache_check(app_configs, **kwargs):
+    """
+    warns when CandidateQueue is on with a process local candidate cache
+
+    each worker process would keep its own queues and catalog version, a
+    swipe or preference change is then not seen by the other workers
+    """
+    if not CandidateQueue.enabled() or CandidateQueue.shared():
+        return []
+    return [checks.Warning(
+        'PUGORUGH_CANDIDATE_QUEUE is on but the {!r} cache is local to '
+        'each process'.format(CandidateQueue.cache_alias()),
+        hint='Point PUGORUGH_CANDIDATE_CACHE at a shared cache such as '
+             'memcached or redis, or serve with a single process.',
+        id='pugorugh.W001',
+        )]
+
+
+@checks.register(checks.Tags.caches)
+def candidate_sets_check(app_configs, **kwargs):
+    """
+    warns when CandidateSets is on with a process local candidate cache
+
+    the sets of each worker are dropped by the catalog version held there,
+    other workers keep matching changed dogs until their sets expire
+    """
+    if not CandidateSets.enabled() or CandidateQueue.shared():
+        return []
+    return [checks.Warning(
+        'PUGORUGH_CANDIDATE_SETS is on but the {!r} cache is local to '
+        'each process'.format(CandidateQueue.cache_alias()),
+        hint='Point PUGORUGH_CANDIDATE_CACHE at a shared cache such as '
+             'memcached or redis, or serve with a single process.',
+        id='pugorugh.W002',
+        )]
@@ -2,6 +2,8 @@ class StatusConverter:
     """ class encapsulates logic for custom URL converter
 
         attributes:
+            STATUSES
+                maps each URL status to its UserDog.status code
             regex
                 regex pattern that wil be matched in the URL
         methods:
@@ -11,7 +13,12 @@ class StatusConverter:
     <https://docs.djangoproject.com/en/3.0/topics/http
     /urls/#registering-custom-path-converters>`_ for info
     """
-    regex = 'liked|disliked|undecided'
+    STATUSES = {
+        'liked': 'l',
+        'disliked': 'd',
+        'undecided': 'u',
+        }
+    regex = '|'.join(STATUSES)
 
     def to_python(self, value):
         return str(value)
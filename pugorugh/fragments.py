@@ -0,0 +1,177 @@
+from collections import OrderedDict
+from threading import Lock
+
+from django.conf import settings
+
+from . import images
+from .candidates import CandidateQueue
+from .renderers import FastJSONRenderer, JSONFragment
+from .serializers import DogSerializer
+
+
+class DogFragment(JSONFragment):
+    """
+    representation of a dog with its rendering and version
+
+    subclasses pugorugh.renderers.JSONFragment
+
+    attributes:
+        version, updated_at
+            Dog.VERSION_FIELDS of the rendered dog
+        images_version
+            images.build_version() the image URLs were resolved with
+    """
+
+    def __init__(self, data, raw, version, updated_at, images_version):
+        super().__init__(data, raw)
+        self.version = version
+        self.updated_at = updated_at
+        self.images_version = images_version
+
+    @property
+    def pk(self):
+        return self['id']
+
+
+class DogFragments:
+    """
+    class encapsulates a process local LRU of rendered dog payloads
+
+    a dog's DogSerializer.represent dict is rendered by FastJSONRenderer
+    once per Dog.version and kept as a DogFragment keyed by dog id, so a
+    swipe response neither builds nor encodes the dog again. an entry is
+    reused while its version matches the dog read from the database. a new
+    image derivative build re-renders every entry.
+
+    with a shared CandidateQueue cache an entry is also reused without
+    reading the dog until the catalog version changes, which the Dog
+    signals of every process bump. with a process local cache other
+    processes' changes are not seen there and the dog is read on every
+    use. QuerySet.update() without a version bump is never seen. the
+    least recently used entries are evicted beyond
+    settings.PUGORUGH_DOG_FRAGMENTS_SIZE dogs
+
+    attributes:
+        counters
+            hits (of which revalidated after reading the dog), misses and
+            evictions since start
+
+    methods:
+        enabled, maxsize, render, fragment, invalidate, clear, stats
+    """
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._version = None
+        self._epoch = 0
+        self._lock = Lock()
+        self.counters = {'hits': 0, 'revalidated': 0, 'misses': 0,
+                         'evictions': 0}
+
+    @staticmethod
+    def enabled():
+        """True when settings.PUGORUGH_DOG_FRAGMENTS is on"""
+        return getattr(settings, 'PUGORUGH_DOG_FRAGMENTS', False)
+
+    @staticmethod
+    def maxsize():
+        return getattr(settings, 'PUGORUGH_DOG_FRAGMENTS_SIZE', 10000)
+
+    @staticmethod
+    def render(dog):
+        """
+        returns the DogFragment of dog
+
+        :argument dog: Dog or a values() dict holding
+            DogSerializer.MODEL_FIELDS and Dog.VERSION_FIELDS
+        :rtype: DogFragment
+        """
+        row = dog if isinstance(dog, dict) else dog.__dict__
+        data = DogSerializer.represent(row)
+        return DogFragment(data, FastJSONRenderer().render(data),
+                           row['version'], row['updated_at'],
+                           images.build_version())
+
+    def fragment(self, load, dog_id=None):
+        """
+        returns the DogFragment of a dog
+
+        the entry of dog_id is returned as is when stored since the last
+        change of a shared catalog version, otherwise load() reads the dog
+        and the entry is reused when its version still matches. the catalog
+        version is read before the dog, an entry is never newer than its
+        epoch
+
+        :argument load: callable returning the Dog or values() dict, see
+            render, and raising Http404 for missing dogs
+        :argument dog_id: id of the dog when known before loading it
+        :rtype: DogFragment
+        """
+        if not self.enabled():
+            return self.render(load())
+
+        shared = CandidateQueue.shared()
+        version = CandidateQueue.catalog_version() if shared else None
+        images_version = images.build_version()
+        with self._lock:
+            if version != self._version:
+                self._version = version
+                self._epoch += 1
+            epoch = self._epoch
+            entry = self._entries.get(dog_id)
+            if (shared and entry is not None and entry[0] == epoch
+                    and entry[1].images_version == images_version):
+                self._entries.move_to_end(dog_id)
+                self.counters['hits'] += 1
+                return entry[1]
+
+        dog = load()
+        pk, dog_version = (dog['id'], dog['version']) if isinstance(
+            dog, dict) else (dog.pk, dog.version)
+        with self._lock:
+            entry = self._entries.get(pk)
+            if (entry is not None and entry[1].version == dog_version
+                    and entry[1].images_version == images_version):
+                self._entries.move_to_end(pk)
+                self._entries[pk] = (epoch, entry[1])
+                self.counters['hits'] += 1
+                self.counters['revalidated'] += 1
+                return entry[1]
+            self.counters['misses'] += 1
+
+        fragment = self.render(dog)
+        with self._lock:
+            self._store(pk, (epoch, fragment))
+        return fragment
+
+    def _store(self, key, entry):
+        self._entries.pop(key, None)
+        self._entries[key] = entry
+        while len(self._entries) > self.maxsize():
+            self._entries.popitem(last=False)
+            self.counters['evictions'] += 1
+
+    def invalidate(self, dog_ids):
+        """drops the entries of dog_ids"""
+        with self._lock:
+            for pk in dog_ids:
+                self._entries.pop(pk, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """
+        returns hits, revalidations, misses, evictions, size and hit ratio
+
+        :rtype: dict
+        """
+        with self._lock:
+            stats = dict(self.counters, size=len(self._entries))
+        total = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = stats['hits'] / total if total else 0.0
+        return stats
+
+
+dog_fragments = DogFragments()
@@ -0,0 +1,219 @@
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from django.conf import settings
+
+from .assets import static_url
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is only needed to build derivatives
+    Image = None
+
+# name: (max width, max height, JPEG quality)
+VARIANTS = {
+    'thumbnail': (160, 160, 70),
+    'card': (480, 480, 78),
+    'full': (1080, 1080, 82),
+    }
+WEBP_QUALITY = 75
+MANIFEST = 'sources.json'
+
+# seconds between checks of the manifest file for a new build
+MANIFEST_RECHECK = 1.0
+
+# the last manifest read, see manifest_state
+_manifest = {'path': None, 'key': None, 'sources': {}, 'checked': None}
+
+
+def source_dir():
+    """returns the directory holding the original dog images"""
+    return getattr(settings, 'PUGORUGH_IMAGE_SOURCE_DIR', os.path.join(
+        settings.BASE_DIR, 'pugorugh', 'static', 'images', 'dogs'))
+
+
+def derived_dir():
+    """returns the directory derivatives are written to"""
+    return getattr(settings, 'PUGORUGH_IMAGE_DERIVED_DIR',
+                   os.path.join(source_dir(), 'derived'))
+
+
+def derived_names(image_filename):
+    """
+    returns {variant: file name} of every derivative of image_filename
+
+    variants are VARIANTS as JPEG plus a `<variant>_webp` WebP copy
+
+    :rtype: dict
+    """
+    stem = os.path.splitext(image_filename)[0]
+    names = {}
+    for variant in VARIANTS:
+        names[variant] = '{}-{}.jpg'.format(stem, variant)
+        names[variant + '_webp'] = '{}-{}.webp'.format(stem, variant)
+    return names
+
+
+def manifest_state():
+    """
+    returns ((path, mtime_ns), {image_filename: sha1}) of the build manifest
+
+    the file is checked at most every MANIFEST_RECHECK seconds and read
+    again once it changed, e.g. after build_dog_images ran in another
+    process. the state is (None, {}) before the first build
+    """
+    path = os.path.join(derived_dir(), MANIFEST)
+    now = time.monotonic()
+    if (_manifest['path'] == path and _manifest['checked'] is not None
+            and now - _manifest['checked'] < MANIFEST_RECHECK):
+        return _manifest['key'], _manifest['sources']
+    try:
+        key = (path, os.stat(path).st_mtime_ns)
+    except OSError:
+        key = None
+    if key is None:
+        sources = {}
+    elif key == _manifest['key']:
+        sources = _manifest['sources']
+    else:
+        try:
+            with open(path, 'r', encoding='utf-8') as manifest_file:
+                sources = json.load(manifest_file)
+        except (OSError, ValueError):
+            key, sources = None, {}
+    _manifest.update(path=path, key=key, sources=sources, checked=now)
+    return key, sources
+
+
+def built_sources():
+    """returns {image_filename: sha1} of the images with derivatives"""
+    return manifest_state()[1]
+
+
+def build_version():
+    """returns a token changing with every build, '0' before the first"""
+    key = manifest_state()[0]
+    return format(key[1], 'x') if key else '0'
+
+
+def derivative_urls(image_filename):
+    """
+    returns {variant: static URL} for the derivatives of image_filename
+
+    URLs are content hashed when the derivative was collected, see
+    assets.static_url. images without a build in the manifest map every
+    variant to the URL of the original image, no URL is left dangling
+
+    :rtype: dict
+    """
+    if not image_filename:
+        return {}
+    names = derived_names(image_filename)
+    if image_filename not in built_sources():
+        original = static_url('images/dogs/' + image_filename)
+        return {variant: original for variant in names}
+    return {variant: static_url('images/dogs/derived/' + name)
+            for variant, name in names.items()}
+
+
+def source_hash(path):
+    """returns the sha1 hex digest of the file at path"""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as source:
+        for block in iter(lambda: source.read(1 << 16), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def render(image_filename, source, target):
+    """
+    writes every derivative of one source image, runs in a worker process
+
+    :rtype: str
+    """
+    names = derived_names(image_filename)
+    with Image.open(os.path.join(source, image_filename)) as original:
+        original = original.convert('RGB')
+        for variant, (width, height, quality) in VARIANTS.items():
+            image = original.copy()
+            image.thumbnail((width, height), Image.LANCZOS)
+            image.save(os.path.join(target, names[variant]), 'JPEG',
+                       quality=quality, optimize=True, progressive=True)
+            image.save(os.path.join(target, names[variant + '_webp']),
+                       'WEBP', quality=WEBP_QUALITY, method=6)
+    return image_filename
+
+
+def render_all(image_filenames, source, target, workers=None):
+    """
+    renders image_filenames, a single image inline and more across a
+    process pool of `workers` processes (os.cpu_count() by default).
+    the pool spawns its workers, forking a threaded server can deadlock
+
+    :rtype: generator yielding each rendered image filename
+    """
+    args = (image_filenames, [source] * len(image_filenames),
+            [target] * len(image_filenames))
+    if len(image_filenames) == 1:
+        yield from map(render, *args)
+        return
+    with ProcessPoolExecutor(max_workers=workers,
+                             mp_context=get_context('spawn')) as pool:
+        yield from pool.map(render, *args)
+
+
+def build_derivatives(image_filenames, workers=None, force=False):
+    """
+    generates missing or outdated derivatives for image_filenames
+
+    sources whose sha1 matches the manifest of the last build and whose
+    derivatives all exist are skipped, the rest are rendered by
+    render_all
+
+    :rtype: dict of built, skipped and missing counts
+    """
+    if Image is None:
+        raise ImportError('Pillow is required to build dog image derivatives')
+    source, target = source_dir(), derived_dir()
+    os.makedirs(target, exist_ok=True)
+    manifest_path = os.path.join(target, MANIFEST)
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as manifest_file:
+            manifest = json.load(manifest_file)
+    except (OSError, ValueError):
+        manifest = {}
+
+    stats = {'built': 0, 'skipped': 0, 'missing': 0}
+    pending = {}
+    for image_filename in sorted(set(filter(None, image_filenames))):
+        path = os.path.join(source, image_filename)
+        if (os.path.basename(image_filename) != image_filename
+                or not os.path.isfile(path)):
+            stats['missing'] += 1
+            continue
+        digest = source_hash(path)
+        outputs = derived_names(image_filename).values()
+        if (not force and manifest.get(image_filename) == digest
+                and all(os.path.exists(os.path.join(target, name))
+                        for name in outputs)):
+            stats['skipped'] += 1
+            continue
+        pending[image_filename] = digest
+
+    if not pending:
+        return stats
+    try:
+        for image_filename in render_all(list(pending), source, target,
+                                         workers):
+            manifest[image_filename] = pending[image_filename]
+            stats['built'] += 1
+    finally:
+        # keep the hashes of what was built even if a render failed
+        with open(manifest_path, 'w', encoding='utf-8') as manifest_file:
+            json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+        _manifest['checked'] = None
+    return stats
@@ -0,0 +1,350 @@
+import hashlib
+import json
+import time
+
+from django.db import DatabaseError, transaction
+from rest_framework.exceptions import ValidationError
+
+from .models import Dog
+from .serializers import DogSerializer
+from .signals import delete_dogs, dogs_created, dogs_updated
+
+
+def iter_json_array(fp, read_size=1 << 16):
+    """
+    yields the items of a top level JSON array without loading the file
+
+    the file is read read_size characters at a time and each item is
+    decoded with json.JSONDecoder.raw_decode as soon as it is complete
+
+    :argument fp: text file object positioned at the array
+    :rtype: generator
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    index = 0
+    eof = False
+    expect = '['
+
+    def refill():
+        nonlocal buffer, index, eof
+        chunk = fp.read(read_size)
+        eof = not chunk
+        buffer = buffer[index:] + chunk
+        index = 0
+        return not eof
+
+    while True:
+        while index < len(buffer) and buffer[index].isspace():
+            index += 1
+        if index == len(buffer):
+            if refill():
+                continue
+            if expect == 'end':
+                return
+            raise ValueError('unexpected end of JSON array')
+
+        char = buffer[index]
+        if expect == '[':
+            if char != '[':
+                raise ValueError('expected a JSON array')
+            index += 1
+            expect = 'first'
+        elif expect in ('first', 'separator') and char == ']':
+            index += 1
+            expect = 'end'
+        elif expect == 'separator':
+            if char != ',':
+                raise ValueError(
+                    'expected "," or "]" in JSON array, got %r' % char)
+            index += 1
+            expect = 'value'
+        elif expect == 'end':
+            raise ValueError('unexpected data after JSON array')
+        else:
+            try:
+                item, end = decoder.raw_decode(buffer, index)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                refill()
+                continue
+            # a number ending the buffer may continue in the next read
+            if end == len(buffer) and not eof:
+                refill()
+                continue
+            index = end
+            expect = 'separator'
+            yield item
+
+
+def iter_ndjson(fp):
+    """
+    yields one decoded JSON value per non blank line
+
+    :argument fp: text file object
+    :rtype: generator
+    """
+    for line in fp:
+        if line.strip():
+            yield json.loads(line)
+
+
+class DogImporter:
+    """
+    class encapsulates chunked, streaming import of Dog records
+
+    records are validated one by one with DogSerializer and the valid ones
+    are bulk_created chunk_size at a time, each chunk in its own
+    transaction. an invalid record is reported through on_reject and
+    skipped, it never aborts the import. if a chunk fails to insert its
+    records are retried one by one so only the bad rows are rejected.
+
+    attributes:
+        chunk_size
+            records validated and inserted per transaction
+        on_reject
+            callable(position, record, errors) called for every rejected row
+        on_chunk
+            callable(stats) called after every chunk
+        stats
+            dict of read, imported and rejected counts and elapsed seconds
+
+    methods:
+        run, rate
+    """
+
+    def __init__(self, chunk_size=1000, on_reject=None, on_chunk=None):
+        self.chunk_size = chunk_size
+        self.on_reject = on_reject or (lambda position, record, errors: None)
+        self.on_chunk = on_chunk or (lambda stats: None)
+        self.serializer = DogSerializer()
+        self.stats = {'read': 0, 'imported': 0, 'rejected': 0, 'elapsed': 0.0}
+
+    def rate(self):
+        """returns records read per second so far"""
+        if not self.stats['elapsed']:
+            return 0.0
+        return self.stats['read'] / self.stats['elapsed']
+
+    def run(self, records):
+        """
+        imports every record of the iterable records
+
+        :argument records: iterable of dicts, e.g. iter_json_array(fp)
+        :rtype: dict
+        """
+        started = time.perf_counter()
+        chunk = []
+        for position, record in enumerate(records):
+            self.stats['read'] += 1
+            try:
+                chunk.append((position, record,
+                              self.serializer.run_validation(record)))
+            except ValidationError as error:
+                self.reject(position, record, error.detail)
+            if len(chunk) >= self.chunk_size:
+                self.flush(chunk)
+                self.stats['elapsed'] = time.perf_counter() - started
+                self.on_chunk(self.stats)
+                chunk = []
+        self.stats['elapsed'] = time.perf_counter() - started
+        if chunk:
+            self.flush(chunk)
+            self.stats['elapsed'] = time.perf_counter() - started
+            self.on_chunk(self.stats)
+        return self.stats
+
+    def reject(self, position, record, errors):
+        self.stats['rejected'] += 1
+        self.on_reject(position, record, errors)
+
+    def flush(self, chunk):
+        """inserts one chunk of validated rows in a transaction"""
+        last_id = self.last_id()
+        dogs = [Dog(**attrs) for _, _, attrs in chunk]
+        try:
+            with transaction.atomic():
+                Dog.objects.bulk_create(dogs)
+        except DatabaseError:
+            dogs = []
+            for position, record, attrs in chunk:
+                dog = Dog(**attrs)
+                try:
+                    with transaction.atomic():
+                        Dog.objects.bulk_create([dog])
+                except DatabaseError as error:
+                    self.reject(position, record, [str(error)])
+                else:
+                    dogs.append(dog)
+        inserted = self.inserted_ids(dogs, last_id) if dogs else []
+        self.stats['imported'] += len(inserted)
+        if inserted:
+            dogs_created.send(sender=Dog, dog_ids=inserted)
+
+    @staticmethod
+    def last_id():
+        return Dog.objects.order_by('-pk').values_list(
+            'pk', flat=True).first() or 0
+
+    @staticmethod
+    def inserted_ids(dogs, last_id):
+        """
+        returns the pks of the bulk_created dogs
+
+        backends returning rows from bulk inserts (PostgreSQL) set them on
+        dogs. otherwise they are read back as the rows after last_id with
+        the image filenames of dogs, rows inserted meanwhile by other
+        writers are only picked up if they share a filename of the batch
+
+        :argument dogs: list of Dog, just bulk_created
+        :argument last_id: greatest Dog pk before the insert
+        :rtype: list
+        """
+        inserted = [dog.pk for dog in dogs if dog.pk is not None]
+        if len(inserted) == len(dogs):
+            return inserted
+        return list(Dog.objects.filter(
+            pk__gt=last_id,
+            image_filename__in={dog.image_filename for dog in dogs},
+            ).values_list('pk', flat=True))
+
+
+class DogSync(DogImporter):
+    """
+    class encapsulates incremental sync of a Dog catalog feed
+
+    each record is identified by `key` (external_id or image_filename) and
+    hashed. per chunk the stored content_hash of the known keys is read in
+    one query, unknown keys are bulk_created, keys whose hash changed are
+    bulk_updated and unchanged rows cost no writes. with delete_missing
+    dogs whose key was not in the feed are deleted after the run. a
+    rejected record keeps its dog, and when a rejected record has no key
+    nothing is deleted at all.
+
+    subclasses DogImporter
+
+    attributes:
+        KEYS
+            accepted values of key
+        key
+            field identifying a record across syncs
+        delete_missing
+            delete dogs absent from the feed
+        delete_skipped
+            True when delete_missing was skipped, see unkeyed
+        unkeyed
+            count of rejected records without a key
+        stats
+            DogImporter.stats plus updated, unchanged and deleted counts
+
+    methods:
+        run, content_hash
+    """
+    KEYS = ('external_id', 'image_filename')
+    FIELDS = ['name', 'image_filename', 'breed', 'age', 'gender', 'size']
+    DELETE_CHUNK = 500
+
+    def __init__(self, key='external_id', delete_missing=False, **kwargs):
+        if key not in self.KEYS:
+            raise ValueError('key must be one of {}'.format(self.KEYS))
+        super().__init__(**kwargs)
+        self.key = key
+        self.delete_missing = delete_missing
+        self.seen = set()
+        self.unkeyed = 0
+        self.delete_skipped = False
+        self.stats.update(updated=0, unchanged=0, deleted=0)
+
+    @classmethod
+    def content_hash(cls, attrs):
+        """returns the sha1 hex digest of the synced fields of attrs"""
+        payload = json.dumps({field: attrs.get(field) for field in cls.FIELDS},
+                             sort_keys=True, separators=(',', ':'))
+        return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+    def run(self, records):
+        stats = super().run(records)
+        if self.delete_missing:
+            self.delete_unseen()
+        return stats
+
+    def reject(self, position, record, errors):
+        """counts the key of a rejected record as seen, its dog is kept"""
+        key = record.get(self.key) if isinstance(record, dict) else None
+        if key:
+            self.seen.add(str(key))
+        else:
+            self.unkeyed += 1
+        super().reject(position, record, errors)
+
+    def flush(self, chunk):
+        """inserts new, updates changed and skips unchanged rows of chunk"""
+        rows = {}
+        for position, record, attrs in chunk:
+            key = record.get('external_id') if self.key == 'external_id' \
+                else attrs.get('image_filename')
+            if not key:
+                self.reject(position, record,
+                            {self.key: ['This field is required.']})
+                continue
+            key = str(key)
+            attrs = dict(attrs, content_hash=self.content_hash(attrs))
+            if self.key == 'external_id':
+                attrs['external_id'] = key
+            rows[key] = attrs
+        self.seen.update(rows)
+
+        existing = {
+            key: (pk, content_hash) for key, pk, content_hash in
+            Dog.objects.filter(**{self.key + '__in': list(rows)}).values_list(
+                self.key, 'pk', 'content_hash')}
+        new = [attrs for key, attrs in rows.items() if key not in existing]
+        changed = []
+        for key, (pk, content_hash) in existing.items():
+            if rows[key]['content_hash'] == content_hash:
+                self.stats['unchanged'] += 1
+            else:
+                changed.append(Dog(pk=pk, **rows[key]))
+        if not changed and not new:
+            return
+
+        try:
+            with transaction.atomic():
+                if changed:
+                    Dog.objects.bulk_update(
+                        changed, self.FIELDS + ['content_hash'])
+                if new:
+                    Dog.objects.bulk_create(Dog(**attrs) for attrs in new)
+        except DatabaseError as error:
+            for position, record, _ in chunk:
+                self.reject(position, record, [str(error)])
+            return
+        self.stats['updated'] += len(changed)
+        if changed:
+            dogs_updated.send(sender=Dog, dog_ids=[dog.pk for dog in changed])
+        if new:
+            # keys identify the batch's rows, unlike pks after the last id
+            inserted = list(Dog.objects.filter(**{
+                self.key + '__in': [attrs[self.key] for attrs in new]
+                }).values_list('pk', flat=True))
+            self.stats['imported'] += len(inserted)
+            dogs_created.send(sender=Dog, dog_ids=inserted)
+
+    def delete_unseen(self):
+        """
+        deletes dogs whose key was not in the feed, in chunks, see
+        signals.delete_dogs. skipped when a rejected record had no key, its
+        dog could be any of them
+        """
+        if self.unkeyed:
+            self.delete_skipped = True
+            return
+        missing = []
+        dogs = Dog.objects.order_by('pk').values_list('pk', self.key)
+        for pk, key in dogs.iterator():
+            if key not in self.seen:
+                missing.append(pk)
+        for start in range(0, len(missing), self.DELETE_CHUNK):
+            delete_dogs(missing[start:start + self.DELETE_CHUNK])
+        self.stats['deleted'] = len(missing)
@@ -0,0 +1,99 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import (
+    override_settings, setup_databases, setup_test_environment,
+    teardown_databases, teardown_test_environment,
+    )
+
+from pugorugh.benchmark import ENDPOINTS, SwipeBenchmark, compare
+
+ISOLATED_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'pugorugh-benchmark',
+        },
+    }
+
+
+class Command(BaseCommand):
+    """
+    management command that benchmarks the swipe workload end to end
+
+    creates test databases like `manage.py test` and an in memory cache,
+    replays the sessions of pugorugh.benchmark.SwipeBenchmark in them and
+    destroys them afterwards, the configured data is never touched. prints
+    throughput, latency percentiles and SQL statements per request of every
+    endpoint, --output writes them as JSON and --baseline compares them to
+    an earlier --output, e.g. of the previous commit.
+
+    usage:
+        python manage.py benchmark_swipes [--dogs N] [--users N]
+            [--swipes N] [--seed N] [--output PATH] [--baseline PATH]
+    """
+    help = 'Benchmark register, preference and swipe requests end to end.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dogs', type=int, default=1000,
+                            help='dogs seeded into the catalog')
+        parser.add_argument('--users', type=int, default=20,
+                            help='sessions, each of a newly registered user')
+        parser.add_argument('--swipes', type=int, default=50,
+                            help='next and status requests per session')
+        parser.add_argument('--like-ratio', type=float, default=0.3,
+                            help='share of liked swipes')
+        parser.add_argument('--seed', type=int, default=0,
+                            help='seed of the random workload')
+        parser.add_argument('--output', help='write the results as JSON')
+        parser.add_argument('--baseline',
+                            help='compare to results written by --output')
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['baseline']:
+            try:
+                with open(options['baseline'], encoding='utf-8') as fp:
+                    baseline = json.load(fp)
+            except (OSError, ValueError) as error:
+                raise CommandError('cannot read baseline: {}'.format(error))
+
+        benchmark = SwipeBenchmark(
+            dogs=options['dogs'], users=options['users'],
+            swipes=options['swipes'], like_ratio=options['like_ratio'],
+            seed=options['seed'])
+        verbosity = options['verbosity']
+        setup_test_environment(debug=False)
+        try:
+            old_config = setup_databases(verbosity, interactive=False)
+            try:
+                with override_settings(CACHES=ISOLATED_CACHES):
+                    results = benchmark.run()
+            finally:
+                teardown_databases(old_config, verbosity)
+        finally:
+            teardown_test_environment()
+
+        self.report(results, baseline)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as fp:
+                json.dump(results, fp, indent=2, sort_keys=True)
+            self.stdout.write('results written to {}'.format(
+                options['output']))
+
+    def report(self, results, baseline):
+        """writes the table of results and the changes to baseline"""
+        changes = compare(baseline, results) if baseline else {}
+        self.stdout.write('{:<12} {:>8} {:>8} {:>8} {:>8} {:>8} {:>8}'.format(
+            'endpoint', 'requests', 'rps', 'p50 ms', 'p95 ms', 'p99 ms',
+            'queries'))
+        rows = [(endpoint, results['endpoints'][endpoint])
+                for endpoint in ENDPOINTS] + [('total', results['total'])]
+        for name, stats in rows:
+            self.stdout.write(
+                '{:<12} {requests:>8} {rps:>8.0f} {p50:>8.2f} {p95:>8.2f} '
+                '{p99:>8.2f} {queries:>8.1f}'.format(name, **stats))
+            change = changes.get(name)
+            if change:
+                self.stdout.write('{:<12} {}'.format('', ', '.join(
+                    '{} {:+.1%}'.format(stat, value)
+                    for stat, value in sorted(change.items()))))
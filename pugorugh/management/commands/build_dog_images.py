@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from pugorugh import images
+from pugorugh.models import Dog
+
+
+class Command(BaseCommand):
+    """
+    management command that builds resized dog image derivatives
+
+    renders thumbnail, card and full size JPEG and WebP copies of each
+    Dog.image_filename across a process pool, see pugorugh.images. sources
+    unchanged since the last build are skipped.
+
+    usage:
+        python manage.py build_dog_images [image_filename ...]
+            [--workers N] [--force]
+    """
+    help = 'Build resized JPEG/WebP derivatives of the dog images.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('image_filenames', nargs='*',
+                            help='images to build, defaults to every '
+                                 'Dog.image_filename')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='worker processes, defaults to the CPU count')
+        parser.add_argument('--force', action='store_true',
+                            help='rebuild images whose source is unchanged')
+
+    def handle(self, *args, **options):
+        filenames = options['image_filenames'] or Dog.objects.values_list(
+            'image_filename', flat=True).distinct()
+        try:
+            stats = images.build_derivatives(
+                filenames, workers=options['workers'], force=options['force'])
+        except ImportError as error:
+            raise CommandError(error)
+        self.stdout.write(self.style.SUCCESS(
+            'built {built}, skipped {skipped}, missing {missing}'.format(
+                **stats)))
@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+
+from pugorugh.models import Dog, UserDog
+
+
+class Command(BaseCommand):
+    """
+    management command that fans dogs out to existing users
+
+    creates missing undecided UserDog rows in bounded INSERT ... SELECT
+    batches, see UserDogManager.fan_out. the command is idempotent and an
+    interrupted run is resumed with --start-user and the last printed id.
+
+    usage:
+        python manage.py fanout_dogs [dog_id ...] [--since-dog ID]
+            [--start-user ID] [--batch-size N]
+    """
+    help = 'Create missing undecided UserDog rows for existing users.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('dog_ids', nargs='*', type=int,
+                            help='dogs to fan out, defaults to every dog')
+        parser.add_argument('--since-dog', type=int, default=None,
+                            help='fan out every dog with a greater id')
+        parser.add_argument('--start-user', type=int, default=0,
+                            help='resume after this user id')
+        parser.add_argument('--batch-size', type=int, default=10000,
+                            help='approximate rows written per statement')
+
+    def handle(self, *args, **options):
+        dog_ids = options['dog_ids']
+        if not dog_ids:
+            dogs = Dog.objects.all()
+            if options['since_dog'] is not None:
+                dogs = dogs.filter(pk__gt=options['since_dog'])
+            dog_ids = list(dogs.values_list('pk', flat=True))
+
+        total = 0
+        for last_user_id, inserted in UserDog.objects.fan_out(
+                dog_ids, batch_size=options['batch_size'],
+                start_user_id=options['start_user']):
+            total += inserted
+            self.stdout.write('user {} done, {} rows'.format(
+                last_user_id, inserted))
+        self.stdout.write(self.style.SUCCESS(
+            'fan out done, {} rows inserted'.format(total)))
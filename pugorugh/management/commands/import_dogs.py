@@ -0,0 +1,99 @@
+from os import path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from pugorugh.importer import (
+    DogImporter, DogSync, iter_json_array, iter_ndjson,
+    )
+
+DEFAULT_SOURCE = path.join(settings.BASE_DIR, 'pugorugh', 'static',
+                           'dog_details.json')
+
+
+class Command(BaseCommand):
+    """
+    management command that streams Dog records into the database
+
+    reads a JSON array or NDJSON (one record per line) file incrementally
+    and imports it in chunks with pugorugh.importer.DogImporter, so memory
+    use does not grow with the size of the catalog. rejected rows are
+    reported on stderr and do not stop the import.
+
+    with --sync records are matched to existing dogs by --key and only new
+    or changed records are written, see pugorugh.importer.DogSync
+
+    usage:
+        python manage.py import_dogs [path] [--format auto|json|ndjson]
+            [--chunk-size N] [--sync [--key external_id|image_filename]
+            [--delete-missing]]
+    """
+    help = 'Stream dogs from a JSON array or NDJSON file into the database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default=DEFAULT_SOURCE,
+                            help='source file, defaults to dog_details.json')
+        parser.add_argument('--format', default='auto',
+                            choices=['auto', 'json', 'ndjson'],
+                            help='input format, auto picks ndjson for '
+                                 '.ndjson/.jsonl files')
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='records validated and inserted per '
+                                 'transaction')
+        parser.add_argument('--sync', action='store_true',
+                            help='insert new, update changed and skip '
+                                 'unchanged records instead of appending')
+        parser.add_argument('--key', default='external_id',
+                            choices=DogSync.KEYS,
+                            help='record field identifying a dog in --sync')
+        parser.add_argument('--delete-missing', action='store_true',
+                            help='with --sync delete dogs not in the source')
+
+    def handle(self, *args, **options):
+        source = options['path']
+        fmt = options['format']
+        if fmt == 'auto':
+            fmt = 'ndjson' if source.endswith(('.ndjson', '.jsonl')) \
+                else 'json'
+        parse = iter_ndjson if fmt == 'ndjson' else iter_json_array
+
+        self.verbosity = options['verbosity']
+        kwargs = dict(chunk_size=options['chunk_size'],
+                      on_reject=self.report_reject,
+                      on_chunk=self.report_progress)
+        if options['sync']:
+            importer = DogSync(key=options['key'],
+                               delete_missing=options['delete_missing'],
+                               **kwargs)
+        else:
+            importer = DogImporter(**kwargs)
+        self.importer = importer
+        try:
+            with open(source, 'r', encoding='utf-8') as fp:
+                stats = importer.run(parse(fp))
+        except (OSError, ValueError) as error:
+            raise CommandError('import failed after {} records: {}'.format(
+                importer.stats['read'], error))
+
+        if options['sync']:
+            self.stdout.write(
+                'updated {updated}, unchanged {unchanged}, '
+                'deleted {deleted}'.format(**stats))
+            if importer.delete_skipped:
+                self.stderr.write(
+                    'missing dogs were not deleted: {} rejected records '
+                    'have no {}'.format(importer.unkeyed, options['key']))
+        self.stdout.write(self.style.SUCCESS(
+            'imported {imported}, rejected {rejected} of {read} records '
+            'in {elapsed:.2f}s ({rate:.0f} records/s)'.format(
+                rate=importer.rate(), **stats)))
+
+    def report_reject(self, position, record, errors):
+        self.stderr.write('record {} rejected: {}'.format(position, errors))
+
+    def report_progress(self, stats):
+        if self.verbosity > 1:
+            self.stdout.write(
+                '{read} read, {imported} imported, {rejected} rejected '
+                '({rate:.0f} records/s)'.format(
+                    rate=self.importer.rate(), **stats))
@@ -0,0 +1,123 @@
+import importlib.util
+import io
+import os
+import pstats
+import shutil
+import subprocess
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from pugorugh.profiling import SUFFIX, profile_dir
+
+DEFAULT_FOCUS = ['views:get_queryset', 'models:get_age_display']
+
+
+class Command(BaseCommand):
+    """
+    management command that aggregates sampled profiles into call graphs
+
+    merges the .pstats files ProfilingMiddleware wrote for each view into
+    <output>/<view>.pstats, prints the functions with the most cumulative
+    time and renders gprof2dot call graphs: the whole view and, for every
+    --focus `module:function` found in it, the subtree below that function
+    (e.g. views:get_queryset, the DogPreferenceMixin.get_queryset of Dogs).
+    graphs are rendered with Graphviz `dot` when installed, otherwise the
+    .dot sources are written. without gprof2dot only the merged stats and
+    the text summary are produced.
+
+    usage:
+        python manage.py profile_report [view ...] [--dir PATH]
+            [--output PATH] [--focus module:function ...] [--format svg]
+    """
+    help = 'Aggregate sampled request profiles and render call graphs.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('views', nargs='*',
+                            help='view names, defaults to every profiled view')
+        parser.add_argument('--dir', default=None,
+                            help='profile directory, PUGORUGH_PROFILE_DIR')
+        parser.add_argument('--output', default=None,
+                            help='report directory, defaults to <dir>/report')
+        parser.add_argument('--focus', action='append', default=None,
+                            help='module:function to graph on its own, '
+                                 'may repeat, fnmatch patterns allowed')
+        parser.add_argument('--format', default='svg',
+                            choices=['svg', 'png', 'pdf', 'dot'])
+        parser.add_argument('--node-thres', type=float, default=0.5,
+                            help='hide nodes below this percentage of time')
+        parser.add_argument('--limit', type=int, default=15,
+                            help='functions listed per view')
+
+    def handle(self, *args, **options):
+        directory = options['dir'] or profile_dir()
+        if not os.path.isdir(directory):
+            raise CommandError('no profiles in {}'.format(directory))
+        output = options['output'] or os.path.join(directory, 'report')
+        os.makedirs(output, exist_ok=True)
+        views = options['views'] or sorted(
+            name for name in os.listdir(directory)
+            if os.path.isdir(os.path.join(directory, name))
+            and os.path.join(directory, name) != output)
+
+        self.graphs = importlib.util.find_spec('gprof2dot') is not None
+        if not self.graphs:
+            self.stderr.write('gprof2dot is not installed, call graphs '
+                              'are skipped')
+        self.dot = shutil.which('dot') if options['format'] != 'dot' \
+            else None
+
+        for view in views:
+            files = sorted(
+                os.path.join(directory, view, name)
+                for name in os.listdir(os.path.join(directory, view))
+                if name.endswith(SUFFIX)) \
+                if os.path.isdir(os.path.join(directory, view)) else []
+            if not files:
+                self.stderr.write('{}: no profiles'.format(view))
+                continue
+            merged = os.path.join(output, view + SUFFIX)
+            stats = pstats.Stats(*files, stream=io.StringIO())
+            stats.dump_stats(merged)
+            self.summarize(view, len(files), stats, options['limit'])
+            if not self.graphs:
+                continue
+            self.render(merged, os.path.join(output, view), options)
+            for focus in options['focus'] or DEFAULT_FOCUS:
+                module, _, function = focus.rpartition(':')
+                self.render(merged, os.path.join(output, '{}-{}'.format(
+                    view, function.replace('*', '_'))), options,
+                    root='{}:*:{}'.format(module or '*', function))
+
+    def summarize(self, view, count, stats, limit):
+        """writes the functions of stats with the most cumulative time"""
+        stream = io.StringIO()
+        stats.stream = stream
+        stats.sort_stats('cumulative').print_stats(limit)
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            '{} ({} profiles)'.format(view, count)))
+        self.stdout.write(stream.getvalue().strip('\n'))
+
+    def render(self, merged, target, options, root=None):
+        """renders the call graph of merged to target.<format>"""
+        command = [sys.executable, '-m', 'gprof2dot', '-f', 'pstats',
+                   '-n', str(options['node_thres']), merged]
+        if root:
+            command[-1:-1] = ['-z', root]
+        graph = subprocess.run(command, stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE)
+        if graph.returncode:
+            if root:
+                return  # focus function not profiled in this view
+            raise CommandError('gprof2dot failed: {}'.format(
+                graph.stderr.decode().strip()))
+
+        if self.dot:
+            path = '{}.{}'.format(target, options['format'])
+            subprocess.run([self.dot, '-T' + options['format'], '-o', path],
+                           input=graph.stdout, check=True)
+        else:
+            path = target + '.dot'
+            with open(path, 'wb') as fp:
+                fp.write(graph.stdout)
+        self.stdout.write('call graph written to {}'.format(path))
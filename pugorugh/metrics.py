@@ -0,0 +1,340 @@
+import json
+import os
+import tempfile
+import time
+from contextlib import ExitStack
+from threading import Lock
+
+from django.conf import settings
+from django.db import connections
+from django.http import Http404, HttpResponse
+
+from .authentication import token_cache
+from .candidates import CandidateQueue, candidate_sets
+from .catalog import dog_catalog
+from .fragments import dog_fragments
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+FILE_PREFIX = 'pugorugh_metrics_'
+UNMATCHED = 'unmatched'
+
+# cache stats holding current sizes, the others count events since start
+CACHE_GAUGES = frozenset(('size', 'ids', 'bytes'))
+
+
+def caches_stats():
+    """returns the integer counters of the process local caches"""
+    sources = {
+        'candidate_queue': CandidateQueue.stats(),
+        'candidate_sets': candidate_sets.stats(),
+        'dog_catalog': dog_catalog.stats(),
+        'dog_fragments': dog_fragments.stats(),
+        'token_cache': token_cache.stats(),
+        }
+    return {cache: {name: value for name, value in stats.items()
+                    if isinstance(value, int)}
+            for cache, stats in sources.items()}
+
+
+def alive(pid):
+    """True when a process with pid exists on this host"""
+    if os.name != 'posix':
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def counters_only(snapshot):
+    """returns snapshot without the CACHE_GAUGES of its caches"""
+    caches = snapshot.get('caches', {})
+    return dict(snapshot, caches={
+        cache: {stat: value for stat, value in stats.items()
+                if stat not in CACHE_GAUGES}
+        for cache, stats in caches.items()})
+
+
+def merge(total, snapshot):
+    """adds the counters of snapshot to total, both nested dicts"""
+    for key, value in snapshot.items():
+        if isinstance(value, dict):
+            merge(total.setdefault(key, {}), value)
+        elif isinstance(value, list):
+            counts = total.setdefault(key, [0] * len(value))
+            for index, count in enumerate(value):
+                counts[index] += count
+        else:
+            total[key] = total.get(key, 0) + value
+    return total
+
+
+def label(value):
+    """escapes value for a Prometheus label"""
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace(
+        '\n', r'\n')
+
+
+class Metrics:
+    """
+    class encapsulates the request and SQL metrics of this process
+
+    per view (the URL name, else the view path) it counts requests by
+    method and status, a latency histogram, SQL statements and seconds
+    spent in the database. counters are plain ints under a lock, recording
+    a request costs a few dict updates.
+
+    with settings.PUGORUGH_METRICS_DIR set every process writes its
+    counters to its own file there at most every
+    PUGORUGH_METRICS_FLUSH_INTERVAL seconds (atomically, by rename) and
+    snapshot() sums the files of every worker. like the multiprocess mode
+    of prometheus_client the counters of stopped workers are kept, so
+    totals never go backwards, while their cache gauges are dropped once
+    the pid no longer exists. the directory is shared by the workers of
+    one host and emptied on deploy. without it only the counters of the
+    serving process are reported.
+
+    attributes:
+        data
+            counters since start, JSON serializable
+
+    methods:
+        enabled, buckets, directory, record, local, flush, snapshot,
+        render, reset
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._flushed = 0.0
+        self.data = {}
+
+    @staticmethod
+    def enabled():
+        """True when settings.PUGORUGH_METRICS is on"""
+        return getattr(settings, 'PUGORUGH_METRICS', False)
+
+    @staticmethod
+    def buckets():
+        """returns the upper bounds of the latency histogram in seconds"""
+        return tuple(getattr(settings, 'PUGORUGH_METRICS_BUCKETS',
+                             DEFAULT_BUCKETS))
+
+    @staticmethod
+    def directory():
+        return getattr(settings, 'PUGORUGH_METRICS_DIR', None)
+
+    def record(self, view, method, status, seconds, queries, query_seconds):
+        """
+        counts one request
+
+        :argument view: name of the view, see MetricsMiddleware
+        :argument seconds: latency of the request
+        :argument queries: SQL statements executed
+        :argument query_seconds: time spent executing them
+        """
+        buckets = self.buckets()
+        slot = next((index for index, bound in enumerate(buckets)
+                     if seconds <= bound), len(buckets))
+        with self._lock:
+            views = self.data.setdefault('views', {})
+            entry = views.get(view)
+            if entry is None:
+                entry = views[view] = {
+                    'requests': {}, 'buckets': [0] * (len(buckets) + 1),
+                    'seconds': 0.0, 'queries': 0, 'query_seconds': 0.0,
+                    }
+            key = '{} {}'.format(method, status)
+            entry['requests'][key] = entry['requests'].get(key, 0) + 1
+            entry['buckets'][slot] += 1
+            entry['seconds'] += seconds
+            entry['queries'] += queries
+            entry['query_seconds'] += query_seconds
+        self.flush()
+
+    def local(self):
+        """returns a copy of this process' counters with its cache stats"""
+        with self._lock:
+            data = json.loads(json.dumps(self.data))
+        data['caches'] = caches_stats()
+        return data
+
+    def flush(self, force=False):
+        """
+        writes this process' counters to PUGORUGH_METRICS_DIR
+
+        skipped until PUGORUGH_METRICS_FLUSH_INTERVAL seconds passed since
+        the last write, unless force
+        """
+        directory = self.directory()
+        if not directory:
+            return
+        now = time.monotonic()
+        interval = getattr(settings, 'PUGORUGH_METRICS_FLUSH_INTERVAL', 5)
+        if not force and now - self._flushed < interval:
+            return
+        self._flushed = now
+        os.makedirs(directory, exist_ok=True)
+        fd, temporary = tempfile.mkstemp(dir=directory, prefix='.tmp')
+        with os.fdopen(fd, 'w') as fp:
+            json.dump(self.local(), fp)
+        os.replace(temporary, os.path.join(
+            directory, '{}{}.json'.format(FILE_PREFIX, os.getpid())))
+
+    def snapshot(self):
+        """
+        returns the counters of every worker, or of this process only
+        without PUGORUGH_METRICS_DIR. cache gauges of workers whose pid is
+        gone are left out
+
+        :rtype: dict
+        """
+        directory = self.directory()
+        if not directory:
+            return self.local()
+        self.flush(force=True)
+        total = {}
+        for name in sorted(os.listdir(directory)):
+            if not name.startswith(FILE_PREFIX):
+                continue
+            try:
+                with open(os.path.join(directory, name)) as fp:
+                    data = json.load(fp)
+            except (OSError, ValueError):
+                continue  # replaced or removed while reading
+            pid = name[len(FILE_PREFIX):-len('.json')]
+            if pid.isdigit() and not alive(int(pid)):
+                data = counters_only(data)
+            merge(total, data)
+        return total
+
+    def render(self):
+        """
+        returns the snapshot in the Prometheus text exposition format
+
+        :rtype: str
+        """
+        data = self.snapshot()
+        views = data.get('views', {})
+        lines = []
+
+        def family(name, kind, text):
+            lines.append('# HELP pugorugh_{} {}'.format(name, text))
+            lines.append('# TYPE pugorugh_{} {}'.format(name, kind))
+
+        family('requests_total', 'counter', 'Requests by view and status.')
+        for view, entry in sorted(views.items()):
+            for key, count in sorted(entry['requests'].items()):
+                method, status = key.split(' ')
+                lines.append(
+                    'pugorugh_requests_total{{view="{}",method="{}",'
+                    'status="{}"}} {}'.format(label(view), label(method),
+                                              status, count))
+
+        family('request_duration_seconds', 'histogram',
+               'Request latency by view.')
+        bounds = [repr(float(bound)) for bound in self.buckets()] + ['+Inf']
+        for view, entry in sorted(views.items()):
+            cumulative = 0
+            for bound, count in zip(bounds, entry['buckets']):
+                cumulative += count
+                lines.append(
+                    'pugorugh_request_duration_seconds_bucket{{view="{}",'
+                    'le="{}"}} {}'.format(label(view), bound, cumulative))
+            lines.append('pugorugh_request_duration_seconds_sum{{view="{}"}}'
+                         ' {}'.format(label(view), entry['seconds']))
+            lines.append('pugorugh_request_duration_seconds_count{{view="{}"'
+                         '}} {}'.format(label(view), cumulative))
+
+        for name, key, text in (
+                ('sql_queries_total', 'queries', 'SQL statements by view.'),
+                ('sql_duration_seconds_total', 'query_seconds',
+                 'Seconds spent executing SQL by view.')):
+            family(name, 'counter', text)
+            for view, entry in sorted(views.items()):
+                lines.append('pugorugh_{}{{view="{}"}} {}'.format(
+                    name, label(view), entry[key]))
+
+        caches = sorted(data.get('caches', {}).items())
+        family('cache_events_total', 'counter',
+               'Process local cache events summed over workers.')
+        for cache, stats in caches:
+            for stat, value in sorted(stats.items()):
+                if stat not in CACHE_GAUGES:
+                    lines.append(
+                        'pugorugh_cache_events_total{{cache="{}",'
+                        'event="{}"}} {}'.format(cache, stat, value))
+        family('cache', 'gauge',
+               'Process local cache sizes summed over live workers.')
+        for cache, stats in caches:
+            for stat, value in sorted(stats.items()):
+                if stat in CACHE_GAUGES:
+                    lines.append('pugorugh_cache{{cache="{}",stat="{}"}} {}'
+                                 .format(cache, stat, value))
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        """drops this process' counters"""
+        with self._lock:
+            self.data = {}
+
+
+metrics = Metrics()
+
+
+class MetricsMiddleware:
+    """
+    Middleware recording the latency and SQL statements of every request
+
+    statements are counted and timed by a connection.execute_wrapper
+    installed on every database connection for the request, the view is
+    the URL name of request.resolver_match, requests matching no URL are
+    counted as `unmatched`. see Metrics for storage and aggregation.
+
+    place it first in settings.MIDDLEWARE to include the other middleware
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not metrics.enabled():
+            return self.get_response(request)
+
+        statements = {'queries': 0, 'seconds': 0.0}
+
+        def execute_wrapper(execute, sql, params, many, context):
+            started = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                statements['queries'] += 1
+                statements['seconds'] += time.perf_counter() - started
+
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(
+                    execute_wrapper))
+            response = self.get_response(request)
+        seconds = time.perf_counter() - started
+
+        match = getattr(request, 'resolver_match', None)
+        metrics.record(match.view_name if match else UNMATCHED,
+                       request.method, response.status_code, seconds,
+                       statements['queries'], statements['seconds'])
+        return response
+
+
+def serve(request):
+    """
+    returns the metrics as Prometheus text to clients in INTERNAL_IPS
+
+    other clients get a 404, the endpoint is not advertised
+    """
+    if request.META.get('REMOTE_ADDR') not in settings.INTERNAL_IPS:
+        raise Http404
+    return HttpResponse(metrics.render(), content_type=CONTENT_TYPE)
@@ -0,0 +1,61 @@
+# Generated by Django 3.0.5 on 2026-10-18 12:24
+
+from django.db import migrations, models, transaction
+
+BACKFILL_CHUNK = 5000
+
+# frozen copy of Dog.AGE_RANGES at the time of this migration
+AGE_RANGES = {
+    'b': (None, 18),
+    'y': (19, 36),
+    'a': (37, 56),
+    's': (57, None),
+    }
+
+
+def backfill_age_group(apps, schema_editor):
+    """
+    sets Dog.age_group with one UPDATE per age group per chunk of ids
+
+    every chunk is committed on its own, the migration is not atomic, so
+    locks and journal growth are bounded by BACKFILL_CHUNK rows. the
+    backfill is idempotent: after an interrupted run the column exists,
+    call backfill_age_group again and `migrate --fake` this migration
+    """
+    alias = schema_editor.connection.alias
+    Dog = apps.get_model('pugorugh', 'Dog')
+    dogs = Dog.objects.using(alias)
+    last_id = dogs.order_by('-pk').values_list('pk', flat=True).first() or 0
+
+    for start in range(0, last_id, BACKFILL_CHUNK):
+        chunk = dogs.filter(pk__gt=start, pk__lte=start + BACKFILL_CHUNK)
+        with transaction.atomic(using=alias):
+            for code, (low, high) in AGE_RANGES.items():
+                rows = chunk
+                if low is not None:
+                    rows = rows.filter(age__gte=low)
+                if high is not None:
+                    rows = rows.filter(age__lte=high)
+                rows.update(age_group=code)
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('pugorugh', '0001_initial'),
+        ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dog',
+            name='age_group',
+            field=models.CharField(
+                blank=True,
+                choices=[('b', 'Baby'), ('y', 'Young'), ('a', 'Adult'),
+                         ('s', 'Senior')],
+                db_index=True, default='', max_length=1),
+            ),
+        migrations.RunPython(backfill_age_group, migrations.RunPython.noop),
+        ]
@@ -0,0 +1,48 @@
+# Generated by Django 3.0.5 on 2026-10-18 12:25
+
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def dedupe_userdogs(apps, schema_editor):
+    """
+    removes duplicate UserDog rows ahead of the (user, dog) constraint
+
+    the most recently written row (highest id) of each duplicated
+    (user, dog) pair is kept
+    """
+    UserDog = apps.get_model('pugorugh', 'UserDog')
+    userdogs = UserDog.objects.using(schema_editor.connection.alias)
+    duplicates = userdogs.values('user', 'dog').annotate(
+        rows=Count('id'), keep=Max('id')).filter(rows__gt=1).order_by()
+
+    for pair in duplicates.iterator():
+        userdogs.filter(user=pair['user'], dog=pair['dog']).exclude(
+            pk=pair['keep']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pugorugh', '0002_dog_age_group'),
+        ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='dog',
+            index=models.Index(fields=['size', 'gender', 'age_group', 'id'],
+                               name='dog_size_gender_age_id_idx'),
+            ),
+        migrations.AddIndex(
+            model_name='userdog',
+            index=models.Index(fields=['user', 'status', 'dog'],
+                               name='userdog_user_status_dog_idx'),
+            ),
+        migrations.RunPython(dedupe_userdogs, migrations.RunPython.noop,
+                             hints={'model_name': 'userdog'}),
+        migrations.AddConstraint(
+            model_name='userdog',
+            constraint=models.UniqueConstraint(
+                fields=('user', 'dog'), name='userdog_unique_user_dog'),
+            ),
+        ]
@@ -0,0 +1,30 @@
+# Generated by Django 3.0.5 on 2026-10-18 12:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pugorugh', '0003_swipe_indexes'),
+        ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dog',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', max_length=40),
+            ),
+        migrations.AddField(
+            model_name='dog',
+            name='external_id',
+            field=models.CharField(blank=True, max_length=64, null=True,
+                                   unique=True),
+            ),
+        migrations.AlterField(
+            model_name='dog',
+            name='image_filename',
+            field=models.CharField(blank=True, db_index=True, default='',
+                                   max_length=100),
+            ),
+        ]
@@ -0,0 +1,118 @@
+# Generated by Django 3.0.5 on 2026-10-18 12:36
+
+from django.db import migrations, models, transaction
+
+BACKFILL_CHUNK = 5000
+
+# frozen copies of Dog.AGE_BITS, GENDER_BITS and SIZE_BITS at the time of
+# this migration, keyed by the Dog and UserPref column they encode
+AGE_BITS = {'b': 1, 'y': 2, 'a': 4, 's': 8}
+GENDER_BITS = {'m': 1, 'f': 2, 'u': 4}
+SIZE_BITS = {'s': 1, 'm': 2, 'l': 4, 'xl': 8, 'u': 16}
+
+DOG_BITS = (
+    ('age_group', 'age_bit', AGE_BITS),
+    ('gender', 'gender_bit', GENDER_BITS),
+    ('size', 'size_bit', SIZE_BITS),
+    )
+PREFERENCE_MASKS = (
+    ('age', 'age_mask', AGE_BITS),
+    ('gender', 'gender_mask', GENDER_BITS),
+    ('size', 'size_mask', SIZE_BITS),
+    )
+
+
+def encode_mask(value, bits):
+    mask = 0
+    for code in value.split(','):
+        mask |= bits.get(code.strip(), 0)
+    return mask
+
+
+def backfill_bits(apps, schema_editor):
+    """
+    sets the Dog bit columns with one UPDATE per code per chunk of ids and
+    encodes every UserPref into its mask columns
+
+    the migration is not atomic, each chunk of dogs and each batch of
+    preferences commits separately. rerunning the backfill is harmless,
+    finish an interrupted run by calling it and faking the migration
+    """
+    alias = schema_editor.connection.alias
+    Dog = apps.get_model('pugorugh', 'Dog')
+    dogs = Dog.objects.using(alias)
+    last_id = dogs.order_by('-pk').values_list('pk', flat=True).first() or 0
+    for start in range(0, last_id, BACKFILL_CHUNK):
+        chunk = dogs.filter(pk__gt=start, pk__lte=start + BACKFILL_CHUNK)
+        with transaction.atomic(using=alias):
+            for field, bit_field, bits in DOG_BITS:
+                for code, bit in bits.items():
+                    chunk.filter(**{field: code}).update(**{bit_field: bit})
+
+    UserPref = apps.get_model('pugorugh', 'UserPref')
+    batch = []
+    for preference in UserPref.objects.using(alias).iterator():
+        for field, mask_field, bits in PREFERENCE_MASKS:
+            setattr(preference, mask_field,
+                    encode_mask(getattr(preference, field), bits))
+        batch.append(preference)
+        if len(batch) >= BACKFILL_CHUNK:
+            UserPref.objects.using(alias).bulk_update(
+                batch, [mask for _, mask, _ in PREFERENCE_MASKS])
+            batch = []
+    if batch:
+        UserPref.objects.using(alias).bulk_update(
+            batch, [mask for _, mask, _ in PREFERENCE_MASKS])
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('pugorugh', '0004_dog_sync_fields'),
+        ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='dog',
+            name='dog_size_gender_age_id_idx',
+            ),
+        migrations.AddField(
+            model_name='dog',
+            name='age_bit',
+            field=models.PositiveSmallIntegerField(default=0),
+            ),
+        migrations.AddField(
+            model_name='dog',
+            name='gender_bit',
+            field=models.PositiveSmallIntegerField(default=0),
+            ),
+        migrations.AddField(
+            model_name='dog',
+            name='size_bit',
+            field=models.PositiveSmallIntegerField(default=0),
+            ),
+        migrations.AddField(
+            model_name='userpref',
+            name='age_mask',
+            field=models.PositiveSmallIntegerField(default=0),
+            ),
+        migrations.AddField(
+            model_name='userpref',
+            name='gender_mask',
+            field=models.PositiveSmallIntegerField(default=0),
+            ),
+        migrations.AddField(
+            model_name='userpref',
+            name='size_mask',
+            field=models.PositiveSmallIntegerField(default=0),
+            ),
+        migrations.RunPython(backfill_bits, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='dog',
+            index=models.Index(fields=['size_bit', 'gender_bit', 'age_bit',
+                                       'id'],
+                               name='dog_bits_id_idx'),
+            ),
+        ]
@@ -0,0 +1,35 @@
+# Generated by Django 3.0.5 on 2026-10-18 12:42
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('pugorugh', '0005_preference_bitmasks'),
+        ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='userdog',
+            name='dog',
+            field=models.ForeignKey(
+                db_constraint=False, null=True,
+                on_delete=django.db.models.deletion.DO_NOTHING,
+                related_name='users_dog',
+                related_query_name='user_dogs_query', to='pugorugh.Dog'),
+            ),
+        migrations.AlterField(
+            model_name='userdog',
+            name='user',
+            field=models.ForeignKey(
+                db_constraint=False, null=True,
+                on_delete=django.db.models.deletion.DO_NOTHING,
+                related_name='dogs_user',
+                related_query_name='dogs_user_query',
+                to=settings.AUTH_USER_MODEL),
+            ),
+        ]
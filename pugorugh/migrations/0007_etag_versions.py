@@ -0,0 +1,34 @@
+# Generated by Django 3.0.5 on 2026-10-18 12:54
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pugorugh', '0006_userdog_shardable'),
+        ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dog',
+            name='updated_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+            ),
+        migrations.AddField(
+            model_name='dog',
+            name='version',
+            field=models.PositiveIntegerField(default=1),
+            ),
+        migrations.AddField(
+            model_name='userpref',
+            name='updated_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+            ),
+        migrations.AddField(
+            model_name='userpref',
+            name='version',
+            field=models.PositiveIntegerField(default=1),
+            ),
+        ]
@@ -0,0 +1,92 @@
+# Generated by Django 3.0.5 on 2026-10-18 13:20
+
+from django.conf import settings
+from django.db import migrations, models, router
+import django.db.models.deletion
+
+# router hints of the operations adding the UserDog foreign key constraints,
+# UserDog shards hold no users and dogs and are skipped, see
+# pugorugh.routers.PugorughRouter.allow_migrate
+CONSTRAINT_HINTS = {'model_name': 'userdog', 'foreign_key_constraints': True}
+
+
+class AlterForeignKey(migrations.AlterField):
+    """
+    AlterField applied to the databases the router allows
+    CONSTRAINT_HINTS, the field state changes everywhere
+    """
+
+    def allowed(self, schema_editor):
+        return router.allow_migrate(schema_editor.connection.alias,
+                                    'pugorugh', **CONSTRAINT_HINTS)
+
+    def database_forwards(self, app_label, schema_editor, from_state,
+                          to_state):
+        if self.allowed(schema_editor):
+            super().database_forwards(app_label, schema_editor, from_state,
+                                      to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state,
+                           to_state):
+        if self.allowed(schema_editor):
+            super().database_backwards(app_label, schema_editor, from_state,
+                                       to_state)
+
+
+def create_cascade_table(apps, schema_editor):
+    """
+    creates the empty UserDog table the ORM cascade reads in a default
+    database migrated while UserDog rows lived only in the shards
+    """
+    UserDog = apps.get_model('pugorugh', 'UserDog')
+    connection = schema_editor.connection
+    if UserDog._meta.db_table not in connection.introspection.table_names():
+        schema_editor.create_model(UserDog)
+
+
+def delete_orphans(apps, schema_editor):
+    """
+    deletes the UserDog rows of deleted users or dogs, left behind while
+    the keys were unconstrained, the constraints added below reject them
+    """
+    alias = schema_editor.connection.alias
+    UserDog = apps.get_model('pugorugh', 'UserDog')
+    Dog = apps.get_model('pugorugh', 'Dog')
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+    rows = UserDog.objects.using(alias)
+    rows.filter(dog_id__isnull=False).exclude(
+        dog_id__in=Dog.objects.using(alias).values('pk')).delete()
+    rows.filter(user_id__isnull=False).exclude(
+        user_id__in=User.objects.using(alias).values('pk')).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('pugorugh', '0007_etag_versions'),
+        ]
+
+    operations = [
+        migrations.RunPython(create_cascade_table, migrations.RunPython.noop,
+                             hints=CONSTRAINT_HINTS),
+        migrations.RunPython(delete_orphans, migrations.RunPython.noop,
+                             hints=CONSTRAINT_HINTS),
+        AlterForeignKey(
+            model_name='userdog',
+            name='dog',
+            field=models.ForeignKey(
+                null=True, on_delete=django.db.models.deletion.CASCADE,
+                related_name='users_dog',
+                related_query_name='user_dogs_query', to='pugorugh.Dog'),
+            ),
+        AlterForeignKey(
+            model_name='userdog',
+            name='user',
+            field=models.ForeignKey(
+                null=True, on_delete=django.db.models.deletion.CASCADE,
+                related_name='dogs_user',
+                related_query_name='dogs_user_query',
+                to=settings.AUTH_USER_MODEL),
+            ),
+        ]
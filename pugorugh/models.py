@@ -1,7 +1,74 @@
 from itertools import chain
 
+from django.conf import settings
 from django.contrib.auth.models import User
-from django.db import models
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections, models, transaction
+from django.db.models import F
+from django.db.models.query_utils import Q
+from django.utils import timezone
+
+from .routers import shard_for, sharded
+
+# MASK_BITS[mask] is the tuple of single bits set in mask, precomputed for
+# every mask of up to five bits so decoding a preference is one lookup
+MASK_BITS = tuple(
+    tuple(1 << bit for bit in range(5) if mask >> bit & 1)
+    for mask in range(1 << 5))
+
+
+def encode_mask(value, bits):
+    """
+    returns the bitmask of the comma separated codes in value
+
+    surrounding whitespace is ignored and unknown codes are skipped
+
+    :argument value: str such as 'm, f'
+    :argument bits: dict mapping codes to single bits, e.g. Dog.GENDER_BITS
+    :rtype: int
+    """
+    mask = 0
+    for code in value.split(','):
+        mask |= bits.get(code.strip(), 0)
+    return mask
+
+
+class DogManager(models.Manager):
+    """
+    manager for Dog keeping the derived code columns in sync on bulk writes
+
+    subclasses django.db.models.Manager
+
+    Method:
+        bulk_create, bulk_update
+    """
+
+    def bulk_create(self, objs, *args, **kwargs):
+        """bulk_create skips Dog.save(), so the codes are derived here"""
+        objs = list(objs)
+        for dog in objs:
+            dog.sync_codes()
+        return super().bulk_create(objs, *args, **kwargs)
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        """
+        bulk_update skips Dog.save(), so the codes are derived and the
+        version is bumped here
+
+        the version is incremented in the database, afterwards the version
+        attribute of objs holds that expression, reload them to read it
+        """
+        objs = list(objs)
+        derived = Dog.derived_fields(fields)
+        now = timezone.now()
+        for dog in objs:
+            if derived:
+                dog.sync_codes()
+            dog.version = F('version') + 1
+            dog.updated_at = now
+        fields = list(fields) + derived + [
+            field for field in Dog.VERSION_FIELDS if field not in fields]
+        return super().bulk_update(objs, fields, *args, **kwargs)
 
 
 class Dog(models.Model):
@@ -42,6 +109,20 @@ class Dog(models.Model):
             list of two tuples defining available
             attribute values for Dog objects size
 
+        AGE_CHOICES: list()
+            list of two tuples defining available
+            attribute values for Dog objects age_group
+
+        AGE_RANGES: dict()
+            inclusive (low, high) months per age group, None is open ended
+
+        AGE_BITS, GENDER_BITS, SIZE_BITS: dict()
+            single bit code of every age group, gender and size value,
+            UserPref masks are the OR of the bits of the selected values
+
+        DERIVED_FIELDS: dict()
+            columns derived from each source column by sync_codes
+
         name: django ORM CharField obj()
             defines database column for Dogs name
 
@@ -61,6 +142,31 @@ class Dog(models.Model):
         size:  django ORM CharField obj()
             defines database column for Dog size
             :argument SIZE_CHOICES
+
+        age_group: django ORM CharField obj()
+            indexed database column for the age group derived from age
+            :argument AGE_CHOICES
+
+        external_id: django ORM CharField obj()
+            optional unique id of the dog in the source catalog feed
+
+        content_hash: django ORM CharField obj()
+            hash of the source record last synced into this row
+
+        age_bit, gender_bit, size_bit: django ORM PositiveSmallIntegerField
+            single bit codes of age_group, gender and size, matched against
+            UserPref masks
+
+        version: django ORM PositiveIntegerField
+            incremented by every save() and DogManager.bulk_update, drives
+            the ETag of the dog payload
+
+        updated_at: django ORM DateTimeField
+            time of the last change, the Last-Modified of the status
+            payload, the next dog payload carries only the ETag
+
+    Method:
+        age_group_for, derived_fields, sync_codes, save
     """
     BABY = 'b'
     YOUNG = 'y'
@@ -88,8 +194,34 @@ class Dog(models.Model):
         (UNKNOWN, 'Unknown')
         ]
 
+    AGE_CHOICES = [
+        (BABY, 'Baby'),
+        (YOUNG, 'Young'),
+        (ADULT, 'Adult'),
+        (SENIOR, 'Senior')
+        ]
+
+    AGE_RANGES = {
+        BABY: (None, 18),
+        YOUNG: (19, 36),
+        ADULT: (37, 56),
+        SENIOR: (57, None),
+        }
+
+    AGE_BITS = {BABY: 1, YOUNG: 2, ADULT: 4, SENIOR: 8}
+    GENDER_BITS = {MALE: 1, FEMALE: 2, UNKNOWN: 4}
+    SIZE_BITS = {SMALL: 1, MEDIUM: 2, LARGE: 4, X_LARGE: 8, UNKNOWN: 16}
+
+    DERIVED_FIELDS = {
+        'age': ['age_group', 'age_bit'],
+        'gender': ['gender_bit'],
+        'size': ['size_bit'],
+        }
+    VERSION_FIELDS = ['version', 'updated_at']
+
     name = models.CharField(max_length=50, blank=True, default='')
-    image_filename = models.CharField(max_length=100, blank=True, default='')
+    image_filename = models.CharField(max_length=100, blank=True, default='',
+                                      db_index=True)
     breed = models.CharField(max_length=50, default='')
     age = models.IntegerField()
     gender = models.CharField(
@@ -102,6 +234,212 @@ class Dog(models.Model):
         choices=SIZE_CHOICES,
         default=UNKNOWN
         )
+    age_group = models.CharField(
+        max_length=1,
+        choices=AGE_CHOICES,
+        default='',
+        blank=True,
+        db_index=True
+        )
+    external_id = models.CharField(max_length=64, null=True, blank=True,
+                                   unique=True)
+    content_hash = models.CharField(max_length=40, blank=True, default='')
+    age_bit = models.PositiveSmallIntegerField(default=0)
+    gender_bit = models.PositiveSmallIntegerField(default=0)
+    size_bit = models.PositiveSmallIntegerField(default=0)
+    version = models.PositiveIntegerField(default=1)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    objects = DogManager()
+
+    class Meta:
+        indexes = [
+            # serves the preference filter and the pk > X keyset of `next`
+            models.Index(fields=['size_bit', 'gender_bit', 'age_bit', 'id'],
+                         name='dog_bits_id_idx'),
+            ]
+
+    @classmethod
+    def age_group_for(cls, age):
+        """
+        returns the AGE_CHOICES code whose AGE_RANGES bucket holds age
+
+        :rtype: str
+        """
+        for code, (low, high) in cls.AGE_RANGES.items():
+            if (low is None or age >= low) and (high is None or age <= high):
+                return code
+        return ''
+
+    @classmethod
+    def derived_fields(cls, fields):
+        """
+        returns the columns derived from any of the source columns fields
+
+        :rtype: list
+        """
+        return [derived for field in fields
+                for derived in cls.DERIVED_FIELDS.get(field, ())]
+
+    def sync_codes(self):
+        """derives age_group and the bit code columns from their sources"""
+        self.age_group = self.age_group_for(self.age)
+        self.age_bit = self.AGE_BITS.get(self.age_group, 0)
+        self.gender_bit = self.GENDER_BITS.get(self.gender, 0)
+        self.size_bit = self.SIZE_BITS.get(self.size, 0)
+
+    def save(self, *args, **kwargs):
+        """
+        keeps the derived code columns in sync and bumps the version of an
+        existing row in the database, concurrent saves never share a version
+        """
+        self.sync_codes()
+        bump = not self._state.adding
+        if bump:
+            self.version = F('version') + 1
+        self.updated_at = timezone.now()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = set(update_fields) | set(
+                self.derived_fields(update_fields)) | set(self.VERSION_FIELDS)
+        super().save(*args, **kwargs)
+        if bump:
+            self.refresh_from_db(fields=['version'])
+
+
+class UserDogManager(models.Manager):
+    """
+    manager for UserDog adding set based fan out of dogs to users
+
+    subclasses django.db.models.Manager
+
+    Method:
+        for_user, fan_out, set_status, set_many_status
+    """
+    # sqlite caps bound parameters at 999 per statement
+    DOG_CHUNK = 500
+    # backends supporting INSERT ... ON CONFLICT DO UPDATE
+    UPSERT_VENDORS = ('sqlite', 'postgresql')
+
+    def for_user(self, user_id):
+        """
+        returns a manager bound to the database holding user_id's rows
+
+        the shard picked by routers.shard_for, or the default routing when
+        UserDog is not sharded
+        """
+        return self.db_manager(shard_for(user_id))
+
+    def _bound(self, user_id):
+        return self if self._db is not None else self.for_user(user_id)
+
+    def fan_out(self, dog_ids, batch_size=10000, start_user_id=0):
+        """
+        creates an undecided UserDog for every user and each dog in dog_ids
+
+        runs server side INSERT ... SELECT statements over windows of user
+        ids so at most ~batch_size rows are written per transaction and no
+        User is loaded into memory. rows that already exist are skipped, so
+        re-running is harmless and an interrupted run can resume from the
+        last user id returned.
+
+        :argument dog_ids: iterable of Dog primary keys
+        :argument batch_size: approximate rows written per statement
+        :argument start_user_id: only users with a greater id are processed
+        :rtype: generator yielding (last_user_id, rows_inserted) per batch
+        """
+        if sharded():
+            raise ImproperlyConfigured(
+                'UserDog fan out joins users and dogs in one database, '
+                'enable PUGORUGH_LAZY_USERDOGS when sharding UserDog')
+        dog_ids = sorted(set(dog_ids))
+        connection = connections[self.db]
+        quote = connection.ops.quote_name
+
+        for start in range(0, len(dog_ids), self.DOG_CHUNK):
+            chunk = dog_ids[start:start + self.DOG_CHUNK]
+            users_per_batch = max(1, batch_size // len(chunk))
+            sql = (
+                'INSERT INTO {ud} (user_id, dog_id, status) '
+                'SELECT u.id, d.id, %s FROM {user} u, {dog} d '
+                'WHERE u.id > %s AND u.id <= %s AND d.id IN ({ids}) '
+                'AND NOT EXISTS (SELECT 1 FROM {ud} x '
+                'WHERE x.user_id = u.id AND x.dog_id = d.id)'
+                ).format(
+                    ud=quote(self.model._meta.db_table),
+                    user=quote(User._meta.db_table),
+                    dog=quote(Dog._meta.db_table),
+                    ids=', '.join(['%s'] * len(chunk)),
+                    )
+            last_user_id = start_user_id
+            while True:
+                users = User.objects.using(self.db).filter(
+                    pk__gt=last_user_id).order_by('pk').values_list(
+                    'pk', flat=True)
+                upper = users[users_per_batch - 1:users_per_batch].first()
+                if upper is None:
+                    upper = users.last()
+                if upper is None:
+                    break
+                with transaction.atomic(using=self.db):
+                    with connection.cursor() as cursor:
+                        cursor.execute(sql, [self.model.UNDECIDED,
+                                             last_user_id, upper] + chunk)
+                        inserted = cursor.rowcount
+                last_user_id = upper
+                yield last_user_id, inserted
+
+    def set_status(self, user_id, dog_id, status):
+        """
+        sets the status of the user's UserDog for dog_id in one statement
+
+        the row is upserted and left untouched when the status is already
+        the same. in UserDog.lazy_mode() an undecided status deletes the row
+        instead. backends without upsert support fall back to an UPDATE
+        followed by an INSERT when no row exists yet
+        """
+        manager = self._bound(user_id)
+        rows = manager.filter(user_id=user_id, dog_id=dog_id)
+        if status == self.model.UNDECIDED and self.model.lazy_mode():
+            rows.delete()
+            return
+
+        connection = connections[manager.db]
+        if connection.vendor not in self.UPSERT_VENDORS:
+            if not rows.update(status=status):
+                manager.get_or_create(user_id=user_id, dog_id=dog_id,
+                                      defaults={'status': status})
+            return
+
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'INSERT INTO {table} (user_id, dog_id, status) '
+                'VALUES (%s, %s, %s) '
+                'ON CONFLICT (user_id, dog_id) DO UPDATE '
+                'SET status = excluded.status '
+                'WHERE {table}.status <> excluded.status'.format(table=table),
+                [user_id, dog_id, status])
+
+    def set_many_status(self, user_id, dog_ids, status):
+        """
+        sets the status of the user's UserDogs for every dog in dog_ids
+
+        missing rows are inserted with the status, then one grouped UPDATE
+        changes every existing row that differs. in UserDog.lazy_mode() an
+        undecided status deletes the rows instead
+        """
+        manager = self._bound(user_id)
+        rows = manager.filter(user_id=user_id, dog_id__in=dog_ids)
+        if status == self.model.UNDECIDED and self.model.lazy_mode():
+            rows.delete()
+            return
+
+        manager.bulk_create(
+            [self.model(user_id=user_id, dog_id=dog_id, status=status)
+             for dog_id in dog_ids],
+            ignore_conflicts=True)
+        rows.exclude(status=status).update(status=status)
 
 
 class UserDog(models.Model):
@@ -129,6 +467,14 @@ class UserDog(models.Model):
         status:  django ORM CharField obj()
             defines database column for UserDog status
             :argument DOG_STATUS
+
+        user and dog are constrained and cascaded. UserDog shards hold no
+        users and dogs, their tables are left unconstrained and their rows
+        deleted with their user or dog by pugorugh.signals, see
+        routers.PugorughRouter
+
+    Method:
+        lazy_mode
     """
     LIKED = 'l'
     DISLIKED = 'd'
@@ -153,7 +499,6 @@ class UserDog(models.Model):
         null=True,
         related_name='users_dog',
         related_query_name='user_dogs_query',
-
         on_delete=models.CASCADE
         )
 
@@ -163,6 +508,31 @@ class UserDog(models.Model):
         default=UNDECIDED
         )
 
+    objects = UserDogManager()
+
+    class Meta:
+        indexes = [
+            # covers the (user, status) lookups of `next`, dog_id included
+            models.Index(fields=['user', 'status', 'dog'],
+                         name='userdog_user_status_dog_idx'),
+            ]
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'dog'],
+                                    name='userdog_unique_user_dog'),
+            ]
+
+    @staticmethod
+    def lazy_mode():
+        """
+        True when UserDog rows are only written for liked/disliked dogs
+
+        controlled by settings.PUGORUGH_LAZY_USERDOGS, in lazy mode a missing
+        UserDog row means the dog is undecided for that user
+
+        :rtype: bool
+        """
+        return getattr(settings, 'PUGORUGH_LAZY_USERDOGS', False)
+
 
 class UserPref(models.Model):
     """
@@ -221,8 +591,27 @@ class UserPref(models.Model):
             defines database column for UserPref size
             :argument SIZE_CHOICES
 
+        MASK_FIELDS: dict()
+            maps each preference column to its mask column and the Dog bits
+            the mask is built from
+
+        age_mask, gender_mask, size_mask: django ORM
+        PositiveSmallIntegerField
+            bitmasks of the codes in age, gender and size, kept in sync by
+            save()
+
+        VERSION_FIELDS: list()
+            columns save() writes on every update
+
+        version: django ORM PositiveIntegerField
+            incremented by every save(), drives the preference ETag
+
+        updated_at: django ORM DateTimeField
+            time of the last change, the preference Last-Modified
+
     Method:
-        get_age_display
+        get_age_display, get_age_filter, get_filter, matches, sync_masks,
+        save
     """
     BABY = 'b'
     YOUNG = 'y'
@@ -285,6 +674,71 @@ class UserPref(models.Model):
         max_length=10
         )
 
+    age_mask = models.PositiveSmallIntegerField(default=0)
+    gender_mask = models.PositiveSmallIntegerField(default=0)
+    size_mask = models.PositiveSmallIntegerField(default=0)
+    version = models.PositiveIntegerField(default=1)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    MASK_FIELDS = {
+        'age': ('age_mask', Dog.AGE_BITS),
+        'gender': ('gender_mask', Dog.GENDER_BITS),
+        'size': ('size_mask', Dog.SIZE_BITS),
+        }
+    VERSION_FIELDS = ['version', 'updated_at']
+
+    def sync_masks(self):
+        """encodes age, gender and size into their mask columns"""
+        for field, (mask_field, bits) in self.MASK_FIELDS.items():
+            setattr(self, mask_field, encode_mask(getattr(self, field), bits))
+
+    def save(self, *args, **kwargs):
+        """
+        keeps the mask columns in sync and bumps the version of an existing
+        row in the database, concurrent saves never share a version
+        """
+        self.sync_masks()
+        bump = not self._state.adding
+        if bump:
+            self.version = F('version') + 1
+        self.updated_at = timezone.now()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = set(update_fields) | {
+                self.MASK_FIELDS[field][0] for field in update_fields
+                if field in self.MASK_FIELDS} | set(self.VERSION_FIELDS)
+        super().save(*args, **kwargs)
+        if bump:
+            self.refresh_from_db(fields=['version'])
+
+    def matches(self, dog):
+        """
+        True when dog's bit codes are all selected by the preference masks
+
+        :argument dog: Dog or any object with age_bit, gender_bit, size_bit
+        :rtype: bool
+        """
+        return bool(self.age_mask & dog.age_bit
+                    and self.gender_mask & dog.gender_bit
+                    and self.size_mask & dog.size_bit)
+
+    def get_filter(self):
+        """
+        converts the preference masks to a Q object filtering Dog
+
+        each mask is decoded with the MASK_BITS table into a small IN on
+        the indexed Dog bit columns. the age range predicates of
+        get_age_filter are used when settings.PUGORUGH_AGE_BUCKETS is off
+
+        :rtype: Q
+        """
+        if getattr(settings, 'PUGORUGH_AGE_BUCKETS', True):
+            age = Q(age_bit__in=MASK_BITS[self.age_mask])
+        else:
+            age = self.get_age_filter(bucketed=False)
+        return (age & Q(gender_bit__in=MASK_BITS[self.gender_mask])
+                & Q(size_bit__in=MASK_BITS[self.size_mask]))
+
     def get_age_display(self):
         """
         converts sequence of UserPref.age values to a frozenset of chained range
@@ -305,3 +759,31 @@ class UserPref(models.Model):
                     ls.append(range(57, 100))
         chained = frozenset(chain.from_iterable(ls))
         return chained
+
+    def get_age_filter(self, bucketed=None):
+        """
+        converts UserPref.age values to a Q object filtering Dog by age
+
+        bucketed filters are a small IN on the indexed Dog.age_group column,
+        otherwise one age range predicate per selected group is used.
+        defaults to settings.PUGORUGH_AGE_BUCKETS
+
+        :rtype: Q
+        """
+        if bucketed is None:
+            bucketed = getattr(settings, 'PUGORUGH_AGE_BUCKETS', True)
+        codes = [a.strip() for a in self.age.split(',')
+                 if a.strip() in Dog.AGE_RANGES]
+        if bucketed:
+            return Q(age_group__in=codes)
+
+        query = Q(pk__in=[])
+        for code in codes:
+            low, high = Dog.AGE_RANGES[code]
+            bounds = {}
+            if low is not None:
+                bounds['age__gte'] = low
+            if high is not None:
+                bounds['age__lte'] = high
+            query |= Q(**bounds)
+        return query
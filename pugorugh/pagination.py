@@ -0,0 +1,28 @@
+from rest_framework.pagination import CursorPagination
+
+
+class DogCursorPagination(CursorPagination):
+    """
+    keyset pagination over Dog primary keys for views.DogQueue
+
+    subclasses rest_framework.pagination.CursorPagination, pages are
+    fetched with `id > cursor ORDER BY id LIMIT n` and the cursor is an
+    opaque token in the `next` link
+
+    Attr overrides:
+        ordering
+            dogs are queued in primary key order like the `next` endpoint
+        page_size
+            default number of dogs per batch
+        page_size_query_param
+            query parameter a client uses to ask for a smaller or larger batch
+        max_page_size
+            upper bound on `limit`
+
+    See `DRF_CursorPagination <https://www.django-rest-framework.org/
+    api-guide/pagination/#cursorpagination>`_ for info
+    """
+    ordering = 'id'
+    page_size = 20
+    page_size_query_param = 'limit'
+    max_page_size = 100
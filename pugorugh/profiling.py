@@ -0,0 +1,129 @@
+import cProfile
+import os
+import random
+import re
+import time
+from threading import Lock
+
+from django.conf import settings
+from rest_framework.exceptions import AuthenticationFailed
+
+from .authentication import CachedTokenAuthentication
+
+UNMATCHED = 'unmatched'
+SUFFIX = '.pstats'
+
+# one profiled request per process at a time, cProfile may not nest
+_profiling = Lock()
+
+
+def enabled():
+    """True when settings.PUGORUGH_PROFILING is on"""
+    return getattr(settings, 'PUGORUGH_PROFILING', False)
+
+
+def profile_dir():
+    """returns settings.PUGORUGH_PROFILE_DIR"""
+    return getattr(settings, 'PUGORUGH_PROFILE_DIR',
+                   os.path.join(settings.BASE_DIR, 'profiles'))
+
+
+def view_dir(view):
+    """returns the directory of the profiles of view, a safe file name"""
+    return os.path.join(profile_dir(), re.sub(r'[^\w.-]', '_', view))
+
+
+def save(profiler, view):
+    """
+    writes the stats of profiler for view and rotates the view's directory
+
+    at most settings.PUGORUGH_PROFILE_KEEP files are kept per view, the
+    oldest are removed
+
+    :rtype: str, path of the written file
+    """
+    directory = view_dir(view)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, '{}-{}{}'.format(
+        time.time_ns(), os.getpid(), SUFFIX))
+    profiler.dump_stats(path)
+
+    keep = getattr(settings, 'PUGORUGH_PROFILE_KEEP', 50)
+    files = sorted(name for name in os.listdir(directory)
+                   if name.endswith(SUFFIX))
+    for name in files[:max(len(files) - keep, 0)]:
+        try:
+            os.remove(os.path.join(directory, name))
+        except FileNotFoundError:
+            pass  # rotated by another worker
+    return path
+
+
+class ProfilingMiddleware:
+    """
+    Middleware running cProfile on sampled or requested requests
+
+    with settings.PUGORUGH_PROFILING on, a request is profiled with
+    probability PUGORUGH_PROFILE_SAMPLE_RATE, or when it carries the
+    PUGORUGH_PROFILE_HEADER header (e.g. `X-Profile: 1`) and is
+    authenticated, by session or API token, as a staff user listed in
+    PUGORUGH_PROFILE_USERS. requested profiles are named in the X-Profile
+    response header.
+
+    stats are written to PUGORUGH_PROFILE_DIR/<view name>/, see save,
+    and aggregated by `python manage.py profile_report`. requests arriving
+    while another request of the process is profiled are not profiled.
+
+    place it after AuthenticationMiddleware
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    @staticmethod
+    def requested(request):
+        """True when request asks for a profile as an allowlisted admin"""
+        header = getattr(settings, 'PUGORUGH_PROFILE_HEADER',
+                         'HTTP_X_PROFILE')
+        if not request.META.get(header):
+            return False
+        user = getattr(request, 'user', None)
+        if user is None or not user.is_authenticated:
+            try:
+                pair = CachedTokenAuthentication().authenticate(request)
+            except AuthenticationFailed:
+                return False
+            if pair is None:
+                return False
+            user = pair[0]
+        return user.is_staff and user.get_username() in getattr(
+            settings, 'PUGORUGH_PROFILE_USERS', ())
+
+    @staticmethod
+    def sampled():
+        rate = getattr(settings, 'PUGORUGH_PROFILE_SAMPLE_RATE', 0.0)
+        return rate > 0 and random.random() < rate
+
+    def __call__(self, request):
+        if not enabled():
+            return self.get_response(request)
+        requested = self.requested(request)
+        if not (requested or self.sampled()) or not _profiling.acquire(
+                blocking=False):
+            return self.get_response(request)
+
+        try:
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.disable()
+        finally:
+            _profiling.release()
+
+        match = getattr(request, 'resolver_match', None)
+        path = save(profiler, match.view_name if match else UNMATCHED)
+        if requested:
+            response['X-Profile'] = os.path.relpath(path, profile_dir())
+        return response
@@ -0,0 +1,74 @@
+from rest_framework.renderers import BrowsableAPIRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:  # the fast renderer falls back to the stdlib encoder
+    orjson = None
+
+# dates, times and dataclasses are formatted by DRF's JSONEncoder.default
+OPTIONS = (orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+           | orjson.OPT_NON_STR_KEYS) if orjson else 0
+
+
+class JSONFragment(dict):
+    """
+    dict carrying its own compact JSON rendering
+
+    FastJSONRenderer returns raw as is when the fragment is the whole
+    payload, other renderers and indented or ASCII only output see a plain
+    dict. raw must be FastJSONRenderer's rendering of the dict
+
+    attributes:
+        raw
+            the rendered bytes
+    """
+
+    def __init__(self, data, raw):
+        super().__init__(data)
+        self.raw = raw
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSON renderer encoding compact payloads with orjson when installed
+
+    the output is byte identical to JSONRenderer's for JSON native types,
+    dates, times, decimals and lazy strings: \\u2028 and \\u2029 are escaped
+    the same way and values orjson does not handle go through DRF's
+    JSONEncoder.default. indented, ASCII only or non compact output, data
+    orjson rejects (e.g. integers beyond 64 bits) and installs without
+    orjson are rendered by JSONRenderer. a JSONFragment payload is not
+    encoded again, its raw bytes are returned.
+
+    floats in exponent notation are spelled differently by orjson (1e16
+    rather than 1e+16) and NaN becomes null instead of an error, use it
+    for payloads without floats such as DogSerializer's
+
+    subclasses rest_framework.renderers.JSONRenderer
+
+    method overrides:
+        render
+    """
+    encoder = JSONEncoder()
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (data is None or self.ensure_ascii or not self.compact
+                or self.get_indent(accepted_media_type,
+                                   renderer_context or {}) is not None):
+            return super().render(data, accepted_media_type, renderer_context)
+        if isinstance(data, JSONFragment):
+            return data.raw
+        if orjson is None:
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(data, default=self.encoder.default,
+                               option=OPTIONS)
+        except TypeError:  # orjson.JSONEncodeError
+            return super().render(data, accepted_media_type, renderer_context)
+        return ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(
+            b'\xe2\x80\xa9', b'\\u2029')
+
+
+# renderer_classes of the dog payload views
+DOG_RENDERERS = (FastJSONRenderer, BrowsableAPIRenderer)
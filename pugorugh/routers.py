@@ -0,0 +1,127 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+# True while a read only view is handled, see views.ReplicaReadMixin
+replica_reads = ContextVar('pugorugh_replica_reads', default=False)
+
+USERDOG = 'pugorugh.userdog'
+
+
+def replica():
+    """returns the alias of settings.PUGORUGH_READ_REPLICA or None"""
+    return getattr(settings, 'PUGORUGH_READ_REPLICA', None)
+
+
+def shards():
+    """returns the aliases of settings.PUGORUGH_USERDOG_SHARDS"""
+    return list(getattr(settings, 'PUGORUGH_USERDOG_SHARDS', ()))
+
+
+def sharded():
+    """True when UserDog rows live outside the default database"""
+    return any(alias != DEFAULT_DB_ALIAS for alias in shards())
+
+
+def userdog_aliases():
+    """returns every alias holding UserDog rows"""
+    return shards() or [DEFAULT_DB_ALIAS]
+
+
+def shard_for(user_id):
+    """
+    returns the alias holding the UserDog rows of user_id
+
+    the shard is user_id modulo the number of shards, None when UserDog is
+    not sharded or user_id is unknown
+
+    :rtype: str
+    """
+    aliases = shards()
+    if not aliases or user_id is None:
+        return None
+    return aliases[int(user_id) % len(aliases)]
+
+
+@contextmanager
+def read_from_replica():
+    """routes the reads of the enclosed block to the read replica"""
+    token = replica_reads.set(True)
+    try:
+        yield
+    finally:
+        replica_reads.reset(token)
+
+
+class PugorughRouter:
+    """
+    class encapsulates routing to a read replica and UserDog shards
+
+    with settings.PUGORUGH_USERDOG_SHARDS listing database aliases, UserDog
+    rows live in the alias picked by shard_for(user_id) and every other
+    model in the default database. UserDog queries are pinned to a shard
+    with UserDog.objects.for_user(user_id), model instances are routed
+    through the `instance` hint. UserDog is never joined with users and
+    dogs of another database.
+
+    the UserDog foreign keys are constrained and cascaded. the default
+    database keeps an empty UserDog table for the cascade of the ORM,
+    migrations hinting `foreign_key_constraints` are not applied to the
+    shards, which hold no users and dogs to reference, their rows are
+    deleted by pugorugh.signals instead.
+
+    with settings.PUGORUGH_READ_REPLICA naming an alias, reads other than
+    UserDog are sent to it while replica_reads is set, e.g. by
+    read_from_replica() around a read only view
+
+    methods:
+        db_for_read, db_for_write, allow_relation, allow_migrate
+
+    See `django multiple databases <https://docs.djangoproject.com/en/3.0/
+    topics/db/multi-db/#automatic-database-routing>`_ for info
+    """
+
+    @staticmethod
+    def userdog_db(hints):
+        instance = hints.get('instance')
+        if instance is None:
+            return None
+        if instance._meta.label_lower == USERDOG:
+            return shard_for(instance.user_id)
+        if instance._meta.label_lower == settings.AUTH_USER_MODEL.lower():
+            return shard_for(instance.pk)
+        return None
+
+    def db_for_read(self, model, **hints):
+        if model._meta.label_lower == USERDOG:
+            return self.userdog_db(hints)
+        if replica() and replica_reads.get():
+            return replica()
+        if sharded():
+            return DEFAULT_DB_ALIAS
+        return None
+
+    def db_for_write(self, model, **hints):
+        if model._meta.label_lower == USERDOG:
+            return self.userdog_db(hints)
+        if sharded():
+            return DEFAULT_DB_ALIAS
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if USERDOG in (obj1._meta.label_lower, obj2._meta.label_lower):
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == replica():
+            return False
+        if not sharded():
+            return None
+        if app_label == 'pugorugh' and model_name == 'userdog':
+            if hints.get('foreign_key_constraints'):
+                return db == DEFAULT_DB_ALIAS
+            return db == DEFAULT_DB_ALIAS or db in shards()
+        return db == DEFAULT_DB_ALIAS
@@ -1,4 +1,3 @@
-import json
 from os import environ
 from os import path
 import sys
@@ -10,15 +9,13 @@ PROJ_DIR = path.dirname(path.dirname(path.dirname(path.abspath(__file__))))
 
 def load_data():
     filepath = path.join(PROJ_DIR, 'pugorugh', 'static', 'dog_details.json')
-    
-    with open(filepath, 'r', encoding='utf-8') as file:
-        data = json.load(file)
 
-        serializer = DogSerializer(data=data, many=True)
-        if serializer.is_valid():
-            serializer.save()
-        else:
-            print(serializer.errors)
+    # records are streamed and imported in chunks, see
+    # `python manage.py import_dogs` for NDJSON input and progress reports
+    with open(filepath, 'r', encoding='utf-8') as file:
+        importer = DogImporter(
+            on_reject=lambda position, record, errors: print(position, errors))
+        importer.run(iter_json_array(file))
 
     print('load_data done.')
 
@@ -28,13 +25,7 @@ if __name__ == '__main__':
     environ.setdefault("DJANGO_SETTINGS_MODULE", "backend.settings")
     django.setup()
 
-    # Assuming your serializer is named DogSerializer
     # has to be imported after django.setup()
-    try:
-
-        from pugorugh.serializers import DogSerializer
-    except ImportError:
-        raise ImportError('serializers.py must contain a properly '
-            'implemented DogSerializer class for this import to work.')
+    from pugorugh.importer import DogImporter, iter_json_array
 
     load_data()
\ No newline at end of file
@@ -0,0 +1,128 @@
+"""
+Requests per second and latency percentiles of running servers.
+
+--concurrency clients request --path in a loop for --seconds against every
+--target and report rps, p50 and p99. With --slow-read a client reads each
+response in --chunk byte pieces with that many milliseconds between them,
+like a phone on a poor connection, which holds a WSGI worker but only a
+coroutine of the ASGI entry point. Start the servers first, e.g.
+
+    gunicorn backend.wsgi --workers 2 --threads 8 --bind 127.0.0.1:8000
+    uvicorn backend.asgi:application --workers 2 --port 8001
+
+    python pugorugh/scripts/http_load_test.py --token <token> \\
+        --target wsgi=http://127.0.0.1:8000 \\
+        --target asgi=http://127.0.0.1:8001 \\
+        --path /api/dog/-1/undecided/next/ --concurrency 64 --slow-read 20
+
+only the standard library is used, every request opens a new connection.
+"""
+import argparse
+import asyncio
+import time
+from urllib.parse import urlsplit
+
+TARGETS = ['wsgi=http://127.0.0.1:8000', 'asgi=http://127.0.0.1:8001']
+
+
+def percentile(values, fraction):
+    """returns the nearest rank percentile of sorted values"""
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, int(round(fraction * (len(values) - 1))))
+    return values[index]
+
+
+async def fetch(host, port, request, slow_read, chunk):
+    """
+    sends request and reads the response until the server closes
+
+    :rtype: int, the response status code
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        writer.write(request)
+        await writer.drain()
+        response = b''
+        while True:
+            data = await reader.read(chunk if slow_read else 65536)
+            if not data:
+                break
+            response += data
+            if slow_read:
+                await asyncio.sleep(slow_read / 1000)
+    finally:
+        writer.close()
+    return int(response.split(b' ', 2)[1]) if response else 0
+
+
+async def client(host, port, request, options, deadline, latencies, errors):
+    """requests until deadline, collects latencies and failures"""
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        try:
+            status = await fetch(host, port, request, options.slow_read,
+                                 options.chunk)
+        except OSError:
+            status = 0
+        if 200 <= status < 400:
+            latencies.append(time.perf_counter() - started)
+        else:
+            errors.append(status)
+
+
+async def run(url, options):
+    """
+    load tests one target
+
+    :rtype: dict of requests, errors, rps, p50 and p99 in milliseconds
+    """
+    parts = urlsplit(url)
+    headers = ['GET {} HTTP/1.1'.format(options.path),
+               'Host: {}'.format(parts.netloc),
+               'Accept: application/json',
+               'Connection: close']
+    if options.token:
+        headers.append('Authorization: Token {}'.format(options.token))
+    request = ('\r\n'.join(headers) + '\r\n\r\n').encode('latin-1')
+
+    latencies, errors = [], []
+    deadline = time.perf_counter() + options.seconds
+    await asyncio.gather(*(
+        client(parts.hostname, parts.port or 80, request, options, deadline,
+               latencies, errors)
+        for _ in range(options.concurrency)))
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': len(errors),
+        'rps': len(latencies) / options.seconds,
+        'p50': percentile(latencies, 0.50) * 1000,
+        'p99': percentile(latencies, 0.99) * 1000,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--target', action='append', dest='targets',
+                        help='name=url of a running server, may repeat')
+    parser.add_argument('--path', default='/api/dog/-1/undecided/next/')
+    parser.add_argument('--token', help='API token of the test user')
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--slow-read', type=float, default=0,
+                        help='milliseconds between response chunks')
+    parser.add_argument('--chunk', type=int, default=256)
+    options = parser.parse_args(argv)
+
+    print('{:<8} {:>9} {:>7} {:>9} {:>9} {:>9}'.format(
+        'target', 'requests', 'errors', 'rps', 'p50 ms', 'p99 ms'))
+    for target in options.targets or TARGETS:
+        name, _, url = target.partition('=')
+        stats = asyncio.run(run(url, options))
+        print('{:<8} {requests:>9} {errors:>7} {rps:>9.0f} {p50:>9.1f} '
+              '{p99:>9.1f}'.format(name, **stats))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+"""
+Swipe write throughput of concurrent worker processes on SQLite.
+
+Every profile gets a fresh, migrated database in a temporary directory
+seeded with users and dogs. --workers processes then run
+UserDogManager.set_status, the write of `UpdateStatus.put`, with random
+users, dogs and statuses for --seconds each. "database is locked" errors
+are counted, not retried.
+
+    python pugorugh/scripts/sqlite_write_bench.py --workers 4 --seconds 10
+    python pugorugh/scripts/sqlite_write_bench.py \\
+        --profile backend.settings_production
+
+profiles are Django settings modules, by default the shipped settings and
+the production profile are compared.
+"""
+import argparse
+import multiprocessing
+import random
+import shutil
+import sys
+import tempfile
+import time
+from os import environ
+from os import path
+
+PROJ_DIR = path.dirname(path.dirname(path.dirname(path.abspath(__file__))))
+PROFILES = ['backend.settings', 'backend.settings_production']
+
+
+def setup(profile, database):
+    """configures Django with profile, using database as default DB"""
+    sys.path.insert(0, PROJ_DIR)
+    environ['DJANGO_SETTINGS_MODULE'] = profile
+    import django
+    from django.conf import settings
+    settings.DATABASES['default']['NAME'] = database
+    django.setup()
+
+
+def prepare(profile, database, users, dogs):
+    """migrates and seeds the benchmark database"""
+    setup(profile, database)
+    from django.contrib.auth.models import User
+    from django.core.management import call_command
+    from pugorugh.models import Dog
+
+    call_command('migrate', verbosity=0)
+    User.objects.bulk_create(
+        User(username='bench%d' % index) for index in range(users))
+    Dog.objects.bulk_create(
+        Dog(name='dog%d' % index, age=index % 120, gender='f', size='m')
+        for index in range(dogs))
+
+
+def work(profile, database, seconds, results):
+    """swipes until the deadline, reports (writes, locked errors, worst)"""
+    setup(profile, database)
+    from django.contrib.auth.models import User
+    from django.db import OperationalError
+    from pugorugh.models import Dog, UserDog
+
+    user_ids = list(User.objects.values_list('pk', flat=True))
+    dog_ids = list(Dog.objects.values_list('pk', flat=True))
+    statuses = [UserDog.LIKED, UserDog.DISLIKED]
+    writes = locked = 0
+    worst = 0.0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        try:
+            UserDog.objects.set_status(random.choice(user_ids),
+                                       random.choice(dog_ids),
+                                       random.choice(statuses))
+            writes += 1
+        except OperationalError as error:
+            if 'locked' not in str(error):
+                raise
+            locked += 1
+        worst = max(worst, time.perf_counter() - started)
+    results.put((writes, locked, worst))
+
+
+def run(profile, workers, seconds, users, dogs):
+    """
+    benchmarks one profile in fresh database
+
+    :rtype: dict of writes, writes per second, locked errors and the
+        slowest single write in milliseconds
+    """
+    context = multiprocessing.get_context('spawn')
+    directory = tempfile.mkdtemp()
+    try:
+        database = path.join(directory, 'bench.sqlite3')
+        seeder = context.Process(target=prepare,
+                                 args=(profile, database, users, dogs))
+        seeder.start()
+        seeder.join()
+        if seeder.exitcode:
+            raise SystemExit('preparing {} failed'.format(profile))
+
+        results = context.Queue()
+        processes = [context.Process(target=work, args=(
+            profile, database, seconds, results)) for _ in range(workers)]
+        for process in processes:
+            process.start()
+        reports = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    writes = sum(report[0] for report in reports)
+    return {
+        'writes': writes,
+        'writes_per_second': writes / seconds,
+        'locked': sum(report[1] for report in reports),
+        'slowest_ms': max(report[2] for report in reports) * 1000,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--profile', action='append', dest='profiles',
+                        help='settings module, may repeat')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--dogs', type=int, default=500)
+    options = parser.parse_args(argv)
+
+    print('{:<32} {:>9} {:>10} {:>8} {:>12}'.format(
+        'profile', 'writes', 'writes/s', 'locked', 'slowest ms'))
+    for profile in options.profiles or PROFILES:
+        stats = run(profile, options.workers, options.seconds,
+                    options.users, options.dogs)
+        print('{:<32} {writes:>9} {writes_per_second:>10.0f} '
+              '{locked:>8} {slowest_ms:>12.1f}'.format(profile, **stats))
+
+
+if __name__ == '__main__':
+    main()
@@ -2,7 +2,10 @@ from django.contrib.auth import get_user_model
 
 from rest_framework import serializers
 
+from . import images
+from .assets import static_url
 from . import models
+from .converter import StatusConverter
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -22,6 +25,20 @@ class UserSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
+class DerivativeImagesField(serializers.ReadOnlyField):
+    """read only {variant: URL} of the resized copies of an image file"""
+
+    def to_representation(self, value):
+        return images.derivative_urls(value)
+
+
+class StaticImageField(serializers.ReadOnlyField):
+    """read only content hashed URL of a file in static/images/dogs"""
+
+    def to_representation(self, value):
+        return static_url('images/dogs/' + value) if value else ''
+
+
 class DogSerializer(serializers.ModelSerializer):
 
     BABY = 'b'
@@ -50,21 +67,83 @@ class DogSerializer(serializers.ModelSerializer):
         (UNKNOWN, 'Unknown')
         ]
 
+    # Dog columns of the representation, e.g. for values() reads
+    MODEL_FIELDS = ['name', 'image_filename', 'gender', 'size',
+                    'breed', 'age', 'id']
+
     gender = serializers.ChoiceField(choices=GENDER_CHOICES)
     size = serializers.ChoiceField(choices=SIZE_CHOICES)
+    image_url = StaticImageField(source='image_filename')
+    images = DerivativeImagesField(source='image_filename')
 
     class Meta:
         model = models.Dog
 
         fields = ['name', 'image_filename', 'gender', 'size',
-                  'breed', 'age', 'id']
+                  'breed', 'age', 'id', 'image_url', 'images']
+
+    @staticmethod
+    def represent(dog):
+        """
+        returns the representation of dog without running the fields
+
+        the read fast path: one dict built in Meta.fields order with the
+        conversions of the declared fields, equal to `DogSerializer(dog)
+        .data` for stored dogs
+
+        :argument dog: values() dict holding MODEL_FIELDS, or a Dog
+        :rtype: dict
+        """
+        row = dog if isinstance(dog, dict) else dog.__dict__
+        image_filename = str(row['image_filename'])
+        return {
+            'name': str(row['name']),
+            'image_filename': image_filename,
+            'gender': row['gender'],
+            'size': row['size'],
+            'breed': str(row['breed']),
+            'age': int(row['age']),
+            'id': int(row['id']),
+            'image_url': static_url('images/dogs/' + image_filename)
+            if image_filename else '',
+            'images': images.derivative_urls(image_filename),
+            }
+
+
+class CodeListField(serializers.CharField):
+    """
+    comma separated list of codes, e.g. 'm, f'
+
+    every code must be one of `codes` once surrounding whitespace is
+    stripped, the value itself is stored and returned as sent
+    """
+    default_error_messages = {
+        'invalid_code': '"{code}" is not a valid choice.',
+        }
+
+    def __init__(self, codes, **kwargs):
+        self.codes = frozenset(codes)
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        value = super().to_internal_value(data)
+        for code in value.split(','):
+            if code.strip() not in self.codes:
+                self.fail('invalid_code', code=code.strip())
+        return value
 
 
 class UserPrefSerializer(serializers.ModelSerializer):
-    age = serializers.CharField()
-    gender = serializers.CharField()
-    size = serializers.CharField()
+    age = CodeListField(models.Dog.AGE_BITS)
+    gender = CodeListField(models.Dog.GENDER_BITS)
+    size = CodeListField(models.Dog.SIZE_BITS)
 
     class Meta:
         model = models.UserPref
-        exclude = ['user']
+        exclude = ['user', 'age_mask', 'gender_mask', 'size_mask',
+                   'version', 'updated_at']
+
+
+class StatusUpdateSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    status = serializers.ChoiceField(choices=list(StatusConverter.STATUSES))
@@ -1,11 +1,38 @@
+import logging
+import re
+from contextvars import ContextVar
+from functools import partial
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db.models.signals import post_save
-from django.dispatch import receiver
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import Signal, receiver
+from rest_framework.authtoken.models import Token
+
+from pugorugh.authentication import token_cache
+from pugorugh import images
+from pugorugh.candidates import CandidateQueue, candidate_sets
+from pugorugh.catalog import dog_catalog
+from pugorugh.fragments import dog_fragments
+from pugorugh.models import Dog, UserDog, UserPref
+from pugorugh.routers import sharded, userdog_aliases
 
-from pugorugh.models import Dog, UserDog
+logger = logging.getLogger(__name__)
 
 user = get_user_model()
 
+# sent by bulk ingestion paths that bypass Dog.save(), e.g. bulk_create
+dogs_created = Signal(providing_args=['dog_ids'])
+# sent by bulk paths that change existing dogs, e.g. bulk_update
+dogs_updated = Signal(providing_args=['dog_ids'])
+
+# ids of the dogs delete_dogs is deleting, their UserDog rows are gone
+_userdogs_deleted = ContextVar('pugorugh_userdogs_deleted',
+                               default=frozenset())
+
 
 @receiver(post_save, sender=user)
 def userdog_receiver(sender, instance, created, **kwargs):
@@ -13,8 +40,227 @@ def userdog_receiver(sender, instance, created, **kwargs):
 
         if a user object is created model.UserDog objects related to user
         are bulk created from all available model.Dog objects database
+
+        skipped when UserDog.lazy_mode() is on, rows are then written
+        only once the user likes or dislikes a dog
     """
-    if created:
+    if created and not UserDog.lazy_mode():
         dogs = Dog.objects.all()
-        UserDog.objects.bulk_create(
+        UserDog.objects.for_user(instance.pk).bulk_create(
             [UserDog(user=instance, dog=d) for d in dogs])
+
+
+@receiver(post_delete, sender=user)
+def user_userdog_receiver(sender, instance, **kwargs):
+    """Custom signal receiver when a User is deleted
+
+        deletes the user's UserDog rows from the shard holding them,
+        UserDog.user is only cascaded by the ORM without shards
+    """
+    if not sharded():
+        return
+    UserDog.objects.for_user(instance.pk).filter(
+        user_id=instance.pk).delete()
+
+
+@receiver(post_delete, sender=Dog)
+def dog_userdog_receiver(sender, instance, **kwargs):
+    """Custom signal receiver when a Dog is deleted
+
+        deletes the dog's UserDog rows from every shard, UserDog.dog is
+        only cascaded by the ORM without shards. dogs deleted by
+        delete_dogs are skipped, their rows are already gone
+    """
+    if not sharded() or instance.pk in _userdogs_deleted.get():
+        return
+    for alias in userdog_aliases():
+        UserDog.objects.using(alias).filter(dog_id=instance.pk).delete()
+
+
+def delete_dogs(dog_ids):
+    """
+    deletes the dogs of dog_ids and their UserDog rows
+
+    with shards the UserDog rows are deleted first with one statement per
+    shard instead of one per dog by dog_userdog_receiver, without shards
+    the ORM cascades UserDog.dog the same way
+
+    :argument dog_ids: list of Dog primary keys
+    """
+    if sharded():
+        for alias in userdog_aliases():
+            UserDog.objects.using(alias).filter(
+                dog_id__in=dog_ids).delete()
+    token = _userdogs_deleted.set(frozenset(dog_ids))
+    try:
+        Dog.objects.filter(pk__in=dog_ids).delete()
+    finally:
+        _userdogs_deleted.reset(token)
+
+
+@receiver(post_save, sender=Dog)
+def dog_receiver(sender, instance, created, raw=False, **kwargs):
+    """Custom signal receiver when a Dog is created
+
+        forwards newly created dogs to dogs_created, fixture loading
+        (raw saves) is left alone
+    """
+    if created and not raw:
+        dogs_created.send(sender=sender, dog_ids=[instance.pk])
+
+
+@receiver(dogs_created)
+def dog_fan_out_receiver(sender, dog_ids, **kwargs):
+    """Custom signal receiver when Dogs are ingested
+
+        fans the new dogs out to every existing user as undecided
+        UserDog rows with UserDogManager.fan_out, unless
+        UserDog.lazy_mode() is on. the fan out runs once the outer
+        transaction commits, so its batches don't hold the write lock of
+        e.g. an admin save or a DogImporter chunk
+    """
+    if not UserDog.lazy_mode():
+        transaction.on_commit(partial(fan_out_dogs, list(dog_ids)))
+
+
+def fan_out_dogs(dog_ids):
+    """
+    fans dog_ids out to every existing user in bounded batches
+
+    :argument dog_ids: list of Dog primary keys
+    """
+    for _ in UserDog.objects.fan_out(dog_ids):
+        pass
+
+
+@receiver(post_save, sender=Dog)
+@receiver(post_delete, sender=Dog)
+@receiver(dogs_created)
+@receiver(dogs_updated)
+def catalog_queue_receiver(sender, **kwargs):
+    """Custom signal receiver when the Dog catalog changes
+
+        drops every cached CandidateQueue, shared candidate set and
+        columnar catalog by bumping the catalog version, this process's
+        copies are dropped at once. rendered dog payloads are revalidated
+    """
+    if (CandidateQueue.enabled() or candidate_sets.enabled()
+            or dog_catalog.enabled() or dog_fragments.enabled()):
+        CandidateQueue.invalidate_catalog()
+        candidate_sets.clear()
+        dog_catalog.invalidate()
+
+
+@receiver(post_save, sender=Dog)
+@receiver(post_delete, sender=Dog)
+@receiver(dogs_created)
+@receiver(dogs_updated)
+def dog_fragments_receiver(sender, instance=None, dog_ids=(), **kwargs):
+    """Custom signal receiver when dogs are saved, deleted or bulk changed
+
+        drops this process's rendered payloads of the dogs, other
+        processes compare theirs with Dog.version on next use, see
+        DogFragments.fragment
+    """
+    if dog_fragments.enabled():
+        dog_fragments.invalidate(
+            [instance.pk] if instance is not None else dog_ids)
+
+
+@receiver(post_save, sender=UserPref)
+def preference_queue_receiver(sender, instance, **kwargs):
+    """Custom signal receiver when a UserPref is saved
+
+        drops the user's cached CandidateQueues, they no longer match
+    """
+    if CandidateQueue.enabled():
+        CandidateQueue.invalidate_user(instance.user_id)
+
+
+@receiver(post_delete, sender=Token)
+def token_cache_receiver(sender, instance, **kwargs):
+    """Custom signal receiver when a Token is deleted
+
+        evicts the token from the authentication token cache, other
+        processes drop theirs through the shared user version
+    """
+    token_cache.evict(instance.key, instance.user_id)
+
+
+@receiver(post_save, sender=user)
+@receiver(post_delete, sender=user)
+def user_token_cache_receiver(sender, instance, **kwargs):
+    """Custom signal receiver when a User is saved or deleted
+
+        evicts the user's tokens from the authentication token cache so
+        deactivated users are rejected on their next request, the user's
+        token keys are looked up when a shared cache is configured
+    """
+    keys = ()
+    if token_cache.shared() is not None:
+        keys = Token.objects.filter(user_id=instance.pk).values_list(
+            'key', flat=True)
+    token_cache.evict_user(instance.pk, keys)
+
+
+@receiver(dogs_created)
+@receiver(dogs_updated)
+def dog_images_receiver(sender, dog_ids, **kwargs):
+    """Custom signal receiver when Dogs are ingested or changed
+
+        builds the image derivatives of the dogs when
+        settings.PUGORUGH_IMAGE_DERIVATIVES_ON_INGEST is on, unchanged
+        sources are skipped by images.build_derivatives
+    """
+    if not getattr(settings, 'PUGORUGH_IMAGE_DERIVATIVES_ON_INGEST', False):
+        return
+    filenames = Dog.objects.filter(pk__in=dog_ids).values_list(
+        'image_filename', flat=True)
+    try:
+        images.build_derivatives(filenames)
+    except (ImportError, OSError):
+        logger.exception('building dog image derivatives failed')
+
+
+@receiver(post_save, sender=Dog)
+def dog_image_save_receiver(sender, instance, created, raw=False,
+                            **kwargs):
+    """Custom signal receiver when a Dog is saved
+
+        builds the image derivatives of the dog when
+        settings.PUGORUGH_IMAGE_DERIVATIVES_ON_INGEST is on, so a save
+        changing image_filename is picked up like an ingest. created dogs
+        are built once by dog_images_receiver through dogs_created, fixture
+        loading (raw saves) is left alone
+    """
+    if created or raw or not getattr(
+            settings, 'PUGORUGH_IMAGE_DERIVATIVES_ON_INGEST', False):
+        return
+    try:
+        images.build_derivatives([instance.image_filename])
+    except (ImportError, OSError):
+        logger.exception('building dog image derivatives failed')
+
+
+PRAGMA_PATTERN = re.compile(r'^[A-Za-z_]+$')
+PRAGMA_VALUE_PATTERN = re.compile(r'^(-?\d+|[A-Za-z_]+)$')
+
+
+@receiver(connection_created)
+def sqlite_pragmas_receiver(sender, connection, **kwargs):
+    """Custom signal receiver when a database connection is opened
+
+        applies settings.PUGORUGH_SQLITE_PRAGMAS, e.g. WAL journaling and a
+        busy timeout, to every new SQLite connection. with CONN_MAX_AGE
+        this runs once per persistent connection, not once per request
+    """
+    if connection.vendor != 'sqlite':
+        return
+    pragmas = getattr(settings, 'PUGORUGH_SQLITE_PRAGMAS', {})
+    with connection.cursor() as cursor:
+        for name, value in pragmas.items():
+            if not (PRAGMA_PATTERN.match(name)
+                    and PRAGMA_VALUE_PATTERN.match(str(value))):
+                raise ImproperlyConfigured(
+                    'invalid SQLite pragma {}={!r}'.format(name, value))
+            cursor.execute('PRAGMA {} = {}'.format(name, value))
@@ -118,7 +118,7 @@ var Dog = React.createClass({
 
     return (
       <div>
-        <img src={"static/images/dogs/" + this.state.details.image_filename} />
+        <img src={this.state.details.image_url || "static/images/dogs/" + this.state.details.image_filename} />
         <p className="dog-card">
           {this.state.details.name}&bull;
           {this.state.details.breed}&bull;
@@ -1,12 +1,68 @@
+import asyncio
+import datetime
+import decimal
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from contextlib import contextmanager
+from unittest import skipIf, skipUnless
+
 from django.contrib.auth.models import User
-from django.test import TestCase
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.utils.http import http_date
+from django.utils.translation import gettext_lazy
+from django.db import connection, connections, transaction
+from django.db.models import F
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
 from rest_framework.test import (
-    APIRequestFactory, APITestCase, force_authenticate
+    APIRequestFactory, APITestCase, APITransactionTestCase,
+    force_authenticate
     )
 
+from . import assets
+from . import benchmark
+from .asgi import ThreadPoolASGIHandler
+from . import candidates
+from . import catalog
+from . import images
+from . import metrics
 from . import models
+from . import profiling
+from . import renderers
+from . import routers
 from . import serializers
 from . import views
+from .authentication import TokenCache, token_cache
+from .signals import dogs_created, sqlite_pragmas_receiver
+from .candidates import CandidateQueue, candidate_sets
+from .checks import candidate_cache_check, candidate_sets_check
+from .fragments import DogFragment, DogFragments, dog_fragments
+from .images import build_derivatives, derivative_urls
+from .importer import DogImporter, DogSync, iter_json_array
+
+
+@contextmanager
+def run_on_commit(using='default'):
+    """
+    runs the transaction.on_commit callbacks queued inside the block,
+    TestCase never commits its transaction so they would be dropped
+    """
+    callbacks = connections[using].run_on_commit
+    start = len(callbacks)
+    yield
+    queued = callbacks[start:]
+    del callbacks[start:]
+    for _, func in queued:
+        func()
 
 
 # model tests
@@ -47,6 +103,7 @@ class DogTestCase(TestCase):
         self.assertEqual(dog.image_filename, '13.jpg')
 
 
+@override_settings(PUGORUGH_LAZY_USERDOGS=True)
 class UserDogTestCAse(TestCase):
     """class encapsulates setup and unittests for models.UserDog
 
@@ -54,7 +111,8 @@ class UserDogTestCAse(TestCase):
 
     :methods
         setUp,
-        test_userdog
+        test_userdog,
+        test_cascade_without_shards
     """
 
     def setUp(self):
@@ -102,6 +160,14 @@ class UserDogTestCAse(TestCase):
         self.assertIsInstance(self.test_dog.dog, models.Dog)
         self.assertEqual(self.test_dog.status, 'u')
 
+    def test_cascade_without_shards(self):
+        """asserts unsharded UserDog keys are constrained and cascaded"""
+        for name in ('user', 'dog'):
+            self.assertTrue(models.UserDog._meta.get_field(
+                name).db_constraint)
+        self.dog.delete()
+        self.assertFalse(models.UserDog.objects.exists())
+
 
 class UserPrefTest(TestCase):
     """class encapsulates setup and unittests for models.UserPref
@@ -211,7 +277,8 @@ class DogSerializerTestCASE(TestCase):
         data = self.serializer.data
 
         self.assertCountEqual(data.keys(), ['name', 'image_filename', 'breed',
-                                            'age', 'gender', 'size', 'id'])
+                                            'age', 'gender', 'size', 'id',
+                                            'image_url', 'images'])
 
     def test_field_content(self):
         """Unittest for serializers.DogSerializer.
@@ -511,3 +578,1900 @@ class TestUpdateStatus(APITestCase):
         dog = queryset.filter(pk=2).get().users_dog.select_related().filter(
             user=self.user).get()
         self.assertEqual(dog.status, 'l')
+
+
+@override_settings(PUGORUGH_LAZY_USERDOGS=True)
+class TestLazyUserDog(APITestCase):
+    """class encapsulates setup and unittests for UserDog.lazy_mode().
+
+    subclasses rest_framework.test.APITestCase
+
+    attribute:
+        fixtures
+            json encoded data that is preloaded into test database
+
+    methods:
+        setUp, test_registration_writes_no_rows, test_next_undecided,
+        test_like_then_undecided, test_eager_mode_fans_out
+    """
+    fixtures = ['dogs.json']
+
+    def setUp(self):
+        """Creates a User and models.UserPref object in test database
+
+        attribute:
+            factory:
+                rest_framework.test.ApIRequestFactory object
+
+            user:
+                User object with username, email, and password set
+        """
+        self.factory = APIRequestFactory()
+        self.user = User.objects.create(
+            username='testuser',
+            email='loser@loser.com',
+            password='password'
+            )
+        models.UserPref.objects.create(
+            user=self.user, age='b,y,a,s', gender='m,f', size='s,m,l,xl')
+
+    def put_status(self, pk, status):
+        request = self.factory.put('api/dog/<pk>/<conv:status>/')
+        force_authenticate(request, user=self.user)
+        return views.UpdateStatus.as_view()(request, pk=pk, status=status)
+
+    def get_next(self, pk, status):
+        request = self.factory.get('api/dog/<pk>/<conv:status>/next/')
+        force_authenticate(request, user=self.user)
+        return views.Dogs.as_view()(request, pk=pk, status=status)
+
+    def test_registration_writes_no_rows(self):
+        """asserts that creating a User does not fan out UserDog rows"""
+        self.assertFalse(
+            models.UserDog.objects.filter(user=self.user).exists())
+
+    def test_next_undecided(self):
+        """asserts that a missing UserDog row is treated as undecided"""
+        response = self.get_next(-1, 'undecided')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['id'], 1)
+
+        self.put_status(1, 'liked')
+        response = self.get_next(-1, 'undecided')
+        self.assertEqual(response.data['id'], 2)
+        response = self.get_next(-1, 'liked')
+        self.assertEqual(response.data['id'], 1)
+
+    def test_like_then_undecided(self):
+        """asserts liked upserts a row and undecided removes it again"""
+        response = self.put_status(2, 'liked')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['id'], 2)
+        self.put_status(2, 'disliked')
+        userdog = models.UserDog.objects.get(user=self.user)
+        self.assertEqual(userdog.status, 'd')
+
+        self.put_status(2, 'undecided')
+        self.assertFalse(
+            models.UserDog.objects.filter(user=self.user).exists())
+        self.assertEqual(self.put_status(999, 'liked').status_code, 404)
+
+    @override_settings(PUGORUGH_LAZY_USERDOGS=False)
+    def test_eager_mode_fans_out(self):
+        """asserts eager mode still bulk creates undecided rows"""
+        user = User.objects.create(username='eager', password='password')
+        self.assertEqual(models.UserDog.objects.filter(
+            user=user, status='u').count(), models.Dog.objects.count())
+
+
+@override_settings(PUGORUGH_LAZY_USERDOGS=False)
+class TestFanOut(TestCase):
+    """class encapsulates setup and unittests for UserDogManager.fan_out
+
+    subclasses django.test TestCase
+
+    methods:
+        setUp, test_new_dog_reaches_users, test_fan_out_after_commit,
+        test_batches_are_idempotent
+    """
+
+    def setUp(self):
+        """Creates three Users before any models.Dog exists"""
+        self.users = [User.objects.create(username='user%d' % i,
+                                          password='password')
+                      for i in range(3)]
+
+    def test_new_dog_reaches_users(self):
+        """asserts a Dog created after registration is undecided for all"""
+        with run_on_commit():
+            dog = models.Dog.objects.create(name='George', age=12,
+                                            gender='m', size='xl')
+        self.assertEqual(models.UserDog.objects.filter(
+            dog=dog, status='u').count(), 3)
+
+    def test_fan_out_after_commit(self):
+        """asserts the fan out waits for the outer transaction"""
+        with run_on_commit():
+            with transaction.atomic():
+                dog = models.Dog.objects.create(name='George', age=12)
+                self.assertFalse(
+                    models.UserDog.objects.filter(dog=dog).exists())
+        self.assertEqual(models.UserDog.objects.filter(dog=dog).count(), 3)
+
+    def test_batches_are_idempotent(self):
+        """asserts fan_out batches, resumes and never duplicates rows"""
+        dogs = [models.Dog.objects.create(name='d%d' % i, age=3)
+                for i in range(2)]
+        models.UserDog.objects.all().delete()
+        ids = [d.pk for d in dogs]
+
+        batches = list(models.UserDog.objects.fan_out(
+            ids, batch_size=2, start_user_id=self.users[0].pk))
+        self.assertEqual(batches, [(self.users[1].pk, 2),
+                                   (self.users[2].pk, 2)])
+        batches = list(models.UserDog.objects.fan_out(ids, batch_size=2))
+        self.assertEqual(sum(inserted for _, inserted in batches), 2)
+        self.assertEqual(models.UserDog.objects.count(), 6)
+
+
+class TestAgeGroup(TestCase):
+    """class encapsulates unittests for models.Dog.age_group
+
+    subclasses django.test TestCase
+
+    methods:
+        test_save_sets_age_group, test_bulk_create_sets_age_group,
+        test_age_filter
+    """
+
+    def test_save_sets_age_group(self):
+        """asserts age_group follows age on save"""
+        dog = models.Dog.objects.create(name='George', age=12)
+        self.assertEqual(dog.age_group, 'b')
+        dog.age = 57
+        dog.save(update_fields=['age'])
+        dog.refresh_from_db()
+        self.assertEqual(dog.age_group, 's')
+
+    def test_bulk_create_sets_age_group(self):
+        """asserts age_group is derived on bulk inserts"""
+        models.Dog.objects.bulk_create(
+            models.Dog(name=str(age), age=age) for age in (18, 19, 56, 120))
+        self.assertEqual(
+            list(models.Dog.objects.order_by('age').values_list(
+                'age_group', flat=True)), ['b', 'y', 'a', 's'])
+
+    def test_age_filter(self):
+        """asserts bucketed and range filters select the same dogs"""
+        for age in (2, 30, 40, 90):
+            models.Dog.objects.create(name=str(age), age=age)
+        pref = models.UserPref(age='b, a')
+        for bucketed in (True, False):
+            ages = models.Dog.objects.filter(
+                pref.get_age_filter(bucketed=bucketed)).values_list(
+                'age', flat=True)
+            self.assertCountEqual(ages, [2, 40])
+
+
+class TestPreferenceMasks(TestCase):
+    """class encapsulates unittests for the UserPref and Dog bit codes
+
+    subclasses django.test TestCase
+
+    methods:
+        setUp, test_masks_follow_preferences, test_dog_bits,
+        test_filter_matches_masks, test_serializer_validates_codes
+    """
+
+    def setUp(self):
+        """Creates a User and a whitespace separated models.UserPref"""
+        self.user = User.objects.create(username='testuser',
+                                        password='password')
+        self.preference = models.UserPref.objects.create(
+            user=self.user, age='b, a', gender='m, f', size='xl, m')
+
+    def test_masks_follow_preferences(self):
+        """asserts masks are encoded on save, ignoring whitespace"""
+        self.assertEqual(self.preference.age_mask, 1 | 4)
+        self.assertEqual(self.preference.gender_mask, 1 | 2)
+        self.assertEqual(self.preference.size_mask, 8 | 2)
+        self.preference.size = 'u'
+        self.preference.save(update_fields=['size'])
+        self.preference.refresh_from_db()
+        self.assertEqual(self.preference.size_mask, 16)
+
+    def test_dog_bits(self):
+        """asserts Dog bit codes follow their source columns"""
+        dog = models.Dog.objects.create(name='George', age=40, gender='f',
+                                        size='xl')
+        self.assertEqual((dog.age_bit, dog.gender_bit, dog.size_bit),
+                         (4, 2, 8))
+        self.assertTrue(self.preference.matches(dog))
+        dog.gender = 'u'
+        models.Dog.objects.bulk_update([dog], ['gender'])
+        dog.refresh_from_db()
+        self.assertEqual(dog.gender_bit, 4)
+        self.assertFalse(self.preference.matches(dog))
+
+    def test_filter_matches_masks(self):
+        """asserts get_filter selects exactly the dogs matches() accepts"""
+        models.Dog.objects.bulk_create(
+            models.Dog(name=str(i), age=age, gender=gender, size=size)
+            for i, (age, gender, size) in enumerate([
+                (2, 'm', 'xl'), (30, 'f', 'm'), (40, 'f', 'm'),
+                (40, 'u', 'm'), (90, 'm', 's'), (10, 'f', 'm')]))
+        expected = [dog.name for dog in models.Dog.objects.all()
+                    if self.preference.matches(dog)]
+        self.assertCountEqual(expected, ['0', '2', '5'])
+        self.assertCountEqual(models.Dog.objects.filter(
+            self.preference.get_filter()).values_list('name', flat=True),
+            expected)
+
+    def test_serializer_validates_codes(self):
+        """asserts unknown codes are rejected and valid values kept as sent"""
+        serializer = serializers.UserPrefSerializer(
+            instance=self.preference,
+            data={'age': 'b, x', 'gender': 'm', 'size': 's'})
+        self.assertFalse(serializer.is_valid())
+        self.assertIn('age', serializer.errors)
+
+        serializer = serializers.UserPrefSerializer(
+            instance=self.preference,
+            data={'age': 'y , s', 'gender': 'u', 'size': 'l'})
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        preference = serializer.save()
+        self.assertEqual(preference.age, 'y , s')
+        self.assertEqual(preference.age_mask, 2 | 8)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'query plans are sqlite specific')
+class TestNextDogQueryPlan(TestCase):
+    """class encapsulates EXPLAIN checks for the views.Dogs `next` query
+
+    subclasses django.test TestCase
+
+    methods:
+        setUp, explain, test_status_uses_userdog_index,
+        test_undecided_uses_dog_index
+    """
+
+    def setUp(self):
+        """Creates a User and models.UserPref object in test database"""
+        self.user = User.objects.create(username='testuser',
+                                        password='password')
+        models.UserPref.objects.create(user=self.user, age='b,y',
+                                       gender='m,f', size='s,m')
+
+    def explain(self, status):
+        """returns the query plan of the next dog query for status"""
+        view = views.Dogs(kwargs={'status': status, 'pk': 0})
+        view.request = APIRequestFactory().get('/')
+        view.request.user = self.user
+        queryset = view.get_queryset().filter(pk__gt=0).order_by('pk')[:1]
+        return queryset.explain()
+
+    def test_status_uses_userdog_index(self):
+        """asserts liked/disliked search the (user, status, dog) index"""
+        self.assertIn('userdog_user_status_dog_idx', self.explain('liked'))
+
+    @override_settings(PUGORUGH_LAZY_USERDOGS=True)
+    def test_undecided_uses_dog_index(self):
+        """asserts the lazy anti-join searches the composite Dog index"""
+        plan = self.explain('undecided')
+        self.assertIn('dog_bits_id_idx', plan)
+        self.assertIn('sqlite_autoindex_pugorugh_userdog', plan)
+
+
+class TestConditionalGet(APITestCase):
+    """class encapsulates unittests for ETag and Last-Modified validators
+    of preferences and dog payloads
+
+    subclasses rest_framework.test.APITestCase
+
+    methods:
+        setUp, test_preference_not_modified, test_preference_put,
+        test_next_dog_not_modified, test_not_modified_not_rendered,
+        test_next_dog_etag_only,
+        test_dog_version, test_concurrent_saves
+    """
+    fixtures = ['dogs.json']
+
+    def setUp(self):
+        """Creates a User with models.UserPref matching every dog"""
+        self.user = User.objects.create(username='testuser',
+                                        password='password')
+        models.UserPref.objects.create(user=self.user, age='b,y,a,s',
+                                       gender='m,f,u', size='s,m,l,xl,u')
+        self.client.force_authenticate(user=self.user)
+
+    def test_preference_not_modified(self):
+        """asserts a current If-None-Match is answered 304 without body"""
+        response = self.client.get('/api/user/preferences/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Last-Modified', response)
+        self.assertIn('no-cache', response['Cache-Control'])
+        etag = response['ETag']
+
+        response = self.client.get('/api/user/preferences/',
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['ETag'], etag)
+
+    def test_preference_put(self):
+        """asserts an update returns a new ETag and old copies go stale"""
+        etag = self.client.get('/api/user/preferences/')['ETag']
+        response = self.client.put('/api/user/preferences/', {
+            'age': 'b', 'gender': 'm', 'size': 's'})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertNotIn('version', response.data)
+
+        response = self.client.get('/api/user/preferences/',
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['age'], 'b')
+
+    def test_next_dog_not_modified(self):
+        """asserts the next dog and status payloads share their ETag"""
+        response = self.client.get('/api/dog/-1/undecided/next/')
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        response = self.client.get('/api/dog/-1/undecided/next/',
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        dog_id = models.Dog.objects.order_by('pk').first().pk
+        response = self.client.put('/api/dog/{}/liked/'.format(dog_id))
+        self.assertEqual(response['ETag'], etag)
+
+    @override_settings(PUGORUGH_DOG_FRAGMENTS=False)
+    def test_not_modified_not_rendered(self):
+        """asserts a 304 of `next` builds no payload without fragments"""
+        rendered = []
+
+        def render(dog):
+            rendered.append(dog.pk)
+            return DogFragments.render(dog)
+
+        dog_fragments.render = render
+        self.addCleanup(delattr, dog_fragments, 'render')
+        etag = self.client.get('/api/dog/-1/undecided/next/')['ETag']
+        response = self.client.get('/api/dog/-1/undecided/next/',
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(len(rendered), 1)
+
+    def test_next_dog_etag_only(self):
+        """asserts If-Modified-Since cannot hide a swipe from `next`"""
+        response = self.client.get('/api/dog/-1/undecided/next/')
+        self.assertNotIn('Last-Modified', response)
+        dog_id = response.data['id']
+        self.client.put('/api/dog/{}/liked/'.format(dog_id))
+        response = self.client.get('/api/dog/-1/undecided/next/',
+                                   HTTP_IF_MODIFIED_SINCE=http_date())
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.data['id'], dog_id)
+
+    def test_dog_version(self):
+        """asserts save() and bulk_update() bump the version and ETag"""
+        etag = self.client.get('/api/dog/-1/undecided/next/')['ETag']
+        dog = models.Dog.objects.order_by('pk').first()
+        self.assertEqual(dog.version, 1)
+        dog.name = 'Renamed'
+        dog.save()
+        self.assertEqual(dog.version, 2)
+
+        models.Dog.objects.bulk_update(
+            [models.Dog(pk=dog.pk, name='Synced', age=dog.age)], ['name'])
+        dog.refresh_from_db()
+        self.assertEqual((dog.name, dog.version), ('Synced', 3))
+        response = self.client.get('/api/dog/-1/undecided/next/',
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['name'], 'Synced')
+
+    def test_concurrent_saves(self):
+        """asserts saves of stale copies never share a version"""
+        first = models.Dog.objects.get(pk=1)
+        second = models.Dog.objects.get(pk=1)
+        first.save()
+        second.save()
+        self.assertEqual((first.version, second.version), (2, 3))
+        preference = models.UserPref.objects.get(user=self.user)
+        models.UserPref.objects.get(user=self.user).save()
+        preference.save()
+        self.assertEqual(preference.version, 3)
+
+
+class TestFastDogPayloads(APITestCase):
+    """class encapsulates unittests for DogSerializer.represent and
+    renderers.FastJSONRenderer
+
+    subclasses rest_framework.test.APITestCase
+
+    methods:
+        test_represent, test_renderer_identical, test_renderer_indent,
+        test_queue_payload
+    """
+    fixtures = ['dogs.json']
+
+    def test_represent(self):
+        """asserts the fast path equals the serializer, order included"""
+        rows = models.Dog.objects.order_by('pk').values(
+            *serializers.DogSerializer.MODEL_FIELDS)
+        for dog, row in zip(models.Dog.objects.order_by('pk'), rows):
+            expected = serializers.DogSerializer(dog).data
+            for payload in (serializers.DogSerializer.represent(row),
+                            serializers.DogSerializer.represent(dog)):
+                self.assertEqual(list(payload.items()),
+                                 list(expected.items()))
+
+    def test_renderer_identical(self):
+        """asserts FastJSONRenderer renders the bytes of JSONRenderer"""
+        data = {
+            'name': 'Zo\u00eb \u2028 \u2029 \U0001f436 "q" \\ \n \x01 \x7f',
+            'nested': [1, -2, True, False, None, [], {}, (3, 4)],
+            'when': datetime.datetime(2020, 1, 2, 3, 4, 5, 678901),
+            'day': datetime.date(2020, 1, 2),
+            'price': decimal.Decimal('1.50'),
+            'lazy': gettext_lazy('Male'),
+            'big': 2 ** 70,
+            7: 'int key',
+            }
+        for payload in (data, [data, data], 'text', 12, None):
+            self.assertEqual(renderers.FastJSONRenderer().render(payload),
+                             JSONRenderer().render(payload))
+
+    def test_renderer_indent(self):
+        """asserts indented output is left to JSONRenderer"""
+        data = {'a': [1, 2]}
+        self.assertEqual(
+            renderers.FastJSONRenderer().render(
+                data, 'application/json; indent=4'),
+            JSONRenderer().render(data, 'application/json; indent=4'))
+
+    def test_queue_payload(self):
+        """asserts the queue body is the serializer's, rendered alike"""
+        user = User.objects.create(username='testuser', password='password')
+        models.UserPref.objects.create(user=user, age='b,y,a,s',
+                                       gender='m,f,u', size='s,m,l,xl,u')
+        self.client.force_authenticate(user=user)
+        response = self.client.get('/api/dog/undecided/queue/?limit=3')
+        dogs = models.Dog.objects.order_by('pk')[:3]
+        expected = serializers.DogSerializer(dogs, many=True).data
+        self.assertEqual(response.json()['results'],
+                         json.loads(JSONRenderer().render(expected)))
+        self.assertEqual(response.content, JSONRenderer().render(
+            response.data))
+
+
+@override_settings(PUGORUGH_DOG_FRAGMENTS=True)
+class TestDogFragments(APITestCase):
+    """class encapsulates unittests for fragments.DogFragments
+
+    subclasses rest_framework.test.APITestCase
+
+    methods:
+        setUp, put_status, test_swipe_reuses_fragment, test_next_payload,
+        test_save_invalidates, test_other_process_revalidates,
+        test_process_local_cache, test_eviction
+    """
+    fixtures = ['dogs.json']
+
+    def setUp(self):
+        """Creates a User, a shared cache and empties the caches"""
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location)
+        settings = self.settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': location}})
+        settings.enable()
+        self.addCleanup(settings.disable)
+        cache.clear()
+        candidate_sets.clear()
+        dog_fragments.clear()
+        dog_fragments.counters.update(hits=0, revalidated=0, misses=0,
+                                      evictions=0)
+        self.factory = APIRequestFactory()
+        self.user = User.objects.create(username='testuser',
+                                        password='password')
+        models.UserPref.objects.create(user=self.user, age='b,y,a,s',
+                                       gender='m,f,u', size='s,m,l,xl,u')
+
+    def put_status(self, pk, status, queries):
+        request = self.factory.put('api/dog/<pk>/<conv:status>/')
+        force_authenticate(request, user=self.user)
+        with self.assertNumQueries(queries):
+            response = views.UpdateStatus.as_view()(request, pk=pk,
+                                                    status=status)
+        response.render()
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_swipe_reuses_fragment(self):
+        """asserts a current fragment is answered without reading the dog"""
+        first = self.put_status(2, 'liked', 2)
+        second = self.put_status(2, 'disliked', 1)
+        expected = JSONRenderer().render(serializers.DogSerializer(
+            models.Dog.objects.get(pk=2)).data)
+        self.assertEqual(first.content, expected)
+        self.assertEqual(second.content, expected)
+        self.assertEqual(second['ETag'], first['ETag'])
+        stats = dog_fragments.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['size']),
+                         (1, 1, 1))
+        self.assertEqual(stats['hit_ratio'], 0.5)
+
+    def test_next_payload(self):
+        """asserts `next` answers the fragment of the dog, rendered alike"""
+        self.client.force_authenticate(user=self.user)
+        first = self.client.get('/api/dog/-1/undecided/next/')
+        second = self.client.get('/api/dog/-1/undecided/next/')
+        dog = models.Dog.objects.order_by('pk').first()
+        self.assertIsInstance(second.data, DogFragment)
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second.content, JSONRenderer().render(
+            serializers.DogSerializer(dog).data))
+        self.assertEqual(dog_fragments.stats()['hits'], 1)
+
+    def test_save_invalidates(self):
+        """asserts a saved dog is rendered again"""
+        first = self.put_status(2, 'liked', 2)
+        dog = models.Dog.objects.get(pk=2)
+        dog.name = 'Renamed'
+        dog.save()
+        second = self.put_status(2, 'liked', 2)
+        self.assertEqual(second.data['name'], 'Renamed')
+        self.assertNotEqual(second['ETag'], first['ETag'])
+        self.assertEqual(dog_fragments.stats()['misses'], 2)
+
+    def test_other_process_revalidates(self):
+        """asserts a catalog version bump makes fragments read the dog"""
+        self.put_status(2, 'liked', 2)
+        CandidateQueue.invalidate_catalog()
+        self.put_status(2, 'liked', 2)
+        self.assertEqual(dog_fragments.stats()['revalidated'], 1)
+
+        # another process renamed the dog, only the version tells
+        models.Dog.objects.filter(pk=2).update(name='Renamed',
+                                               version=F('version') + 1)
+        CandidateQueue.invalidate_catalog()
+        self.assertEqual(self.put_status(2, 'liked', 2).data['name'],
+                         'Renamed')
+        self.assertEqual(dog_fragments.stats()['misses'], 2)
+
+    def test_process_local_cache(self):
+        """asserts a locmem catalog version never skips reading the dog"""
+        with self.settings(CACHES={'default': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+            self.put_status(2, 'liked', 2)
+            models.Dog.objects.filter(pk=2).update(name='Renamed',
+                                                   version=F('version') + 1)
+            self.assertEqual(self.put_status(2, 'liked', 2).data['name'],
+                             'Renamed')
+            self.put_status(2, 'liked', 2)
+        stats = dog_fragments.stats()
+        self.assertEqual((stats['misses'], stats['revalidated']), (2, 1))
+
+    @override_settings(PUGORUGH_DOG_FRAGMENTS_SIZE=2)
+    def test_eviction(self):
+        """asserts the least recently used fragment is evicted"""
+        for pk in (1, 2, 1, 3):
+            dog_fragments.fragment(
+                lambda: models.Dog.objects.get(pk=pk), pk)
+        stats = dog_fragments.stats()
+        self.assertEqual((stats['size'], stats['evictions']), (2, 1))
+        with self.assertNumQueries(0):
+            dog_fragments.fragment(lambda: None, 1)
+
+
+class TestDogQueue(APITestCase):
+    """class encapsulates setup and unittests for views.DogQueue
+
+    subclasses rest_framework.test.APITestCase
+
+    attribute:
+        fixtures
+            json encoded data that is preloaded into test database
+
+    methods:
+        setUp, test_pages_follow_cursor, test_matches_next
+    """
+    fixtures = ['dogs.json']
+
+    def setUp(self):
+        """Creates and authenticates a User with models.UserPref"""
+        self.user = User.objects.create(username='testuser',
+                                        password='password')
+        models.UserPref.objects.create(user=self.user, age='b,y,a,s',
+                                       gender='f', size='s,m,l,xl')
+        self.client.force_authenticate(user=self.user)
+
+    def test_pages_follow_cursor(self):
+        """asserts batches are keyset ordered and the cursor is opaque"""
+        response = self.client.get('/api/dog/undecided/queue/?limit=4')
+        self.assertEqual(response.status_code, 200)
+        ids = [dog['id'] for dog in response.data['results']]
+        self.assertEqual(ids, [1, 3, 7, 9])
+        self.assertIn('cursor=', response.data['next'])
+
+        response = self.client.get(response.data['next'])
+        ids += [dog['id'] for dog in response.data['results']]
+        self.assertEqual(ids, [1, 3, 7, 9, 10, 13, 14, 17])
+
+    def test_matches_next(self):
+        """asserts the queue skips dogs the user already decided on"""
+        self.client.put('/api/dog/3/liked/')
+        response = self.client.get('/api/dog/undecided/queue/?limit=2')
+        self.assertEqual([dog['id'] for dog in response.data['results']],
+                         [1, 7])
+        response = self.client.get('/api/dog/liked/queue/')
+        self.assertEqual([dog['id'] for dog in response.data['results']],
+                         [3])
+        self.assertIsNone(response.data['next'])
+
+
+@override_settings(PUGORUGH_CANDIDATE_QUEUE=True)
+class TestCandidateQueue(APITestCase):
+    """class encapsulates setup and unittests for candidates.CandidateQueue
+
+    subclasses rest_framework.test.APITestCase
+
+    attribute:
+        fixtures
+            json encoded data that is preloaded into test database
+
+    methods:
+        setUp, next_id, test_next_is_served_from_queue,
+        test_status_change_patches_queue, test_invalidation,
+        test_process_local_cache_check
+    """
+    fixtures = ['dogs.json']
+
+    def setUp(self):
+        """Creates and authenticates a User with models.UserPref"""
+        cache.clear()
+        candidate_sets.clear()
+        CandidateQueue.counters.update(hits=0, misses=0)
+        self.user = User.objects.create(username='testuser',
+                                        password='password')
+        self.preference = models.UserPref.objects.create(
+            user=self.user, age='b,y,a,s', gender='f', size='s,m,l,xl')
+        self.client.force_authenticate(user=self.user)
+
+    def next_id(self, pk, status='undecided'):
+        response = self.client.get('/api/dog/%s/%s/next/' % (pk, status))
+        return response.data.get('id') if response.status_code == 200 else None
+
+    def test_next_is_served_from_queue(self):
+        """asserts a cached queue answers `next` with a single query"""
+        self.assertEqual(self.next_id(-1), 1)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.next_id(1), 3)
+        self.assertEqual(self.next_id(19), None)
+        self.assertEqual(CandidateQueue.stats()['misses'], 1)
+        self.assertEqual(CandidateQueue.stats()['hits'], 2)
+
+    def test_status_change_patches_queue(self):
+        """asserts liking a dog moves it between cached queues"""
+        self.assertEqual(self.next_id(-1), 1)
+        self.assertEqual(self.next_id(-1, 'liked'), None)
+        self.client.put('/api/dog/1/liked/')
+        self.assertEqual(self.next_id(-1), 3)
+        self.assertEqual(self.next_id(-1, 'liked'), 1)
+        self.assertEqual(CandidateQueue.stats()['misses'], 2)
+
+    def test_invalidation(self):
+        """asserts preference and catalog changes drop cached queues"""
+        self.assertEqual(self.next_id(-1), 1)
+        self.client.put('/api/user/preferences/',
+                        {'age': 'b', 'gender': 'f', 'size': 'm'},
+                        format='json')
+        self.assertEqual(self.next_id(-1), 19)
+
+        with run_on_commit():
+            dog = models.Dog.objects.create(name='Pup', age=3, gender='f',
+                                            size='m')
+        self.assertEqual(self.next_id(19), dog.pk)
+        dog.delete()
+        self.assertEqual(self.next_id(19), None)
+
+    def test_process_local_cache_check(self):
+        """asserts a locmem candidate cache is reported, a shared one not"""
+        self.assertEqual([warning.id for warning in
+                          candidate_cache_check(None)], ['pugorugh.W001'])
+        shared = {'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': tempfile.gettempdir()}}
+        with self.settings(CACHES=shared):
+            self.assertEqual(candidate_cache_check(None), [])
+        with self.settings(PUGORUGH_CANDIDATE_SETS=True):
+            self.assertEqual([warning.id for warning in
+                              candidate_sets_check(None)], ['pugorugh.W002'])
+
+
+@override_settings(PUGORUGH_CANDIDATE_QUEUE=False, PUGORUGH_CANDIDATE_SETS=True)
+class TestCandidateSets(APITestCase):
+    """class encapsulates setup and unittests for candidates.CandidateSets
+
+    subclasses rest_framework.test.APITestCase
+
+    attribute:
+        fixtures
+            json encoded data that is preloaded into test database
+
+    methods:
+        setUp, create_user, next_id, test_signature_is_shared,
+        test_status_intersection, test_bounded_status_lookup,
+        test_catalog_change, test_eviction
+    """
+    fixtures = ['dogs.json']
+
+    def setUp(self):
+        """Creates two users sharing one preference signature"""
+        cache.clear()
+        candidate_sets.clear()
+        candidate_sets.counters.update(hits=0, misses=0, evictions=0)
+        self.first = self.create_user('first', 'f')
+        self.second = self.create_user('second', 'm, f')
+
+    def create_user(self, username, gender):
+        user = User.objects.create(username=username, password='password')
+        models.UserPref.objects.create(user=user, age='b,y,a,s',
+                                       gender=gender, size='s,m,l,xl')
+        return user
+
+    def next_id(self, user, pk, status='undecided'):
+        self.client.force_authenticate(user=user)
+        response = self.client.get('/api/dog/%s/%s/next/' % (pk, status))
+        return response.data.get('id') if response.status_code == 200 else None
+
+    def test_signature_is_shared(self):
+        """asserts users with equal masks share one set"""
+        third = self.create_user('third', 'f,m')
+        self.assertEqual(self.next_id(self.first, -1), 1)
+        self.assertEqual(self.next_id(self.second, -1), 1)
+        self.assertEqual(self.next_id(third, -1), 1)
+        self.assertEqual(self.next_id(self.second, 1), 2)
+        stats = candidate_sets.stats()
+        self.assertEqual((stats['misses'], stats['hits'], stats['size']),
+                         (2, 2, 2))
+
+    def test_status_intersection(self):
+        """asserts set results match the filtered queryset per status"""
+        self.client.force_authenticate(user=self.second)
+        self.client.put('/api/dog/2/liked/')
+        self.client.put('/api/dog/3/disliked/')
+        for status in ('undecided', 'liked', 'disliked'):
+            view = views.Dogs(kwargs={'status': status, 'pk': 0})
+            view.request = APIRequestFactory().get('/')
+            view.request.user = self.second
+            expected = list(view.get_queryset().order_by('pk').values_list(
+                'pk', flat=True))
+            self.assertEqual(view.get_candidate_ids(), expected)
+        self.assertEqual(self.next_id(self.second, -1, 'liked'), 2)
+        self.assertEqual(self.next_id(self.second, 2, 'liked'), None)
+
+    @override_settings(PUGORUGH_LAZY_USERDOGS=True)
+    def test_bounded_status_lookup(self):
+        """asserts `next` reads the status of a window of ids only"""
+        self.client.force_authenticate(user=self.second)
+        for pk in (1, 2, 3):
+            self.client.put('/api/dog/%s/liked/' % pk)
+        self.assertEqual(self.next_id(self.second, -1), 4)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.next_id(self.second, 2, 'liked'), 3)
+        statements = [query['sql'] for query in queries
+                      if 'pugorugh_userdog' in query['sql']]
+        self.assertEqual(len(statements), 1)
+        self.assertIn('LIMIT', statements[0])
+
+        windows = []
+
+        def window(after):
+            windows.append(after)
+            return [pk for pk in (1, 2, 3, 4, 5) if pk > after][:2]
+
+        self.assertEqual(candidates.next_with_status(
+            self.second.id, 'undecided', -1, window, set), 4)
+        self.assertEqual(windows, [-1, 2])
+
+    def test_catalog_change(self):
+        """asserts sets are rebuilt after the catalog changes"""
+        self.assertEqual(self.next_id(self.first, 19), None)
+        with run_on_commit():
+            dog = models.Dog.objects.create(name='Pup', age=3, gender='f',
+                                            size='m')
+        self.assertEqual(self.next_id(self.first, 19), dog.pk)
+        self.assertEqual(candidate_sets.stats()['misses'], 2)
+
+    def test_eviction(self):
+        """asserts the least recently used set is evicted past max ids"""
+        self.next_id(self.first, -1)
+        with self.settings(
+                PUGORUGH_CANDIDATE_SETS_MAX_IDS=models.Dog.objects.count()):
+            self.next_id(self.second, -1)
+        stats = candidate_sets.stats()
+        self.assertEqual((stats['size'], stats['evictions']), (1, 1))
+        self.next_id(self.second, -1)
+        self.assertEqual(candidate_sets.stats()['hits'], 1)
+
+
+@skipIf(catalog.np is None, 'numpy is not installed')
+@override_settings(PUGORUGH_CANDIDATE_QUEUE=False,
+                   PUGORUGH_CANDIDATE_SETS=False,
+                   PUGORUGH_COLUMNAR_CATALOG=True)
+class TestDogCatalog(APITestCase):
+    """class encapsulates setup and unittests for catalog.DogCatalog
+
+    subclasses rest_framework.test.APITestCase
+
+    attribute:
+        fixtures
+            json encoded data that is preloaded into test database
+
+    methods:
+        setUp, next_id, test_matches_queryset, test_next_reads_status_only,
+        test_reload_on_change, test_reload_after_max_age
+    """
+    fixtures = ['dogs.json']
+
+    def setUp(self):
+        """Creates and authenticates a User with models.UserPref"""
+        cache.clear()
+        catalog.dog_catalog.invalidate()
+        dog_fragments.clear()
+        catalog.dog_catalog.counters.update(loads=0)
+        self.user = User.objects.create(username='testuser',
+                                        password='password')
+        self.preference = models.UserPref.objects.create(
+            user=self.user, age='b,y,a', gender='m, f', size='s,m,l')
+        self.client.force_authenticate(user=self.user)
+
+    def next_id(self, pk, status='undecided'):
+        response = self.client.get('/api/dog/%s/%s/next/' % (pk, status))
+        return response.data.get('id') if response.status_code == 200 else None
+
+    def test_matches_queryset(self):
+        """asserts catalog candidates equal the filtered queryset"""
+        self.client.put('/api/dog/2/liked/')
+        self.client.put('/api/dog/4/disliked/')
+        for status in ('undecided', 'liked', 'disliked'):
+            view = views.Dogs(kwargs={'status': status, 'pk': 0})
+            view.request = APIRequestFactory().get('/')
+            view.request.user = self.user
+            expected = list(view.get_queryset().order_by('pk').values_list(
+                'pk', flat=True))
+            self.assertEqual(catalog.dog_catalog.candidates(
+                self.preference, status).tolist(), expected)
+
+    def test_next_reads_status_only(self):
+        """asserts a loaded catalog answers `next` without the dog filter"""
+        first = self.next_id(-1)
+        self.assertEqual(catalog.dog_catalog.stats()['loads'], 1)
+        # user lookup (preference), status rows, the dog payload
+        with self.assertNumQueries(3):
+            second = self.next_id(first)
+        self.assertGreater(second, first)
+        self.assertEqual(catalog.dog_catalog.stats()['size'],
+                         models.Dog.objects.count())
+
+    def test_reload_on_change(self):
+        """asserts the catalog is reloaded after dogs change"""
+        self.assertIsNone(self.next_id(19))
+        with run_on_commit():
+            dog = models.Dog.objects.create(name='Pup', age=3, gender='f',
+                                            size='m')
+        self.assertEqual(self.next_id(19), dog.pk)
+        dog.size = 'xl'
+        dog.save()
+        self.assertIsNone(self.next_id(19))
+        self.assertEqual(catalog.dog_catalog.stats()['loads'], 3)
+
+    def test_reload_after_max_age(self):
+        """asserts a process local catalog version expires the arrays"""
+        catalog.dog_catalog.columns()
+        catalog.dog_catalog.columns()
+        self.assertEqual(catalog.dog_catalog.stats()['loads'], 1)
+        with self.settings(PUGORUGH_COLUMNAR_CATALOG_MAX_AGE=0):
+            catalog.dog_catalog.invalidate()
+            catalog.dog_catalog.columns()
+            # QuerySet.update() sends no signal to invalidate the arrays
+            models.Dog.objects.filter(pk=1).update(size_bit=0)
+            ids = catalog.dog_catalog.ids(self.preference)
+        self.assertNotIn(1, ids.tolist())
+        self.assertEqual(catalog.dog_catalog.stats()['loads'], 3)
+
+
+@override_settings(PUGORUGH_DOG_FRAGMENTS=False,
+                   PUGORUGH_LAZY_USERDOGS=True)
+class TestUpdateStatusQueries(APITestCase):
+    """class encapsulates query count unittests for views.UpdateStatus.put
+
+    dogs are read on every swipe, see TestDogFragments for cached payloads
+
+    subclasses rest_framework.test.APITestCase
+
+    attribute:
+        fixtures
+            json encoded data that is preloaded into test database
+
+    methods:
+        setUp, put_status, test_lazy_swipe, test_eager_swipe
+    """
+    fixtures = ['dogs.json']
+
+    def setUp(self):
+        """Creates a User and an APIRequestFactory"""
+        self.factory = APIRequestFactory()
+        self.user = User.objects.create(username='testuser',
+                                        password='password')
+
+    def put_status(self, pk, status):
+        request = self.factory.put('api/dog/<pk>/<conv:status>/')
+        force_authenticate(request, user=self.user)
+        with self.assertNumQueries(2):
+            response = views.UpdateStatus.as_view()(request, pk=pk,
+                                                    status=status)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['id'], pk)
+        return models.UserDog.objects.filter(user=self.user, dog_id=pk)
+
+    @override_settings(PUGORUGH_LAZY_USERDOGS=True)
+    def test_lazy_swipe(self):
+        """asserts lazy mode upserts and deletes in two statements"""
+        self.assertEqual(self.put_status(2, 'liked').get().status, 'l')
+        self.assertEqual(self.put_status(2, 'liked').get().status, 'l')
+        self.assertEqual(self.put_status(2, 'disliked').get().status, 'd')
+        self.assertFalse(self.put_status(2, 'undecided').exists())
+
+    @override_settings(PUGORUGH_LAZY_USERDOGS=False)
+    def test_eager_swipe(self):
+        """asserts eager mode updates existing rows in two statements"""
+        models.UserDog.objects.create(user=self.user, dog_id=2)
+        self.assertEqual(self.put_status(2, 'liked').get().status, 'l')
+        self.assertEqual(self.put_status(2, 'undecided').get().status, 'u')
+        self.assertEqual(models.UserDog.objects.count(), 1)
+
+
+@override_settings(PUGORUGH_LAZY_USERDOGS=True)
+class TestBulkUpdateStatus(APITestCase):
+    """class encapsulates setup and unittests for views.BulkUpdateStatus
+
+    subclasses rest_framework.test.APITestCase
+
+    attribute:
+        fixtures
+            json encoded data that is preloaded into test database
+
+    methods:
+        setUp, statuses, test_batch_results, test_grouped_statements,
+        test_rejects_non_list
+    """
+    fixtures = ['dogs.json']
+
+    def setUp(self):
+        """Creates and authenticates a User"""
+        self.user = User.objects.create(username='testuser',
+                                        password='password')
+        self.client.force_authenticate(user=self.user)
+
+    def statuses(self):
+        return dict(models.UserDog.objects.filter(user=self.user).values_list(
+            'dog_id', 'status'))
+
+    def test_batch_results(self):
+        """asserts per item results and last-wins for repeated dogs"""
+        models.UserDog.objects.create(user=self.user, dog_id=4, status='l')
+        response = self.client.put('/api/dog/statuses/', [
+            {'id': 1, 'status': 'liked'},
+            {'id': 2, 'status': 'liked'},
+            {'id': 2, 'status': 'disliked'},
+            {'id': 4, 'status': 'undecided'},
+            {'id': 999, 'status': 'liked'},
+            {'id': 3, 'status': 'loved'},
+            ], format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [item['result'] for item in response.data['results']],
+            ['updated', 'superseded', 'updated', 'updated', 'not_found',
+             'invalid'])
+        self.assertEqual(self.statuses(), {1: 'l', 2: 'd'})
+
+    @override_settings(PUGORUGH_LAZY_USERDOGS=False)
+    def test_grouped_statements(self):
+        """asserts one transaction with grouped statements per status"""
+        items = [{'id': pk, 'status': 'liked'} for pk in range(1, 11)]
+        items += [{'id': pk, 'status': 'disliked'} for pk in range(11, 20)]
+        # dog lookup, (insert missing, grouped update) per status and the
+        # savepoint the transaction becomes inside TestCase
+        with self.assertNumQueries(1 + 2 * 2 + 2):
+            response = self.client.put('/api/dog/statuses/', items,
+                                       format='json')
+        self.assertEqual(response.status_code, 200)
+        statuses = self.statuses()
+        self.assertEqual(len(statuses), 19)
+        self.assertEqual(statuses[10], 'l')
+        self.assertEqual(statuses[11], 'd')
+
+    def test_rejects_non_list(self):
+        """asserts the body must be a list"""
+        response = self.client.put('/api/dog/statuses/',
+                                   {'id': 1, 'status': 'liked'},
+                                   format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+class TestDogImporter(TestCase):
+    """class encapsulates unittests for importer.DogImporter and import_dogs
+
+    subclasses django.test TestCase
+
+    methods:
+        setUp, test_stream_json_array, test_rejects_do_not_abort,
+        test_concurrent_rows_not_signalled, test_command_ndjson
+    """
+
+    def setUp(self):
+        """builds five dog records, the fourth one invalid"""
+        self.records = [
+            {'name': 'dog%d' % i, 'image_filename': '%d.jpg' % i,
+             'breed': 'Pug', 'age': 10 * i, 'gender': 'f', 'size': 's'}
+            for i in range(5)]
+        self.records[3]['gender'] = 'x'
+
+    def test_stream_json_array(self):
+        """asserts the array parser yields records across small reads"""
+        text = json.dumps(self.records, indent=2)
+        self.assertEqual(list(iter_json_array(io.StringIO(text), 16)),
+                         self.records)
+
+    def test_rejects_do_not_abort(self):
+        """asserts invalid rows are reported and the rest are chunked in"""
+        rejected = []
+        chunks = []
+        importer = DogImporter(
+            chunk_size=2,
+            on_reject=lambda position, record, errors: rejected.append(
+                position),
+            on_chunk=lambda stats: chunks.append(stats['imported']))
+        stats = importer.run(iter(self.records))
+        self.assertEqual(rejected, [3])
+        self.assertEqual(chunks, [2, 4])
+        self.assertEqual((stats['read'], stats['imported'],
+                          stats['rejected']), (5, 4, 1))
+        self.assertEqual(models.Dog.objects.get(name='dog4').age_group, 'a')
+
+    def test_concurrent_rows_not_signalled(self):
+        """asserts rows of other writers are not taken for the batch's"""
+        other = models.Dog.objects.create(name='other', age=3, gender='m',
+                                          size='s', image_filename='x.jpg')
+        created = []
+
+        def receiver(sender, dog_ids, **kwargs):
+            created.extend(dog_ids)
+
+        dogs_created.connect(receiver)
+        self.addCleanup(dogs_created.disconnect, receiver)
+        importer = DogImporter()
+        # the other row was inserted after the importer read the last id
+        importer.last_id = lambda: other.pk - 1
+        stats = importer.run(iter(self.records))
+        self.assertEqual(stats['imported'], 4)
+        self.assertEqual(sorted(created), sorted(
+            models.Dog.objects.exclude(pk=other.pk).values_list(
+                'pk', flat=True)))
+
+    def test_command_ndjson(self):
+        """asserts import_dogs reads NDJSON and reports the totals"""
+        with tempfile.NamedTemporaryFile('w', suffix='.ndjson') as source:
+            source.write('\n'.join(json.dumps(r) for r in self.records))
+            source.flush()
+            out, err = io.StringIO(), io.StringIO()
+            call_command('import_dogs', source.name, chunk_size=3,
+                         stdout=out, stderr=err)
+        self.assertIn('imported 4, rejected 1 of 5 records', out.getvalue())
+        self.assertIn('record 3 rejected', err.getvalue())
+        self.assertEqual(models.Dog.objects.count(), 4)
+
+
+class TestDogSync(TestCase):
+    """class encapsulates unittests for importer.DogSync
+
+    subclasses django.test TestCase
+
+    methods:
+        setUp, test_resync_unchanged_writes_nothing,
+        test_insert_update_delete, test_rejected_records_keep_dogs,
+        test_delete_userdogs_in_bulk, test_image_filename_key
+    """
+
+    def setUp(self):
+        """builds three dog records keyed by external_id"""
+        self.records = [
+            {'external_id': 'feed-%d' % i, 'name': 'dog%d' % i,
+             'image_filename': '%d.jpg' % i, 'breed': 'Pug', 'age': 10 * i,
+             'gender': 'f', 'size': 's'}
+            for i in range(3)]
+
+    def test_resync_unchanged_writes_nothing(self):
+        """asserts an unchanged feed costs one SELECT per chunk"""
+        DogSync(chunk_size=2).run(self.records)
+        with self.assertNumQueries(2):
+            stats = DogSync(chunk_size=2).run(self.records)
+        self.assertEqual((stats['imported'], stats['updated'],
+                          stats['unchanged']), (0, 0, 3))
+
+    def test_insert_update_delete(self):
+        """asserts new rows are inserted, changed updated, missing deleted"""
+        DogSync().run(self.records)
+        self.records[1]['age'] = 60
+        del self.records[2]
+        self.records.append(dict(self.records[0], external_id='feed-9',
+                                 name='dog9'))
+        stats = DogSync(delete_missing=True).run(self.records)
+        self.assertEqual((stats['imported'], stats['updated'],
+                          stats['unchanged'], stats['deleted']),
+                         (1, 1, 1, 1))
+        self.assertEqual(models.Dog.objects.get(
+            external_id='feed-1').age_group, 's')
+        self.assertCountEqual(
+            models.Dog.objects.values_list('external_id', flat=True),
+            ['feed-0', 'feed-1', 'feed-9'])
+
+    def test_rejected_records_keep_dogs(self):
+        """asserts a rejected record never deletes its or any dog"""
+        DogSync().run(self.records)
+        self.records[1]['gender'] = 'x'
+        stats = DogSync(delete_missing=True).run(self.records)
+        self.assertEqual((stats['rejected'], stats['deleted']), (1, 0))
+
+        del self.records[2]
+        del self.records[1]['external_id']
+        sync = DogSync(delete_missing=True)
+        stats = sync.run(self.records)
+        self.assertTrue(sync.delete_skipped)
+        self.assertEqual(stats['deleted'], 0)
+        self.assertEqual(models.Dog.objects.count(), 3)
+
+    @override_settings(PUGORUGH_LAZY_USERDOGS=False)
+    def test_delete_userdogs_in_bulk(self):
+        """asserts missing dogs lose their UserDog rows in one statement"""
+        DogSync().run(self.records)
+        for name in ('one', 'two'):
+            User.objects.create(username=name, password='password')
+        self.assertEqual(models.UserDog.objects.count(), 6)
+        with CaptureQueriesContext(connection) as queries:
+            stats = DogSync(delete_missing=True).run(self.records[:1])
+        self.assertEqual(stats['deleted'], 2)
+        self.assertEqual(len([query for query in queries
+                              if 'DELETE FROM "pugorugh_userdog"'
+                              in query['sql']]), 1)
+        self.assertEqual(models.UserDog.objects.count(), 2)
+
+    def test_image_filename_key(self):
+        """asserts rows imported without hashes are adopted by filename"""
+        DogImporter().run(self.records)
+        stats = DogSync(key='image_filename').run(self.records)
+        self.assertEqual((stats['imported'], stats['updated']), (0, 3))
+        stats = DogSync(key='image_filename').run(self.records)
+        self.assertEqual(stats['unchanged'], 3)
+        self.assertEqual(models.Dog.objects.count(), 3)
+
+
+class TestCachedTokenAuthentication(APITestCase):
+    """class encapsulates unittests for CachedTokenAuthentication
+
+    subclasses rest_framework.test.APITestCase
+
+    methods:
+        setUp, get_preferences, test_token_resolved_once,
+        test_deactivation_evicts, test_token_deletion_evicts,
+        test_revoked_in_other_process, test_lru_bound
+    """
+
+    def setUp(self):
+        """Creates a User with a Token and clears the token cache"""
+        token_cache.clear()
+        token_cache.counters.update(hits=0, misses=0, evictions=0)
+        self.user = User.objects.create(username='testuser',
+                                        password='password')
+        self.token = Token.objects.create(user=self.user)
+        models.UserPref.objects.create(user=self.user)
+
+    def get_preferences(self, key=None):
+        self.client.credentials(
+            HTTP_AUTHORIZATION='Token ' + (key or self.token.key))
+        return self.client.get('/api/user/preferences/')
+
+    def test_token_resolved_once(self):
+        """asserts repeated requests skip the Token join User query"""
+        self.assertEqual(self.get_preferences().status_code, 200)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.get_preferences().status_code, 200)
+        self.assertEqual(token_cache.stats()['hits'], 1)
+        self.assertEqual(token_cache.stats()['misses'], 1)
+
+    def test_deactivation_evicts(self):
+        """asserts a deactivated user is rejected despite a cached token"""
+        self.get_preferences()
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.get_preferences().status_code, 401)
+
+    def test_token_deletion_evicts(self):
+        """asserts a deleted token is rejected despite being cached"""
+        self.get_preferences()
+        key = self.token.key
+        self.token.delete()
+        self.assertEqual(self.get_preferences(key).status_code, 401)
+
+    @override_settings(PUGORUGH_TOKEN_SHARED_CACHE='default')
+    def test_revoked_in_other_process(self):
+        """asserts a local hit is rejected once another process revoked
+        the user in the shared cache"""
+        cache.clear()
+        self.get_preferences()
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        TokenCache().evict_user(self.user.pk, [self.token.key])
+        self.assertEqual(self.get_preferences().status_code, 401)
+
+    @override_settings(PUGORUGH_TOKEN_CACHE_SIZE=1)
+    def test_lru_bound(self):
+        """asserts the cache never holds more than its configured size"""
+        other = User.objects.create(username='other', password='password')
+        models.UserPref.objects.create(user=other)
+        self.get_preferences()
+        self.get_preferences(Token.objects.create(user=other).key)
+        self.assertEqual(token_cache.stats()['size'], 1)
+        self.assertEqual(token_cache.stats()['evictions'], 1)
+
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+class TestDogImages(TestCase):
+    """class encapsulates unittests for the images derivative pipeline
+
+    subclasses django.test TestCase
+
+    methods:
+        setUp, test_serializer_exposes_urls, test_build_skips_unchanged,
+        test_save_builds_derivatives, test_create_builds_once
+    """
+
+    def setUp(self):
+        """Creates a temporary image source directory"""
+        self.source = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.source)
+        settings = self.settings(PUGORUGH_IMAGE_SOURCE_DIR=self.source)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        images._manifest['checked'] = None
+        self.addCleanup(images._manifest.update, checked=None)
+
+    def test_serializer_exposes_urls(self):
+        """asserts DogSerializer lists a URL per built derivative"""
+        dog = models.Dog.objects.create(name='George', age=12,
+                                        image_filename='13.jpg')
+        data = serializers.DogSerializer(dog).data
+        self.assertEqual(data['images'], derivative_urls('13.jpg'))
+        self.assertEqual(data['images']['thumbnail_webp'], data['image_url'])
+
+        os.makedirs(images.derived_dir())
+        with open(os.path.join(images.derived_dir(), images.MANIFEST),
+                  'w') as manifest:
+            json.dump({'13.jpg': 'sha1'}, manifest)
+        images._manifest['checked'] = None
+        data = serializers.DogSerializer(dog).data
+        self.assertEqual(data['images']['thumbnail_webp'],
+                         '/static/images/dogs/derived/13-thumbnail.webp')
+
+    @skipIf(Image is None, 'Pillow is not installed')
+    def test_build_skips_unchanged(self):
+        """asserts derivatives are built once per source content"""
+        Image.new('RGB', (2000, 1000), 'red').save(
+            os.path.join(self.source, '1.jpg'))
+        Image.new('RGB', (100, 100), 'red').save(
+            os.path.join(self.source, '3.jpg'))
+        with self.settings(PUGORUGH_IMAGE_SOURCE_DIR=self.source):
+            stats = build_derivatives(
+                ['1.jpg', '2.jpg', '3.jpg', '../1.jpg'], workers=2)
+            self.assertEqual(stats, {'built': 2, 'skipped': 0, 'missing': 2})
+            derived = os.path.join(self.source, 'derived')
+            with Image.open(os.path.join(derived, '1-card.webp')) as card:
+                self.assertEqual(card.size, (480, 240))
+            self.assertEqual(build_derivatives(['1.jpg'])['skipped'], 1)
+
+            Image.new('RGB', (300, 300), 'blue').save(
+                os.path.join(self.source, '1.jpg'))
+            self.assertEqual(build_derivatives(['1.jpg'])['built'], 1)
+
+    @skipIf(Image is None, 'Pillow is not installed')
+    @override_settings(PUGORUGH_IMAGE_DERIVATIVES_ON_INGEST=True)
+    def test_save_builds_derivatives(self):
+        """asserts Dog.save() builds the derivatives of a new image"""
+        dog = models.Dog.objects.create(name='George', age=12,
+                                        image_filename='1.jpg')
+        Image.new('RGB', (600, 600), 'red').save(
+            os.path.join(self.source, '2.jpg'))
+        dog.image_filename = '2.jpg'
+        dog.save()
+        self.assertIn('2.jpg', images.built_sources())
+        self.assertTrue(os.path.exists(os.path.join(
+            images.derived_dir(), '2-card.webp')))
+
+    @skipIf(Image is None, 'Pillow is not installed')
+    @override_settings(PUGORUGH_IMAGE_DERIVATIVES_ON_INGEST=True)
+    def test_create_builds_once(self):
+        """asserts a created dog's source is hashed and rendered once"""
+        Image.new('RGB', (600, 600), 'red').save(
+            os.path.join(self.source, '1.jpg'))
+        hashed = []
+        self.addCleanup(setattr, images, 'source_hash', images.source_hash)
+        images.source_hash = lambda path: hashed.append(path) or 'sha1'
+        models.Dog.objects.create(name='George', age=12,
+                                  image_filename='1.jpg')
+        self.assertEqual(len(hashed), 1)
+        self.assertIn('1.jpg', images.built_sources())
+
+
+class TestStaticAssets(TestCase):
+    """class encapsulates unittests for the assets hashed static pipeline
+
+    subclasses django.test TestCase
+
+    methods:
+        setUp, test_collect_hashes_and_compresses, test_serve_headers
+    """
+
+    def setUp(self):
+        """collects a small static tree into a temporary STATIC_ROOT"""
+        source, root = tempfile.mkdtemp(), tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, source)
+        self.addCleanup(shutil.rmtree, root)
+        os.makedirs(os.path.join(source, 'js'))
+        os.makedirs(os.path.join(source, 'images', 'dogs'))
+        with open(os.path.join(source, 'js', 'app.js'), 'w') as bundle:
+            bundle.write('var app = "pug or ugh";\n' * 200)
+        with open(os.path.join(source, 'images', 'dogs', '1.jpg'),
+                  'wb') as image:
+            image.write(b'not really a jpeg')
+
+        settings = self.settings(STATICFILES_DIRS=[source], STATIC_ROOT=root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.addCleanup(assets.static_url.cache_clear)
+        self.addCleanup(assets.hashed_names.cache_clear)
+        self.addCleanup(assets.manifest_version.cache_clear)
+        assets.static_url.cache_clear()
+        assets.hashed_names.cache_clear()
+        assets.manifest_version.cache_clear()
+        call_command('collectstatic', interactive=False, verbosity=0)
+        self.root = root
+
+    def test_collect_hashes_and_compresses(self):
+        """asserts bundles and images resolve to hashed, gzipped copies"""
+        url = assets.static_url('js/app.js')
+        self.assertRegex(url, r'^/static/js/app\.[0-9a-f]{12}\.js$')
+        self.assertTrue(os.path.exists(os.path.join(
+            self.root, url[len('/static/'):] + '.gz')))
+        dog = models.Dog(name='George', age=3, image_filename='1.jpg')
+        self.assertRegex(serializers.DogSerializer(dog).data['image_url'],
+                         r'^/static/images/dogs/1\.[0-9a-f]{12}\.jpg$')
+
+    def test_serve_headers(self):
+        """asserts hashed files are immutable and served precompressed"""
+        path = assets.static_url('js/app.js')[len('/static/'):]
+        request = APIRequestFactory().get('/static/' + path,
+                                          HTTP_ACCEPT_ENCODING='gzip, br')
+        response = assets.serve(request, path)
+        self.assertEqual(response['Cache-Control'], assets.IMMUTABLE)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        response.close()
+
+        response = assets.serve(APIRequestFactory().get('/'), 'js/app.js')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=60')
+        self.assertNotIn('Content-Encoding', response)
+        response.close()
+
+
+@override_settings(PUGORUGH_READ_REPLICA='replica',
+                   PUGORUGH_USERDOG_SHARDS=['userdogs_0', 'userdogs_1'])
+class TestPugorughRouter(TestCase):
+    """class encapsulates unittests for routers.PugorughRouter
+
+    subclasses django.test TestCase
+
+    methods:
+        setUp, test_shard_for, test_read_and_write, test_allow_migrate
+    """
+
+    def setUp(self):
+        self.router = routers.PugorughRouter()
+
+    def test_shard_for(self):
+        """asserts users are spread over the shards by id"""
+        self.assertEqual([routers.shard_for(pk) for pk in (1, 2, 3)],
+                         ['userdogs_1', 'userdogs_0', 'userdogs_1'])
+        self.assertIsNone(routers.shard_for(None))
+        with self.settings(PUGORUGH_USERDOG_SHARDS=[]):
+            self.assertIsNone(routers.shard_for(1))
+            self.assertFalse(routers.sharded())
+        self.assertEqual(models.UserDog.objects.for_user(2).db, 'userdogs_0')
+
+    def test_read_and_write(self):
+        """asserts UserDog follows its user and reads use the replica"""
+        user = User(pk=3)
+        userdog = models.UserDog(user_id=2)
+        self.assertEqual(self.router.db_for_write(
+            models.UserDog, instance=userdog), 'userdogs_0')
+        self.assertEqual(self.router.db_for_read(
+            models.UserDog, instance=user), 'userdogs_1')
+        self.assertEqual(self.router.db_for_read(models.Dog), 'default')
+        with routers.read_from_replica():
+            self.assertEqual(self.router.db_for_read(models.Dog), 'replica')
+            self.assertEqual(self.router.db_for_write(models.Dog),
+                             'default')
+        self.assertTrue(self.router.allow_relation(userdog, user))
+        self.assertIsNone(self.router.allow_relation(user, models.Dog()))
+
+    def test_allow_migrate(self):
+        """asserts UserDog rows live in the shards, constraints do not"""
+        allow = self.router.allow_migrate
+        self.assertTrue(allow('userdogs_0', 'pugorugh', 'userdog'))
+        self.assertTrue(allow('default', 'pugorugh', 'userdog'))
+        self.assertFalse(allow('userdogs_0', 'pugorugh', 'userdog',
+                               foreign_key_constraints=True))
+        self.assertTrue(allow('default', 'pugorugh', 'userdog',
+                              foreign_key_constraints=True))
+        self.assertFalse(allow('userdogs_0', 'pugorugh', 'dog'))
+        self.assertFalse(allow('userdogs_1', 'auth', 'user'))
+        self.assertTrue(allow('default', 'auth', 'user'))
+        self.assertFalse(allow('replica', 'pugorugh', 'dog'))
+
+
+@skipUnless(routers.sharded(), 'run with --settings=backend.settings_sharded')
+@override_settings(PUGORUGH_READ_REPLICA=None)
+class TestShardedUserDog(APITestCase):
+    """class encapsulates unittests for UserDog sharded over databases
+
+    subclasses rest_framework.test.APITestCase
+
+    attribute:
+        databases
+            the default database and the UserDog shards
+        fixtures
+            json encoded data that is preloaded into test database
+
+    methods:
+        setUp, next_id, test_rows_live_in_user_shard, test_next_and_queue,
+        test_queue_pages, test_bulk_statuses, test_deletes_reach_shards
+    """
+    databases = {'default', *routers.shards()}
+    fixtures = ['dogs.json']
+
+    def setUp(self):
+        """Creates two users whose rows live in different shards"""
+        cache.clear()
+        candidate_sets.clear()
+        self.users = [User.objects.create(username=name, password='password')
+                      for name in ('first', 'second')]
+        for user in self.users:
+            models.UserPref.objects.create(user=user, age='b,y,a,s',
+                                           gender='m,f', size='s,m,l,xl')
+
+    def next_id(self, user, pk, status='undecided'):
+        self.client.force_authenticate(user=user)
+        response = self.client.get('/api/dog/%s/%s/next/' % (pk, status))
+        return response.data.get('id') if response.status_code == 200 else None
+
+    def test_rows_live_in_user_shard(self):
+        """asserts status rows are written to the user's shard only"""
+        for user in self.users:
+            self.client.force_authenticate(user=user)
+            self.client.put('/api/dog/1/liked/')
+        first, second = (routers.shard_for(user.pk) for user in self.users)
+        self.assertNotEqual(first, second)
+        for user in self.users:
+            alias = routers.shard_for(user.pk)
+            self.assertEqual(list(models.UserDog.objects.using(
+                alias).values_list('user_id', 'dog_id', 'status')),
+                [(user.pk, 1, 'l')])
+        # the default database only keeps the empty table the ORM cascades
+        self.assertFalse(models.UserDog.objects.using('default').exists())
+
+    def test_next_and_queue(self):
+        """asserts `next` and the queue skip the user's decided dogs"""
+        user = self.users[0]
+        self.client.force_authenticate(user=user)
+        self.client.put('/api/dog/1/liked/')
+        self.client.put('/api/dog/2/disliked/')
+        self.assertEqual(self.next_id(user, -1), 3)
+        self.assertEqual(self.next_id(user, -1, 'liked'), 1)
+        self.assertEqual(self.next_id(self.users[1], -1), 1)
+        with self.settings(PUGORUGH_CANDIDATE_QUEUE=False,
+                           PUGORUGH_CANDIDATE_SETS=False):
+            self.assertEqual(self.next_id(user, -1), 3)
+            self.assertEqual(self.next_id(user, -1, 'disliked'), 2)
+        self.client.force_authenticate(user=user)
+        response = self.client.get('/api/dog/liked/queue/')
+        self.assertEqual([dog['id'] for dog in response.data['results']],
+                         [1])
+
+    def test_queue_pages(self):
+        """asserts sharded queue pages follow both cursors"""
+        user = self.users[0]
+        self.client.force_authenticate(user=user)
+        self.client.put('/api/dog/2/liked/')
+        expected = list(models.Dog.objects.filter(
+            models.UserPref.objects.get(user=user).get_filter()).exclude(
+            pk=2).order_by('pk').values_list('pk', flat=True))
+        first = self.client.get('/api/dog/undecided/queue/?limit=3').data
+        self.assertEqual([dog['id'] for dog in first['results']],
+                         expected[:3])
+        second = self.client.get(first['next']).data
+        self.assertEqual([dog['id'] for dog in second['results']],
+                         expected[3:6])
+        back = self.client.get(second['previous']).data
+        self.assertEqual(back['results'], first['results'])
+
+    def test_bulk_statuses(self):
+        """asserts batch updates are applied in the user's shard"""
+        user = self.users[1]
+        self.client.force_authenticate(user=user)
+        response = self.client.put('/api/dog/statuses/', [
+            {'id': 1, 'status': 'liked'}, {'id': 2, 'status': 'disliked'}],
+            format='json')
+        self.assertEqual([item['result'] for item in response.data['results']],
+                         ['updated', 'updated'])
+        self.assertEqual(models.UserDog.objects.for_user(user.pk).filter(
+            user_id=user.pk).count(), 2)
+
+    def test_deletes_reach_shards(self):
+        """asserts deleting a dog or user deletes its rows in the shards"""
+        for user in self.users:
+            self.client.force_authenticate(user=user)
+            self.client.put('/api/dog/1/liked/')
+            self.client.put('/api/dog/2/liked/')
+        models.Dog.objects.get(pk=1).delete()
+        self.users[0].delete()
+        rows = [(alias, list(models.UserDog.objects.using(alias).values_list(
+            'user_id', 'dog_id'))) for alias in routers.shards()]
+        self.assertCountEqual(
+            [row for _, alias_rows in rows for row in alias_rows],
+            [(self.users[1].pk, 2)])
+
+
+@skipUnless(routers.replica(), 'run with --settings=backend.settings_sharded')
+class TestReplicaReads(APITransactionTestCase):
+    """class encapsulates unittests for reads routed to the read replica
+
+    a transaction test case, the replica is a second connection to the
+    test database and must see committed rows
+
+    subclasses rest_framework.test.APITransactionTestCase
+
+    methods:
+        setUp, test_preference_get
+    """
+    databases = '__all__'
+
+    def setUp(self):
+        """Creates a User with models.UserPref"""
+        self.user = User.objects.create(username='testuser',
+                                        password='password')
+        models.UserPref.objects.create(user=self.user, age='b', gender='m',
+                                       size='s')
+
+    def test_preference_get(self):
+        """asserts the preference GET reads from the replica alias"""
+        self.client.force_authenticate(user=self.user)
+        with CaptureQueriesContext(connections['replica']) as queries:
+            response = self.client.get('/api/user/preferences/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(any('pugorugh_userpref' in query['sql']
+                            for query in queries.captured_queries))
+
+
+class TestSwipeBenchmark(TestCase):
+    """class encapsulates unittests for benchmark.SwipeBenchmark
+
+    subclasses django.test TestCase
+
+    methods:
+        test_run, test_compare
+    """
+
+    def test_run(self):
+        """asserts every endpoint is replayed, measured and serializable"""
+        results = benchmark.SwipeBenchmark(dogs=30, users=2, swipes=5).run()
+        self.assertEqual(models.Dog.objects.count(), 30)
+        self.assertEqual(User.objects.count(), 2)
+        for endpoint in benchmark.ENDPOINTS:
+            stats = results['endpoints'][endpoint]
+            self.assertGreater(stats['requests'], 0, endpoint)
+            self.assertGreater(stats['queries'], 0, endpoint)
+            self.assertLessEqual(stats['p50'], stats['p99'])
+        self.assertEqual(
+            results['endpoints']['status']['requests'],
+            models.UserDog.objects.exclude(status='u').count())
+        json.dumps(results)
+
+    def test_compare(self):
+        """asserts relative changes to a baseline"""
+        stats = {'rps': 100.0, 'p95': 10.0, 'p99': 20.0, 'queries': 2.0}
+        baseline = {'endpoints': {'next': stats}, 'total': stats}
+        results = {'endpoints': {'next': dict(stats, p99=30.0)},
+                   'total': stats}
+        changes = benchmark.compare(baseline, results)
+        self.assertEqual(changes['next']['p99'], 0.5)
+        self.assertEqual(changes['total']['p95'], 0.0)
+
+
+class TestMetrics(APITestCase):
+    """class encapsulates unittests for metrics.MetricsMiddleware and
+    metrics.serve
+
+    subclasses rest_framework.test.APITestCase
+
+    methods:
+        setUp, test_request_recorded, test_serve, test_serve_internal_only,
+        test_worker_files_merged, test_dead_worker_gauges_dropped
+    """
+
+    def setUp(self):
+        """Creates a User with models.UserPref, resets the metrics"""
+        self.user = User.objects.create(username='testuser',
+                                        password='password')
+        models.UserPref.objects.create(user=self.user, age='b', gender='m',
+                                       size='s')
+        self.client.force_authenticate(user=self.user)
+        metrics.metrics.reset()
+        self.addCleanup(metrics.metrics.reset)
+
+    def test_request_recorded(self):
+        """asserts requests, latency and SQL statements are counted"""
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/api/user/preferences/')
+        entry = metrics.metrics.local()['views']['preferences']
+        self.assertEqual(entry['requests'], {'GET 200': 1})
+        self.assertEqual(sum(entry['buckets']), 1)
+        self.assertEqual(entry['queries'], len(queries))
+        self.assertGreater(entry['query_seconds'], 0)
+
+    def test_serve(self):
+        """asserts the Prometheus text of the recorded views"""
+        self.client.get('/api/user/preferences/')
+        self.client.get('/api/user/preferences/')
+        response = self.client.get('/metrics/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], metrics.CONTENT_TYPE)
+        text = response.content.decode()
+        self.assertIn('pugorugh_requests_total{view="preferences",'
+                      'method="GET",status="200"} 2', text)
+        self.assertIn('pugorugh_request_duration_seconds_bucket{'
+                      'view="preferences",le="+Inf"} 2', text)
+        self.assertIn('# TYPE pugorugh_cache_events_total counter', text)
+        self.assertIn('pugorugh_cache_events_total{cache="token_cache",'
+                      'event="hits"}', text)
+        self.assertIn('pugorugh_cache{cache="token_cache",stat="size"}',
+                      text)
+        self.assertNotIn('pugorugh_cache{cache="token_cache",stat="hits"}',
+                         text)
+
+    def test_serve_internal_only(self):
+        """asserts clients outside INTERNAL_IPS get a 404"""
+        response = self.client.get('/metrics/', REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(response.status_code, 404)
+
+    def test_worker_files_merged(self):
+        """asserts the counters written by other workers are summed"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        with self.settings(PUGORUGH_METRICS_DIR=directory):
+            self.client.get('/api/user/preferences/')
+            worker = metrics.metrics.local()
+            with open(os.path.join(directory, '{}0.json'.format(
+                    metrics.FILE_PREFIX)), 'w') as fp:
+                json.dump(worker, fp)
+            entry = metrics.metrics.snapshot()['views']['preferences']
+        self.assertEqual(entry['requests'], {'GET 200': 2})
+        self.assertEqual(sum(entry['buckets']), 2)
+
+    def test_dead_worker_gauges_dropped(self):
+        """asserts a stopped worker keeps its counters but not its sizes"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        worker = subprocess.run([sys.executable, '-c',
+                                 'import os; print(os.getpid())'],
+                                stdout=subprocess.PIPE, check=True)
+        dead = {'caches': {'token_cache': {'hits': 5, 'size': 7}}}
+        with open(os.path.join(directory, '{}{}.json'.format(
+                metrics.FILE_PREFIX, int(worker.stdout))), 'w') as fp:
+            json.dump(dead, fp)
+        with self.settings(PUGORUGH_METRICS_DIR=directory):
+            local = metrics.metrics.local()['caches']['token_cache']
+            stats = metrics.metrics.snapshot()['caches']['token_cache']
+        self.assertEqual(stats['hits'], local['hits'] + 5)
+        self.assertEqual(stats['size'], local['size'])
+
+
+class TestProfilingMiddleware(APITestCase):
+    """class encapsulates unittests for profiling.ProfilingMiddleware and
+    the profile_report command
+
+    subclasses rest_framework.test.APITestCase
+
+    methods:
+        setUp, profiles, test_sampled, test_requested, test_not_allowlisted,
+        test_rotation, test_profile_report
+    """
+
+    def setUp(self):
+        """Creates a staff User with a Token and a profile directory"""
+        self.user = User.objects.create(username='admin', password='password',
+                                        is_staff=True)
+        models.UserPref.objects.create(user=self.user, age='b', gender='m',
+                                       size='s')
+        token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION='Token {}'.format(token))
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        settings = self.settings(
+            PUGORUGH_PROFILING=True, PUGORUGH_PROFILE_SAMPLE_RATE=0.0,
+            PUGORUGH_PROFILE_USERS=['admin'],
+            PUGORUGH_PROFILE_DIR=self.directory)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def profiles(self, view='preferences'):
+        directory = os.path.join(self.directory, view)
+        if not os.path.isdir(directory):
+            return []
+        return sorted(os.listdir(directory))
+
+    def test_sampled(self):
+        """asserts sampled requests are profiled per view"""
+        self.client.get('/api/user/preferences/')
+        self.assertEqual(self.profiles(), [])
+        with self.settings(PUGORUGH_PROFILE_SAMPLE_RATE=1.0):
+            response = self.client.get('/api/user/preferences/')
+        self.assertEqual(len(self.profiles()), 1)
+        self.assertNotIn('X-Profile', response)
+
+    def test_requested(self):
+        """asserts an allowlisted admin gets the requested profile"""
+        response = self.client.get('/api/user/preferences/',
+                                   HTTP_X_PROFILE='1')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Profile'],
+                         os.path.join('preferences', self.profiles()[0]))
+
+    def test_not_allowlisted(self):
+        """asserts the header is ignored for users not allowlisted"""
+        with self.settings(PUGORUGH_PROFILE_USERS=[]):
+            response = self.client.get('/api/user/preferences/',
+                                       HTTP_X_PROFILE='1')
+        self.assertNotIn('X-Profile', response)
+        self.assertEqual(self.profiles(), [])
+
+    def test_rotation(self):
+        """asserts only the newest PUGORUGH_PROFILE_KEEP files are kept"""
+        with self.settings(PUGORUGH_PROFILE_KEEP=2):
+            responses = [self.client.get('/api/user/preferences/',
+                                         HTTP_X_PROFILE='1')
+                         for _ in range(3)]
+        self.assertEqual(
+            self.profiles(), [os.path.basename(response['X-Profile'])
+                              for response in responses[1:]])
+
+    def test_profile_report(self):
+        """asserts the profiles of a view are merged and summarized"""
+        for _ in range(2):
+            self.client.get('/api/user/preferences/', HTTP_X_PROFILE='1')
+        stdout, stderr = io.StringIO(), io.StringIO()
+        call_command('profile_report', '--format', 'dot', stdout=stdout,
+                     stderr=stderr)
+        merged = os.path.join(self.directory, 'report', 'preferences.pstats')
+        self.assertTrue(os.path.isfile(merged))
+        self.assertIn('preferences (2 profiles)', stdout.getvalue())
+        self.assertIn('get_object', stdout.getvalue())
+
+
+class TestThreadPoolASGIHandler(TransactionTestCase):
+    """class encapsulates unittests for asgi.ThreadPoolASGIHandler
+
+    a transaction test case, requests are handled by connections of the
+    worker threads and must see committed rows
+
+    subclasses django.test TransactionTestCase
+
+    methods:
+        setUp, request, test_request_in_worker_thread, test_pool_bounded
+    """
+
+    def setUp(self):
+        """Creates a User with a Token and models.UserPref"""
+        self.user = User.objects.create(username='testuser',
+                                        password='password')
+        self.token = Token.objects.create(user=self.user)
+        models.UserPref.objects.create(user=self.user, age='b', gender='m',
+                                       size='s')
+        self.handler = ThreadPoolASGIHandler(max_workers=2)
+        self.addCleanup(self.handler.executor.shutdown)
+
+    def request(self, path):
+        """returns the (status, body) of a GET of path through the handler"""
+        scope = {
+            'type': 'http', 'method': 'GET', 'path': path,
+            'query_string': b'', 'server': ('testserver', 80),
+            'headers': [(
+                b'authorization', 'Token {}'.format(self.token).encode())],
+            }
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b''}
+
+        async def send(message):
+            messages.append(message)
+
+        asyncio.run(self.handler(scope, receive, send))
+        body = b''.join(message.get('body', b'') for message in messages
+                        if message['type'] == 'http.response.body')
+        return messages[0]['status'], body
+
+    def test_request_in_worker_thread(self):
+        """asserts the view runs in the pool and reads the database"""
+        status, body = self.request('/api/user/preferences/')
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body.decode())['age'], 'b')
+        self.assertTrue(all(thread.name.startswith('pugorugh-asgi')
+                            for thread in self.handler.executor._threads))
+
+    def test_pool_bounded(self):
+        """asserts no more than max_workers threads handle requests"""
+        for _ in range(4):
+            self.assertEqual(self.request('/api/user/preferences/')[0], 200)
+        self.assertLessEqual(len(self.handler.executor._threads), 2)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'SQLite pragmas')
+class TestSQLitePragmas(TestCase):
+    """class encapsulates unittests for signals.sqlite_pragmas_receiver
+
+    subclasses django.test TestCase
+
+    methods:
+        pragma, test_pragmas_applied, test_invalid_pragma
+    """
+
+    def pragma(self, name):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA {}'.format(name))
+            return cursor.fetchone()[0]
+
+    def test_pragmas_applied(self):
+        """asserts configured pragmas are set on a new connection"""
+        original = {name: self.pragma(name)
+                    for name in ('cache_size', 'busy_timeout')}
+        with self.settings(PUGORUGH_SQLITE_PRAGMAS={'cache_size': -1234,
+                                                    'busy_timeout': 2500}):
+            sqlite_pragmas_receiver(connection.__class__, connection)
+            self.assertEqual(self.pragma('cache_size'), -1234)
+            self.assertEqual(self.pragma('busy_timeout'), 2500)
+        with self.settings(PUGORUGH_SQLITE_PRAGMAS=original):
+            sqlite_pragmas_receiver(connection.__class__, connection)
+
+    def test_invalid_pragma(self):
+        """asserts pragma names and values are validated"""
+        with self.settings(PUGORUGH_SQLITE_PRAGMAS={
+                'cache_size': '1; DROP TABLE pugorugh_dog'}):
+            with self.assertRaises(ImproperlyConfigured):
+                sqlite_pragmas_receiver(connection.__class__, connection)
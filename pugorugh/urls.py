@@ -1,10 +1,12 @@
 from django.conf import settings
-from django.urls import include, path, register_converter
+from django.urls import include, path, re_path, register_converter
 from django.views.generic import TemplateView
 from django.views.generic.base import RedirectView
 from rest_framework.authtoken.views import obtain_auth_token
 
+from . import assets
 from . import converter
+from . import metrics
 from . import views
 
 register_converter(converter.StatusConverter, 'conv')
@@ -18,16 +20,32 @@ urlpatterns = [
         permanent=True
         )),
     path('', TemplateView.as_view(template_name='index.html')),
+    path('api/dog/statuses/', views.BulkUpdateStatus.as_view(),
+         name='bulk_update_status'),
+
     path('api/dog/<pk>/<conv:status>/', views.UpdateStatus.as_view(),
          name='update_status'),
 
     path('api/dog/<pk>/<conv:status>/next/', views.Dogs.as_view(),
          name='next_undecided'),
 
+    path('api/dog/<conv:status>/queue/', views.DogQueue.as_view(),
+         name='dog_queue'),
+
     path('api/user/preferences/', views.CreateUpdatePreference.as_view(),
-         name='preferences')
+         name='preferences'),
+
+    path('api/stats/', views.CacheStats.as_view(), name='cache_stats'),
+
+    path('metrics/', metrics.serve, name='metrics'),
     ]
 
+if settings.PUGORUGH_SERVE_STATIC:
+    urlpatterns += [
+        re_path(r'^{}(?P<path>.*)$'.format(settings.STATIC_URL.lstrip('/')),
+                assets.serve),
+        ]
+
 if settings.DEBUG:
     import debug_toolbar
 
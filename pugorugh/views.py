@@ -1,15 +1,34 @@
+from itertools import islice
+
 from django.contrib.auth import get_user_model
-from django.db.models.query_utils import Q
+from django.db import transaction
+from django.db.models import Exists, OuterRef
 from django.http import Http404
-from rest_framework import permissions
+from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from rest_framework import permissions, status
 from rest_framework.generics import (
     CreateAPIView,
-    GenericAPIView, RetrieveUpdateAPIView, UpdateAPIView,
+    GenericAPIView, ListAPIView, RetrieveUpdateAPIView, UpdateAPIView,
     )
 from rest_framework.mixins import RetrieveModelMixin, UpdateModelMixin
 from rest_framework.response import Response
+from rest_framework.views import APIView
 
+from . import images
 from . import models
+from . import pagination
+from .renderers import DOG_RENDERERS
+from .assets import manifest_version
+from .authentication import token_cache
+from .candidates import (
+    STATUS_WINDOW, CandidateQueue, candidate_sets, iter_with_status,
+    )
+from .catalog import dog_catalog
+from .converter import StatusConverter
+from .fragments import DogFragment, dog_fragments
+from .routers import read_from_replica, sharded
 from . import serializers
 
 
@@ -34,12 +53,95 @@ class UserRegisterView(CreateAPIView):
     serializer_class = serializers.UserSerializer
 
 
-class CreateUpdatePreference(RetrieveModelMixin, UpdateModelMixin,
+class ReplicaReadMixin:
+    """
+    Mixin routing the reads of safe (GET, HEAD, OPTIONS) requests to the
+    read replica, see routers.PugorughRouter
+
+    writes always go to the primary, so a read following a write of the
+    same client may briefly see replication lag
+
+    method overrides:
+            dispatch
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method not in permissions.SAFE_METHODS:
+            return super().dispatch(request, *args, **kwargs)
+        with read_from_replica():
+            return super().dispatch(request, *args, **kwargs)
+
+
+def dog_validators(dog):
+    """
+    returns the strong ETag and Last-Modified timestamp of a dog payload
+
+    the ETag changes with Dog.version, with the static manifest and with
+    the image derivative build, which the image URLs of the payload are
+    resolved from
+
+    :argument dog: Dog, DogFragment or a values() dict with id, version
+        and updated_at
+    :rtype: tuple
+    """
+    if isinstance(dog, (models.Dog, DogFragment)):
+        pk, version, updated_at = dog.pk, dog.version, dog.updated_at
+    else:
+        pk, version, updated_at = dog['id'], dog['version'], dog['updated_at']
+    return ('"dog-{}-{}-{}-{}"'.format(pk, version, manifest_version(),
+                                       images.build_version()),
+            updated_at.timestamp())
+
+
+class ConditionalGetMixin:
+    """
+    Mixin answering conditional GET requests of a versioned object
+
+    get_validators(obj) returns the strong ETag and Last-Modified timestamp
+    of obj, None for no Last-Modified. a GET or HEAD whose If-None-Match
+    (or, without it, If-Modified-Since) still matches is answered 304
+    before obj is serialized, every response carries the validators and
+    must be revalidated by clients
+
+    methods:
+            get_validators, set_validators, serialize, conditional_retrieve
+    """
+
+    def get_validators(self, obj):
+        raise NotImplementedError
+
+    def serialize(self, obj):
+        """returns the representation of obj"""
+        return self.get_serializer(obj).data
+
+    @staticmethod
+    def set_validators(response, validators):
+        """adds ETag, Last-Modified and Cache-Control to response"""
+        etag, last_modified = validators
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+    def conditional_retrieve(self, obj):
+        """returns a 304 when the client's copy of obj is current, else obj"""
+        validators = self.get_validators(obj)
+        response = get_conditional_response(
+            self.request, etag=validators[0], last_modified=validators[1])
+        if response is None:
+            response = Response(self.serialize(obj))
+        return self.set_validators(response, validators)
+
+
+class CreateUpdatePreference(ReplicaReadMixin, ConditionalGetMixin,
+                             RetrieveModelMixin, UpdateModelMixin,
                              GenericAPIView):
     """
     Class for retrieval, creation, update for 'api/user/preferences/'.
 
-    subclasses rest_framework.generics.CreateAPIView, RetrieveModelMixin,
+    subclasses ReplicaReadMixin, ConditionalGetMixin,
+    rest_framework.generics.CreateAPIView, RetrieveModelMixin,
     UpdateModelMixin
 
     Attr overrides:
@@ -51,6 +153,10 @@ class CreateUpdatePreference(RetrieveModelMixin, UpdateModelMixin,
     method overrides:
         get_object()
 
+        get_validators()
+
+        perform_update()
+
         See `DRF_GenericApiView <https://www.django-rest-framework.org/api
         -guide/ generic-views/#genericapiview>`_ for info
     """
@@ -74,65 +180,118 @@ class CreateUpdatePreference(RetrieveModelMixin, UpdateModelMixin,
         except models.UserPref.DoesNotExist:
             return models.UserPref.objects.create(user=user)
 
+    def get_validators(self, obj):
+        """returns the ETag and Last-Modified of the UserPref version"""
+        return ('"pref-{}-{}"'.format(obj.pk, obj.version),
+                obj.updated_at.timestamp())
+
     def get(self, request, *args, **kwargs):
         """
-            method that returns model instance of UserPref in response
+            method that returns model instance of UserPref in response,
+            304 when the client's If-None-Match is the current ETag
 
             See `DRF_RetrieveModelMixin <https://www.django-rest-framework.org/
             api-guide/generic-views/#retrievemodelmixin>`_ for info
         """
 
-        return self.retrieve(request, *args, **kwargs)
+        return self.conditional_retrieve(self.get_object())
+
+    def perform_update(self, serializer):
+        """saves the UserPref, kept for the validators of the response"""
+        serializer.save()
+        self.updated = serializer.instance
 
     def put(self, request, *args, **kwargs):
         """
-            implements updating and saving an UserPref model instance.
+            implements updating and saving an UserPref model instance,
+            the response carries the new ETag
 
             See `DRF_RetrieveModelMixin <https://www.django-rest-framework.org/
             api-guide/generic-views/#updatemodelmixin>`_ for info
         """
-        return self.update(request, *args, **kwargs)
+        response = self.update(request, *args, **kwargs)
+        return self.set_validators(response, self.get_validators(self.updated))
 
 
-class Dogs(RetrieveUpdateAPIView):
+class DogPreferenceMixin:
     """
-    Class for retrieval operations for 'api/dog/<pk>/<conv:status>/next/'.
+    Mixin filtering Dog objects by UserPref and the URL keyword status.
 
-    subclasses rest_framework.generics.RetrieveUpdateAPIView,
+    shared by the single dog `next` view and the batch queue view so both
+    use the same preference and status semantics
 
-    Attr overrides:
-            permission_classes
-
-            serializer_class
     method overrides:
             get_queryset
 
-            get_object
-
-    See `DRF_RetrieveUpdateAPIView <https://www.django-rest-framework.org/
-    api-guide/generic-views/#retrieveupdateapiview>`_ for info
+    methods:
+            status_bounds, status_ids, get_candidate_ids
     """
 
-    permission_classes = (permissions.IsAuthenticated,)
-    serializer_class = serializers.DogSerializer
+    def status_bounds(self):
+        """
+        returns (pk, limit, reverse): the ids get_queryset must hold when
+        UserDog is sharded, up to limit dogs following pk
+        """
+        raise NotImplementedError
+
+    def status_ids(self, pk, limit, reverse=False):
+        """
+        returns up to limit ids of the matching dogs following pk with the
+        URL keyword status, every one when limit is None
+
+        the user's status rows are read from their shard STATUS_WINDOW ids
+        at a time, see candidates.iter_with_status
+
+        :argument pk: id to start after, None to start with the first
+        :argument reverse: ids below pk in descending order
+        :rtype: list
+        """
+        user = self.request.user
+        preferences = models.UserPref.objects.get(user=user)
+        dogs = models.Dog.objects.filter(preferences.get_filter())
+
+        def window(after):
+            rows = dogs
+            if after is not None:
+                rows = rows.filter(**{'pk__lt' if reverse else 'pk__gt':
+                                      after})
+            return list(rows.order_by('-pk' if reverse else 'pk').values_list(
+                'pk', flat=True)[:STATUS_WINDOW])
+
+        def matching(ids):
+            return set(dogs.filter(pk__in=ids).values_list('pk', flat=True))
+
+        return list(islice(iter_with_status(
+            user.id, self.kwargs['status'], pk, window, matching, reverse),
+            limit))
 
     def get_queryset(self):
         """
         logic for initial filtration of QuerySet by UserPref attribute values
 
-        filters initial queryset by UserPref.age, UserPref.size, UserPref.gender
-        additional filters by URL keyword status
+        filters initial queryset by the UserPref age, size and gender masks
+        (see UserPref.get_filter), additional filters by URL keyword status
+
+        in UserDog.lazy_mode() undecided dogs are every dog without a
+        liked/disliked UserDog row for the user (anti-join)
+
+        when UserDog is sharded databases are never joined, the dogs are
+        filtered by the few ids of status_ids(*status_bounds()) read from
+        the user's shard
         """
         user = self.request.user
         preferences = models.UserPref.objects.get(user=user)
-        age = preferences.get_age_display()
-        gender = preferences.gender.split(',')
-        size = preferences.size.split(',')
         status = self.kwargs['status']
-        dogs = models.Dog.objects.filter(
-            Q(age__in=age) & Q(size__in=size) & Q(gender__in=gender))
+        dogs = models.Dog.objects.filter(preferences.get_filter())
+
+        if sharded():
+            return dogs.filter(pk__in=self.status_ids(*self.status_bounds()))
 
         if status == 'undecided':
+            if models.UserDog.lazy_mode():
+                decided = models.UserDog.objects.filter(
+                    user=user, dog=OuterRef('pk')).exclude(status='u')
+                return dogs.filter(~Exists(decided))
             return dogs.filter(user_dogs_query__status='u',
                                user_dogs_query__user=user)
         elif status == 'liked':
@@ -142,16 +301,203 @@ class Dogs(RetrieveUpdateAPIView):
             return dogs.filter(user_dogs_query__status='d',
                                user_dogs_query__user=user)
 
+    def get_candidate_ids(self):
+        """
+        returns the ordered ids of the dogs get_queryset would return
+
+        with dog_catalog.enabled() the preference filter is answered by the
+        columnar catalog, otherwise with candidate_sets.enabled() by the
+        shared set of the user's preference signature, both intersected
+        with the user's status rows
+        """
+        if dog_catalog.enabled():
+            preference = models.UserPref.objects.get(user=self.request.user)
+            return dog_catalog.candidates(
+                preference, self.kwargs['status']).tolist()
+        if candidate_sets.enabled():
+            preference = models.UserPref.objects.get(user=self.request.user)
+            return candidate_sets.candidates(preference, self.kwargs['status'])
+        if sharded():
+            return self.status_ids(None, None)
+        return list(self.get_queryset().order_by('pk').values_list(
+            'pk', flat=True))
+
+
+class Dogs(ReplicaReadMixin, ConditionalGetMixin, DogPreferenceMixin,
+           RetrieveUpdateAPIView):
+    """
+    Class for retrieval operations for 'api/dog/<pk>/<conv:status>/next/'.
+
+    subclasses ReplicaReadMixin, ConditionalGetMixin, DogPreferenceMixin,
+    rest_framework.generics.RetrieveUpdateAPIView
+
+    Attr overrides:
+            permission_classes
+
+            serializer_class
+
+            renderer_classes
+    method overrides:
+            status_bounds
+
+            get_object
+
+            get_validators
+
+            serialize
+
+            retrieve
+
+    dogs are answered with their DogFragment, rendered once per version
+    and held by dog_fragments, see get_fragment
+
+    with CandidateQueue.enabled() the next dog id is found in the user's
+    cached candidate queue instead of running the filtered join, otherwise
+    with dog_catalog.enabled() by a searchsorted over the columnar catalog
+    or with candidate_sets.enabled() in the user's shared candidate set
+
+    See `DRF_RetrieveUpdateAPIView <https://www.django-rest-framework.org/
+    api-guide/generic-views/#retrieveupdateapiview>`_ for info
+    """
+
+    permission_classes = (permissions.IsAuthenticated,)
+    serializer_class = serializers.DogSerializer
+    renderer_classes = DOG_RENDERERS
+
+    @staticmethod
+    def cached_candidates():
+        """True when the next dog id is found without the filtered join"""
+        return (CandidateQueue.enabled() or dog_catalog.enabled()
+                or candidate_sets.enabled())
+
+    def next_dog_id(self):
+        """
+        returns the id of the next dog from the cached candidates or raises
+        Http404
+        """
+        pk = int(self.kwargs['pk'])
+        status = self.kwargs['status']
+        if CandidateQueue.enabled():
+            queue = CandidateQueue(self.request.user.id, status)
+            dog_id = queue.next_after(pk, self.get_candidate_ids)
+        elif dog_catalog.enabled():
+            preference = models.UserPref.objects.get(user=self.request.user)
+            dog_id = dog_catalog.next_after(preference, status, pk)
+        else:
+            preference = models.UserPref.objects.get(user=self.request.user)
+            dog_id = candidate_sets.next_after(preference, status, pk)
+        if dog_id is None:
+            raise Http404
+        return dog_id
+
+    def status_bounds(self):
+        """the dog following the URL's 'pk' is the only one needed"""
+        return int(self.kwargs['pk']), 1, False
+
     def get_object(self):
         """returns Dog object or raises Http404 """
+        if self.cached_candidates():
+            return get_object_or_404(models.Dog, pk=self.next_dog_id())
+
         queryset = self.get_queryset()
 
         try:
-            dog = queryset.filter(pk__gt=self.kwargs["pk"])[0]
+            dog = queryset.filter(pk__gt=self.kwargs["pk"]).order_by('pk')[0]
             return dog
         except IndexError:
             raise Http404
 
+    def get_validators(self, obj):
+        """
+        returns the ETag of obj without Last-Modified, the next dog changes
+        with the user's statuses and its updated_at may well be older than
+        the previous answer's
+        """
+        return dog_validators(obj)[0], None
+
+    def serialize(self, obj):
+        """returns the DogFragment of obj, rendered only if not cached"""
+        if isinstance(obj, DogFragment):
+            return obj
+        return dog_fragments.render(obj)
+
+    def get_fragment(self):
+        """
+        returns the DogFragment of the next dog or raises Http404
+
+        with cached candidates and a shared catalog version the dog is not
+        read while its fragment is current, see DogFragments.fragment.
+        without dog_fragments.enabled() the Dog is returned unrendered,
+        serialize renders it only for a 200
+        """
+        if not dog_fragments.enabled():
+            return self.get_object()
+        if self.cached_candidates():
+            dog_id = self.next_dog_id()
+            return dog_fragments.fragment(
+                lambda: get_object_or_404(models.Dog, pk=dog_id), dog_id)
+        return dog_fragments.fragment(self.get_object)
+
+    def retrieve(self, request, *args, **kwargs):
+        """
+        returns the next dog, 304 when the client's If-None-Match is the
+        dog's current ETag
+        """
+        return self.conditional_retrieve(self.get_fragment())
+
+
+class DogQueue(ReplicaReadMixin, DogPreferenceMixin, ListAPIView):
+    """
+    Class for batch retrieval for 'api/dog/<conv:status>/queue/'.
+
+    returns up to `limit` dogs matching the user's preferences and status in
+    one keyset paginated query, plus an opaque `next` cursor so clients can
+    prefetch a queue of dogs instead of one round trip per swipe
+
+    subclasses ReplicaReadMixin, DogPreferenceMixin,
+    rest_framework.generics.ListAPIView
+
+    Attr overrides:
+            permission_classes
+
+            serializer_class
+
+            renderer_classes
+
+            pagination_class
+    method overrides:
+            status_bounds
+
+            list
+
+    See `DRF_CursorPagination <https://www.django-rest-framework.org/
+    api-guide/pagination/#cursorpagination>`_ for info
+    """
+    permission_classes = (permissions.IsAuthenticated,)
+    serializer_class = serializers.DogSerializer
+    renderer_classes = DOG_RENDERERS
+    pagination_class = pagination.DogCursorPagination
+
+    def status_bounds(self):
+        """the dogs of the requested page, one more tells of a next page"""
+        cursor = self.paginator.decode_cursor(self.request)
+        limit = self.paginator.get_page_size(self.request) + 1
+        if cursor is None:
+            return None, limit, False
+        pk = int(cursor.position) if cursor.position is not None else None
+        return pk, cursor.offset + limit, cursor.reverse
+
+    def list(self, request, *args, **kwargs):
+        """
+        pages values() rows of the matching dogs and represents them with
+        the DogSerializer.represent fast path, no Dog is instantiated
+        """
+        rows = self.filter_queryset(self.get_queryset()).values(
+            *self.serializer_class.MODEL_FIELDS)
+        page = self.paginate_queryset(rows)
+        return self.get_paginated_response(
+            [self.serializer_class.represent(row) for row in page])
+
 
 class UpdateStatus(UpdateAPIView):
     """
@@ -163,9 +509,9 @@ class UpdateStatus(UpdateAPIView):
             permission_classes
 
             serializer_class
-    method overrides:
-            get_queryset
 
+            renderer_classes
+    method overrides:
             get_object
 
             put
@@ -175,42 +521,142 @@ class UpdateStatus(UpdateAPIView):
     """
     permission_classes = (permissions.IsAuthenticated,)
     serializer_class = serializers.DogSerializer
-
-    def get_queryset(self):
-        """filter initial queryset returns all dogs related to request.user"""
-        user_id = self.request.user.id
-        dogs = models.Dog.objects.filter(user_dogs_query__user_id=user_id)
-        return dogs
+    renderer_classes = DOG_RENDERERS
 
     def get_object(self):
         """
-        Returns UserDog object to be updated.
+        returns the values() dict of the dog of the URL's 'pk', the fields
+        of its DogFragment, or raises Http404
+        """
+        dog = models.Dog.objects.filter(pk=self.kwargs['pk']).values(
+            *self.serializer_class.MODEL_FIELDS,
+            *models.Dog.VERSION_FIELDS).first()
+        if dog is None:
+            raise Http404
+        return dog
 
-        from queryset filter related UserDog keyword arguments 'pk'
-        passed by the URL
+    def put(self, request, *args, **kwargs):
+        """update UserDog.status object returns related serialized dog object
 
+        at most two statements: the dog payload is read by get_object,
+        unless its DogFragment is current, and the status is written with
+        UserDogManager.set_status, which skips unchanged rows
         """
-        queryset = self.get_queryset()
-        user = self.request.user
+        status_filter = self.kwargs['status']
         pk = self.kwargs['pk']
-        dog = queryset.filter(pk=pk).get().users_dog.select_related().filter(
-            user=user).get()
-        return dog
+        try:
+            dog_id = int(pk)
+        except ValueError:
+            dog_id = None
+        dog = dog_fragments.fragment(self.get_object, dog_id)
+
+        code = StatusConverter.STATUSES[status_filter]
+        models.UserDog.objects.set_status(request.user.id, dog.pk, code)
+        self.update_queue(dog.pk)
+        return ConditionalGetMixin.set_validators(Response(dog),
+                                                  dog_validators(dog))
+
+    def update_queue(self, dog_id):
+        """moves dog_id to the new status in the user's candidate queues"""
+        if CandidateQueue.enabled():
+            CandidateQueue.move(self.request.user.id, dog_id,
+                                self.kwargs['status'])
+
+
+class BulkUpdateStatus(APIView):
+    """
+    Class for batch status updates at 'api/dog/statuses/'.
+
+    accepts a list of {"id": <dog pk>, "status": <liked|disliked|undecided>}
+    items, e.g. swipes queued by an offline client, and applies them in one
+    transaction with one grouped UPDATE ... WHERE dog_id IN (...) per status.
+    when a dog appears more than once the last item wins.
+
+    responds with one result per item: "updated", "superseded",
+    "not_found" or "invalid" (with the validation errors)
+
+    subclasses rest_framework.views.APIView
+
+    Attr overrides:
+            permission_classes
+
+    Attr:
+            max_items
+                largest accepted batch
+    """
+    permission_classes = (permissions.IsAuthenticated,)
+    max_items = 500
 
     def put(self, request, *args, **kwargs):
-        """update UserDog.status object returns related serialized dog object"""
-        status_filter = self.kwargs['status']
-        dog = self.get_object()
-        serializer = self.serializer_class(dog.dog)
-        if status_filter == 'liked':
-            dog.status = 'l'
-            dog.save()
-        if status_filter == 'disliked':
-            dog.status = 'd'
-            dog.save()
-        if status_filter == 'undecided':
-            if dog.status != 'u':
-                dog.status = 'u'
-                dog.save()
-
-        return Response(serializer.data)
+        """validates the batch, applies it and returns per item results"""
+        items = request.data
+        if not isinstance(items, list):
+            return Response({'detail': 'Expected a list of items.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if len(items) > self.max_items:
+            return Response(
+                {'detail': 'At most {} items per batch.'.format(
+                    self.max_items)},
+                status=status.HTTP_400_BAD_REQUEST)
+
+        results = []
+        latest = {}
+        for item in items:
+            serializer = serializers.StatusUpdateSerializer(data=item)
+            if serializer.is_valid():
+                result = dict(serializer.validated_data)
+                latest[result['id']] = result
+            else:
+                raw = item if isinstance(item, dict) else {}
+                result = {'id': raw.get('id'), 'status': raw.get('status'),
+                          'result': 'invalid', 'errors': serializer.errors}
+            results.append(result)
+
+        rows = models.UserDog.objects.for_user(request.user.id)
+        with transaction.atomic(using=rows.db):
+            found = set(models.Dog.objects.filter(
+                pk__in=latest).values_list('pk', flat=True))
+            by_status = {}
+            for dog_id, result in latest.items():
+                if dog_id in found:
+                    by_status.setdefault(result['status'], []).append(dog_id)
+            for status_filter, dog_ids in by_status.items():
+                rows.set_many_status(
+                    request.user.id, dog_ids,
+                    StatusConverter.STATUSES[status_filter])
+
+        for result in results:
+            if 'result' in result:
+                continue
+            if latest[result['id']] is not result:
+                result['result'] = 'superseded'
+            elif result['id'] in found:
+                result['result'] = 'updated'
+            else:
+                result['result'] = 'not_found'
+
+        if CandidateQueue.enabled() and by_status:
+            CandidateQueue.invalidate_user(request.user.id)
+        return Response({'results': results})
+
+
+class CacheStats(APIView):
+    """
+    Class for admin retrieval of cache statistics at 'api/stats/'.
+
+    subclasses rest_framework.views.APIView
+
+    Attr overrides:
+            permission_classes
+    """
+    permission_classes = (permissions.IsAdminUser,)
+
+    def get(self, request, *args, **kwargs):
+        """returns hit/miss counters of the process local caches"""
+        return Response({
+            'candidate_queue': CandidateQueue.stats(),
+            'candidate_sets': candidate_sets.stats(),
+            'dog_catalog': dog_catalog.stats(),
+            'dog_fragments': dog_fragments.stats(),
+            'token_cache': token_cache.stats(),
+            })